@@ -0,0 +1,219 @@
+"""Cross-quarter trends and rankings
+
+analyze() returns hours, cash, material value, participants and event
+counts per quarter for a range of quarters: overall, per event type and per
+organization, with year-over-year change for the overall series. Each
+breakdown is one grouped query (the overall and per-type series come
+straight from the rollup tables), never one query per quarter. Top
+volunteers and organizations are ranked with window functions.
+
+Results are cached per (range, top, data versions), so a repeat request is
+served from memory until one of the tables it reads changes. Event-level
+queries read only the partitions (hot database or yearly archives) that
+hold the range.
+"""
+import os
+import re
+
+import archive
+import versions
+from cache import TTLCache
+
+QUARTER_RE = re.compile(r'^(\d{4})Q([1-4])$')
+
+DEFAULT_QUARTERS = 8
+MAX_QUARTERS = 40
+DEFAULT_TOP = 10
+MAX_TOP = 50
+
+METRICS = ('events', 'participants', 'hours', 'cash', 'material')
+
+# Everything analyze() reads, rollups included (they change with these tables)
+TABLES = ('event_profiles', 'contributions', 'event_types', 'organizations', 'volunteers')
+
+_cache = TTLCache(ttl=float(os.environ.get('ANALYTICS_CACHE_TTL', 300)), maxsize=256)
+
+
+def parse_quarter(text):
+    """(year, quarter) for '2024Q1', or None"""
+    match = QUARTER_RE.match(text or '')
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+
+def _index(year, quarter):
+    return year * 4 + quarter - 1
+
+
+def _name(index):
+    return f'{index // 4}Q{index % 4 + 1}'
+
+
+def resolve_range(cursor, start=None, end=None):
+    """Validated (start, end) quarter names; missing ends default to the
+    latest DEFAULT_QUARTERS quarters with data. Raises ValueError."""
+    if not end:
+        cursor.execute('SELECT year, quarter FROM quarterly_summaries ORDER BY year DESC, quarter DESC LIMIT 1')
+        row = cursor.fetchone()
+        end = f"{row['year']}Q{row['quarter']}" if row else None
+    if end is None:
+        return None, None
+    parsed_end = parse_quarter(end)
+    if parsed_end is None:
+        raise ValueError('Quarters must look like 2024Q1')
+    if not start:
+        start = _name(_index(*parsed_end) - DEFAULT_QUARTERS + 1)
+    parsed_start = parse_quarter(start)
+    if parsed_start is None:
+        raise ValueError('Quarters must look like 2024Q1')
+    if parsed_start > parsed_end:
+        start, end = end, start
+    if _index(*parse_quarter(end)) - _index(*parse_quarter(start)) + 1 > MAX_QUARTERS:
+        raise ValueError(f'A range covers at most {MAX_QUARTERS} quarters')
+    return start, end
+
+
+def _bucket(row):
+    return {metric: row[metric] or 0 for metric in METRICS}
+
+
+def _change(current, previous):
+    if not previous:
+        return None
+    return round((current - previous) / previous * 100, 1)
+
+
+def _totals(cursor, first, last):
+    cursor.execute('''
+        SELECT year, quarter, total_events as events, total_participants as participants,
+               total_volunteer_hours as hours, total_cash_donations as cash,
+               total_material_value as material
+        FROM quarterly_summaries
+        WHERE (year, quarter) BETWEEN (?, ?) AND (?, ?)
+    ''', (first // 4, first % 4 + 1, last // 4, last % 4 + 1))
+    return {_index(row['year'], row['quarter']): _bucket(row) for row in cursor.fetchall()}
+
+
+def _grouped(rows, quarters):
+    """[(key, name, quarter, bucket)] -> per-key series over every quarter"""
+    zero = dict.fromkeys(METRICS, 0)
+    groups = {}
+    for key, name, quarter, bucket in rows:
+        group = groups.setdefault(key, {'id': key, 'name': name, 'buckets': {}})
+        group['buckets'][quarter] = bucket
+    result = []
+    for group in groups.values():
+        series = [dict(group['buckets'].get(q, zero), quarter=q) for q in quarters]
+        total = {metric: sum(b[metric] for b in series) for metric in METRICS}
+        result.append({'id': group['id'], 'name': group['name'], 'series': series, 'total': total})
+    result.sort(key=lambda g: (-g['total']['hours'], g['name'] or ''))
+    return result
+
+
+def _by_type(cursor, start, end):
+    (ys, qs), (ye, qe) = parse_quarter(start), parse_quarter(end)
+    cursor.execute('''
+        SELECT qts.year, qts.quarter, qts.event_type_id, et.name,
+               qts.total_events as events, qts.total_participants as participants,
+               qts.total_volunteer_hours as hours, qts.total_cash_donations as cash,
+               qts.total_material_value as material
+        FROM quarterly_type_summaries qts
+        LEFT JOIN event_types et ON et.id = qts.event_type_id
+        WHERE (qts.year, qts.quarter) BETWEEN (?, ?) AND (?, ?)
+    ''', (ys, qs, ye, qe))
+    return [(row['event_type_id'] or None, row['name'] or 'Uncategorized',
+             f"{row['year']}Q{row['quarter']}", _bucket(row)) for row in cursor.fetchall()]
+
+
+# The range's events in every partition holding them
+_EVENTS_SQL = '''
+    SELECT quarter, organization_id, actual_participants, total_hours, total_cash, total_material
+    FROM {s}.event_profiles WHERE quarter BETWEEN ? AND ?
+'''
+
+
+def _by_organization(cursor, start, end):
+    # Events carry their contribution totals, so this is one pass over the range
+    events, params = archive.union(cursor, _EVENTS_SQL, (start, end), start, end)
+    cursor.execute(f'''
+        SELECT ep.quarter, ep.organization_id, o.name,
+               COUNT(*) as events, SUM(ep.actual_participants) as participants,
+               SUM(ep.total_hours) as hours, SUM(ep.total_cash) as cash,
+               SUM(ep.total_material) as material
+        FROM ({events}) ep
+        LEFT JOIN organizations o ON o.id = ep.organization_id
+        GROUP BY ep.quarter, ep.organization_id
+    ''', params)
+    return [(row['organization_id'], row['name'] or 'No organization', row['quarter'], _bucket(row))
+            for row in cursor.fetchall()]
+
+
+def rankings(cursor, start, end, top=DEFAULT_TOP):
+    """Top volunteers by hours and organizations by donated value in the range"""
+    contributions, params = archive.union(cursor, '''
+        SELECT c.volunteer_id, c.volunteer_hours, c.cash_donation, c.material_value
+        FROM {s}.contributions c
+        JOIN {s}.event_profiles ep ON ep.id = c.event_id
+        WHERE ep.quarter BETWEEN ? AND ?
+    ''', (start, end), start, end)
+    cursor.execute(f'''
+        SELECT * FROM (
+            SELECT v.id, v.name, SUM(c.volunteer_hours) as hours,
+                   SUM(c.cash_donation) + SUM(c.material_value) as value,
+                   COUNT(*) as contributions,
+                   RANK() OVER (ORDER BY SUM(c.volunteer_hours) DESC) as rank
+            FROM ({contributions}) c
+            JOIN volunteers v ON v.id = c.volunteer_id
+            GROUP BY v.id
+        ) WHERE rank <= ? ORDER BY rank, name
+    ''', params + [top])
+    volunteers = [dict(row) for row in cursor.fetchall()]
+    events, params = archive.union(cursor, _EVENTS_SQL, (start, end), start, end)
+    cursor.execute(f'''
+        SELECT * FROM (
+            SELECT o.id, o.name, SUM(ep.total_cash) + SUM(ep.total_material) as value,
+                   SUM(ep.total_hours) as hours, COUNT(*) as events,
+                   RANK() OVER (ORDER BY SUM(ep.total_cash) + SUM(ep.total_material) DESC) as rank
+            FROM ({events}) ep
+            JOIN organizations o ON o.id = ep.organization_id
+            GROUP BY o.id
+        ) WHERE rank <= ? ORDER BY rank, name
+    ''', params + [top])
+    return {'volunteers': volunteers, 'organizations': [dict(row) for row in cursor.fetchall()]}
+
+
+def _compute(cursor, start, end, top):
+    first, last = _index(*parse_quarter(start)), _index(*parse_quarter(end))
+    quarters = [_name(i) for i in range(first, last + 1)]
+    # One year earlier too, for the year-over-year column
+    totals = _totals(cursor, first - 4, last)
+    zero = dict.fromkeys(METRICS, 0)
+    series = []
+    for i in range(first, last + 1):
+        bucket = totals.get(i, zero)
+        previous = totals.get(i - 4, zero)
+        series.append(dict(bucket, quarter=_name(i),
+                           yoy={metric: _change(bucket[metric], previous[metric]) for metric in METRICS}))
+    return {
+        'start': start,
+        'end': end,
+        'quarters': quarters,
+        'totals': series,
+        'by_type': _grouped(_by_type(cursor, start, end), quarters),
+        'by_organization': _grouped(_by_organization(cursor, start, end), quarters),
+        'rankings': rankings(cursor, start, end, top),
+    }
+
+
+def analyze(cursor, start=None, end=None, top=DEFAULT_TOP):
+    """Trends and rankings for start..end (see resolve_range); None without data"""
+    start, end = resolve_range(cursor, start, end)
+    if start is None:
+        return None
+    top = max(1, min(top or DEFAULT_TOP, MAX_TOP))
+    current = versions.get_versions(cursor, TABLES)
+    key = (start, end, top, tuple(sorted(current.items())))
+    return _cache.get_or_compute(key, lambda: _compute(cursor, start, end, top))
+
+
+def cache_stats():
+    return _cache.stats()
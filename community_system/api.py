@@ -0,0 +1,153 @@
+"""JSON API (/api/v1) over the same data as the HTML pages
+
+Every response carries an ETag built from the data_versions counters of
+the tables it reads, so a client repeating a request with If-None-Match
+gets 304 Not Modified after one tiny lookup, without the route's queries.
+
+List endpoints take ?limit= and return a `next` cursor; every endpoint
+takes ?fields=a,b to return only those fields of each item.
+"""
+import re
+from functools import wraps
+
+from flask import Blueprint, jsonify, request, make_response, url_for
+
+import analytics
+import queries
+import readpool
+import versions
+from database import get_db
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+QUARTER_RE = re.compile(r'^\d{4}Q[1-4]$')
+
+
+def conditional(*tables):
+    """Serve 304 when the client's ETag still matches the tables' versions"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            tag = versions.etag(get_db().cursor(), tables, request.full_path)
+            if request.if_none_match.contains_weak(tag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(tag)
+            # Clients may keep the body but must revalidate before reusing it
+            response.headers['Cache-Control'] = 'no-cache'
+            return response
+        return wrapper
+    return decorator
+
+
+def select_fields(row):
+    """Row as a dict, limited to ?fields= when given"""
+    item = dict(row)
+    fields = request.args.get('fields')
+    if not fields:
+        return item
+    wanted = {f.strip() for f in fields.split(',')}
+    return {key: value for key, value in item.items() if key in wanted}
+
+
+def not_found(message):
+    return jsonify(error=message), 404
+
+
+@api.route('/dashboard')
+@conditional('event_profiles', 'contributions', 'event_types')
+def dashboard():
+    result = queries.dashboard(get_db().cursor())
+    result['recent_events'] = [select_fields(r) for r in result['recent_events']]
+    return jsonify(result)
+
+
+@api.route('/events')
+@conditional('event_profiles', 'event_types', 'organizations')
+def events():
+    filters = {field: request.args[field] for field in queries.EVENT_FILTERS if request.args.get(field)}
+    limit = queries.clamp_page_size(request.args.get('limit', type=int))
+    rows, next_cursor = readpool.run('list', queries.event_page, filters, limit,
+                                     request.args.get('after_date'),
+                                     request.args.get('after_id', type=int))
+    next_url = None
+    if next_cursor:
+        next_url = url_for('api.events', **filters, limit=limit, fields=request.args.get('fields'),
+                           after_date=next_cursor[0], after_id=next_cursor[1])
+    return jsonify(items=[select_fields(r) for r in rows], next=next_url)
+
+
+@api.route('/events/<int:event_id>')
+@conditional('event_profiles', 'contributions', 'event_types', 'organizations')
+def event(event_id):
+    cursor = get_db().cursor()
+    row = queries.get_event(cursor, event_id)
+    if not row:
+        return not_found('Event not found')
+    return jsonify(event=select_fields(row),
+                   contributions=[dict(c) for c in queries.event_contributions(cursor, event_id, row['archived_year'])],
+                   summary=queries.totals_of(row))
+
+
+@api.route('/volunteers')
+@conditional('volunteers', 'contributions')
+def volunteers():
+    limit = queries.clamp_page_size(request.args.get('limit', type=int))
+    rows, next_cursor = readpool.run('list', queries.volunteer_page, limit,
+                                     request.args.get('after_name'),
+                                     request.args.get('after_id', type=int))
+    next_url = None
+    if next_cursor:
+        next_url = url_for('api.volunteers', limit=limit, fields=request.args.get('fields'),
+                           after_name=next_cursor[0], after_id=next_cursor[1])
+    return jsonify(items=[select_fields(r) for r in rows], next=next_url)
+
+
+@api.route('/volunteers/<int:vol_id>')
+@conditional('volunteers', 'contributions', 'event_profiles')
+def volunteer(vol_id):
+    cursor = get_db().cursor()
+    row = queries.get_volunteer(cursor, vol_id)
+    if not row:
+        return not_found('Volunteer not found')
+    return jsonify(volunteer=select_fields(row),
+                   contributions=[dict(c) for c in queries.volunteer_contributions(cursor, vol_id)],
+                   totals=queries.totals_of(row))
+
+
+@api.route('/reports')
+@conditional('event_profiles', 'contributions')
+def reports():
+    cursor = get_db().cursor()
+    cursor.execute('''
+        SELECT year, quarter, total_events, total_participants, total_volunteer_hours,
+               total_cash_donations, total_material_value
+        FROM quarterly_summaries ORDER BY year DESC, quarter DESC
+    ''')
+    items = [dict(select_fields(r), name=f"{r['year']}Q{r['quarter']}") for r in cursor.fetchall()]
+    return jsonify(items=items)
+
+
+@api.route('/reports/<quarter>')
+@conditional('event_profiles', 'contributions', 'event_types')
+def report(quarter):
+    if not QUARTER_RE.match(quarter):
+        return not_found('Quarter must look like 2024Q1')
+    report = readpool.run('report', queries.quarter_report, quarter)
+    report['events'] = [select_fields(r) for r in report['events']]
+    report['by_type'] = [dict(r) for r in report['by_type']]
+    return jsonify(report)
+
+
+@api.route('/analytics')
+@conditional(*analytics.TABLES)
+def trends():
+    try:
+        result = readpool.run('analytics', analytics.analyze, request.args.get('start'),
+                              request.args.get('end'), request.args.get('top', type=int))
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(result or {'quarters': []})
@@ -1,61 +1,102 @@
 """Flask main application"""
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify
-from database import get_db, init_db, calculate_quarter
+from flask import (Flask, render_template, request, redirect, url_for, flash, jsonify,
+                   abort, Response, send_file, stream_with_context)
+from database import get_db, ensure_schema, init_app, calculate_quarter, pool, transaction
+from cache import TTLCache
 from datetime import datetime
+from jinja2 import FileSystemBytecodeCache
+import os
+import shutil
+import sqlite3
+import tempfile
+import analytics
+import archive
+import changefeed
+import contribution_writes
+import exports
+import identity
+import importer
+import jobs
+import json
+from api import api
+from assets import init_assets
+from compression import init_compression
+from instrumentation import init_instrumentation
+import pagecache
+import queries
+import readpool
+from refdata import reference
+import rollups
+import search
+import volunteer_index
 
 app = Flask(__name__)
 app.secret_key = 'community_system_secret_key'
+# Templates still compile on first use, but a new worker loads the compiled
+# bytecode from disk instead of parsing each template again
+app.jinja_options = {**app.jinja_options,
+                     'bytecode_cache': FileSystemBytecodeCache(os.environ.get('JINJA_CACHE_DIR'))}
+init_app(app)
+app.register_blueprint(api)
+init_assets(app)
+# Registered first so it runs after every other after_request hook
+init_compression(app)
+init_instrumentation(app)
+
+def get_page_size():
+    """Page size requested via ?limit=, bounded to 1..queries.MAX_PAGE_SIZE"""
+    return queries.clamp_page_size(request.args.get('limit', type=int))
+
+# Dashboard figures; cleared by every write to event_profiles or contributions
+dashboard_cache = TTLCache(ttl=float(os.environ.get('DASHBOARD_CACHE_TTL', 30)))
+
+def queue_identity_run(full=False):
+    """Match orphan contributions to volunteers shortly (batched, see identity.py)"""
+    jobs.submit(get_db(), 'resolve_identities', {'full': True} if full else None, debounce=identity.BATCH_SECONDS)
+
+READ_ONLY_EVENT = 'This event belongs to a closed quarter and is read-only'
+
+def reject_archived_event(cursor, event_id):
+    """A redirect to the event with an error if it is archived, else None"""
+    if archive.archived_event(cursor, event_id) is not None:
+        flash(READ_ONLY_EVENT, 'error')
+        return redirect(url_for('view_event', event_id=event_id))
+    return None
+
+def load_dashboard():
+    """Dashboard totals and recent events"""
+    return queries.dashboard(get_db().cursor())
 
 @app.route('/')
 def index():
     """Dashboard"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT COUNT(*) FROM event_profiles')
-    total_events = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COALESCE(SUM(volunteer_hours), 0) FROM contributions')
-    total_hours = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COALESCE(SUM(cash_donation), 0) FROM contributions')
-    total_cash = cursor.fetchone()[0]
-    
-    cursor.execute('SELECT COALESCE(SUM(material_value), 0) FROM contributions')
-    total_material = cursor.fetchone()[0]
-    
-    cursor.execute('''
-        SELECT ep.*, et.name as event_type_name 
-        FROM event_profiles ep 
-        LEFT JOIN event_types et ON ep.event_type_id = et.id 
-        ORDER BY ep.event_date DESC LIMIT 5
-    ''')
-    recent_events = cursor.fetchall()
-    
-    conn.close()
-    
-    return render_template('index.html', 
-                         total_events=total_events,
-                         total_hours=total_hours,
-                         total_cash=total_cash,
-                         total_material=total_material,
-                         recent_events=recent_events)
+    dashboard = dashboard_cache.get_or_compute('dashboard', load_dashboard)
+    return render_template('index.html', **dashboard)
 
 @app.route('/events')
 def event_list():
-    """Event list"""
+    """Event list, newest first, one keyset page at a time"""
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('''
-        SELECT ep.*, et.name as event_type_name, o.name as org_name
-        FROM event_profiles ep 
-        LEFT JOIN event_types et ON ep.event_type_id = et.id 
-        LEFT JOIN organizations o ON ep.organization_id = o.id
-        ORDER BY ep.event_date DESC
-    ''')
-    events = cursor.fetchall()
-    conn.close()
-    return render_template('event_list.html', events=events)
+    limit = get_page_size()
+    filters = {field: request.args[field] for field in queries.EVENT_FILTERS if request.args.get(field)}
+    
+    # Cursor is the (event_date, id) of the last row on the previous page
+    after_id = request.args.get('after_id', type=int)
+    events, next_cursor = readpool.run('list', queries.event_page, filters, limit,
+                                       request.args.get('after_date'), after_id)
+    next_page = None
+    if next_cursor:
+        next_page = dict(filters, limit=limit, after_date=next_cursor[0], after_id=next_cursor[1])
+    
+    # Filter choices come from small tables, never from a scan of events
+    quarters = queries.quarters(cursor)
+    event_types = reference.event_types(cursor)
+    organizations = reference.organizations(cursor)
+    
+    return render_template('event_list.html', events=events, filters=filters,
+                         next_page=next_page, is_first_page=after_id is None,
+                         quarters=quarters, event_types=event_types, organizations=organizations)
 
 @app.route('/events/add', methods=['GET', 'POST'])
 def add_event():
@@ -66,79 +107,68 @@ def add_event():
     if request.method == 'POST':
         event_date = request.form['event_date']
         quarter = calculate_quarter(event_date)
+        if archive.is_closed(cursor, quarter):
+            flash(f'{quarter} is closed and archived; events cannot be added to it', 'error')
+            return redirect(url_for('add_event'))
         
-        cursor.execute('''
-            INSERT INTO event_profiles 
-            (event_name, event_date, event_type_id, location, description,
-             organization_id, coordinator_name, coordinator_phone, coordinator_email,
-             expected_participants, actual_participants, income, expense, notes, status, quarter)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (
-            request.form['event_name'],
-            event_date,
-            request.form.get('event_type_id') or None,
-            request.form.get('location'),
-            request.form.get('description'),
-            request.form.get('organization_id') or None,
-            request.form.get('coordinator_name'),
-            request.form.get('coordinator_phone'),
-            request.form.get('coordinator_email'),
-            request.form.get('expected_participants') or 0,
-            request.form.get('actual_participants') or 0,
-            request.form.get('income') or 0,
-            request.form.get('expense') or 0,
-            request.form.get('notes'),
-            request.form.get('status', 'In Progress'),
-            quarter
-        ))
-        event_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        try:
+            with transaction(conn):
+                cursor.execute('''
+                    INSERT INTO event_profiles 
+                    (event_name, event_date, event_type_id, location, description,
+                     organization_id, coordinator_name, coordinator_phone, coordinator_email,
+                     expected_participants, actual_participants, income, expense, notes, status, quarter)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (
+                    request.form['event_name'],
+                    event_date,
+                    request.form.get('event_type_id') or None,
+                    request.form.get('location'),
+                    request.form.get('description'),
+                    request.form.get('organization_id') or None,
+                    request.form.get('coordinator_name'),
+                    request.form.get('coordinator_phone'),
+                    request.form.get('coordinator_email'),
+                    request.form.get('expected_participants') or 0,
+                    request.form.get('actual_participants') or 0,
+                    request.form.get('income') or 0,
+                    request.form.get('expense') or 0,
+                    request.form.get('notes'),
+                    request.form.get('status', 'In Progress'),
+                    quarter
+                ))
+                event_id = cursor.lastrowid
+                rollups.add_event(cursor, event_id)
+                changefeed.publish_event(cursor, 'event.added', event_id)
+        except sqlite3.IntegrityError:
+            # The chosen type or organization was deleted after the form loaded
+            flash('That event type or organization no longer exists', 'error')
+            return redirect(url_for('add_event'))
+        dashboard_cache.clear()
         
         flash('Event added successfully!', 'success')
         return redirect(url_for('edit_event', event_id=event_id))
     
-    cursor.execute('SELECT * FROM event_types')
-    event_types = cursor.fetchall()
-    cursor.execute('SELECT * FROM organizations ORDER BY name')
-    organizations = cursor.fetchall()
-    conn.close()
-    
-    return render_template('add_event.html', event_types=event_types, organizations=organizations)
+    return render_template('add_event.html', event_types=reference.event_types(cursor),
+                         organizations=reference.organizations(cursor))
 
 
 @app.route('/events/<int:event_id>')
 def view_event(event_id):
     """View event details"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT ep.*, et.name as event_type_name, o.name as org_name
-        FROM event_profiles ep 
-        LEFT JOIN event_types et ON ep.event_type_id = et.id 
-        LEFT JOIN organizations o ON ep.organization_id = o.id
-        WHERE ep.id = ?
-    ''', (event_id,))
-    event = cursor.fetchone()
-    
-    if not event:
-        flash('Event not found', 'error')
-        return redirect(url_for('event_list'))
-    
-    cursor.execute('SELECT * FROM contributions WHERE event_id = ?', (event_id,))
-    contributions = cursor.fetchall()
-    
-    cursor.execute('''
-        SELECT COALESCE(SUM(volunteer_hours), 0) as total_hours,
-               COALESCE(SUM(cash_donation), 0) as total_cash,
-               COALESCE(SUM(material_value), 0) as total_material
-        FROM contributions WHERE event_id = ?
-    ''', (event_id,))
-    summary = cursor.fetchone()
-    
-    conn.close()
-    return render_template('view_event.html', event=event, contributions=contributions, summary=summary)
+    cursor = get_db().cursor()
+    
+    def render():
+        event = queries.get_event(cursor, event_id)
+        if not event:
+            flash('Event not found', 'error')
+            return redirect(url_for('event_list'))
+        contributions = queries.event_contributions(cursor, event_id, event['archived_year'])
+        # The event row carries its running totals
+        return render_template('view_event.html', event=event, contributions=contributions, summary=event)
+    
+    return pagecache.cached(cursor, 'view_event', event_id, ('event', event_id),
+                            ('event_types', 'organizations'), render)
 
 @app.route('/events/<int:event_id>/edit', methods=['GET', 'POST'])
 def edit_event(event_id):
@@ -149,59 +179,79 @@ def edit_event(event_id):
     if request.method == 'POST':
         event_date = request.form['event_date']
         quarter = calculate_quarter(event_date)
+        if archive.is_closed(cursor, quarter):
+            flash(f'{quarter} is closed and archived; events cannot be moved into it', 'error')
+            return redirect(url_for('edit_event', event_id=event_id))
+        rejected = reject_archived_event(cursor, event_id)
+        if rejected:
+            return rejected
         
-        cursor.execute('''
-            UPDATE event_profiles SET
-            event_name=?, event_date=?, event_type_id=?, location=?, description=?,
-            organization_id=?, coordinator_name=?, coordinator_phone=?, coordinator_email=?,
-            expected_participants=?, actual_participants=?, income=?, expense=?, notes=?, status=?, quarter=?
-            WHERE id=?
-        ''', (
-            request.form['event_name'],
-            event_date,
-            request.form.get('event_type_id') or None,
-            request.form.get('location'),
-            request.form.get('description'),
-            request.form.get('organization_id') or None,
-            request.form.get('coordinator_name'),
-            request.form.get('coordinator_phone'),
-            request.form.get('coordinator_email'),
-            request.form.get('expected_participants') or 0,
-            request.form.get('actual_participants') or 0,
-            request.form.get('income') or 0,
-            request.form.get('expense') or 0,
-            request.form.get('notes'),
-            request.form.get('status', 'In Progress'),
-            quarter,
-            event_id
-        ))
-        conn.commit()
+        try:
+            with transaction(conn):
+                rollups.remove_event(cursor, event_id)
+                cursor.execute('''
+                    UPDATE event_profiles SET
+                    event_name=?, event_date=?, event_type_id=?, location=?, description=?,
+                    organization_id=?, coordinator_name=?, coordinator_phone=?, coordinator_email=?,
+                    expected_participants=?, actual_participants=?, income=?, expense=?, notes=?, status=?, quarter=?
+                    WHERE id=?
+                ''', (
+                    request.form['event_name'],
+                    event_date,
+                    request.form.get('event_type_id') or None,
+                    request.form.get('location'),
+                    request.form.get('description'),
+                    request.form.get('organization_id') or None,
+                    request.form.get('coordinator_name'),
+                    request.form.get('coordinator_phone'),
+                    request.form.get('coordinator_email'),
+                    request.form.get('expected_participants') or 0,
+                    request.form.get('actual_participants') or 0,
+                    request.form.get('income') or 0,
+                    request.form.get('expense') or 0,
+                    request.form.get('notes'),
+                    request.form.get('status', 'In Progress'),
+                    quarter,
+                    event_id
+                ))
+                rollups.add_event(cursor, event_id)
+                changefeed.publish_event(cursor, 'event.updated', event_id)
+        except sqlite3.IntegrityError:
+            flash('That event type or organization no longer exists', 'error')
+            return redirect(url_for('edit_event', event_id=event_id))
+        dashboard_cache.clear()
         flash('Event updated successfully!', 'success')
+        # Post/Redirect/Get: the form is re-rendered by a fresh GET
+        return redirect(url_for('edit_event', event_id=event_id))
     
     cursor.execute('SELECT * FROM event_profiles WHERE id = ?', (event_id,))
     event = cursor.fetchone()
-    cursor.execute('SELECT * FROM event_types')
-    event_types = cursor.fetchall()
-    cursor.execute('SELECT * FROM organizations ORDER BY name')
-    organizations = cursor.fetchall()
-    cursor.execute('SELECT * FROM contributions WHERE event_id = ?', (event_id,))
-    contributions = cursor.fetchall()
-    cursor.execute('SELECT * FROM volunteers ORDER BY name')
-    volunteers = cursor.fetchall()
+    if not event:
+        # Archived events are still viewable, just not editable
+        if queries.get_event(cursor, event_id):
+            flash(READ_ONLY_EVENT, 'error')
+            return redirect(url_for('view_event', event_id=event_id))
+        flash('Event not found', 'error')
+        return redirect(url_for('event_list'))
+    contributions = queries.event_contributions(cursor, event_id)
     
-    conn.close()
-    return render_template('edit_event.html', event=event, event_types=event_types, 
-                         organizations=organizations, contributions=contributions, volunteers=volunteers)
+    return render_template('edit_event.html', event=event, event_types=reference.event_types(cursor), 
+                         organizations=reference.organizations(cursor), contributions=contributions)
 
 @app.route('/events/<int:event_id>/delete', methods=['POST'])
 def delete_event(event_id):
     """Delete event"""
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('DELETE FROM contributions WHERE event_id = ?', (event_id,))
-    cursor.execute('DELETE FROM event_profiles WHERE id = ?', (event_id,))
-    conn.commit()
-    conn.close()
+    rejected = reject_archived_event(cursor, event_id)
+    if rejected:
+        return rejected
+    with transaction(conn):
+        rollups.remove_event(cursor, event_id)
+        cursor.execute('DELETE FROM contributions WHERE event_id = ?', (event_id,))
+        cursor.execute('DELETE FROM event_profiles WHERE id = ?', (event_id,))
+        changefeed.publish(cursor, 'event.deleted', {'id': event_id})
+    dashboard_cache.clear()
     flash('Event deleted', 'success')
     return redirect(url_for('event_list'))
 
@@ -211,6 +261,9 @@ def add_contribution(event_id):
     conn = get_db()
     cursor = conn.cursor()
     
+    rejected = reject_archived_event(cursor, event_id)
+    if rejected:
+        return rejected
     volunteer_id = request.form.get('volunteer_id') or None
     volunteer_name = request.form['volunteer_name']
     volunteer_contact = request.form.get('volunteer_contact')
@@ -222,22 +275,25 @@ def add_contribution(event_id):
         if vol:
             volunteer_name = vol['name']
     
-    cursor.execute('''
-        INSERT INTO contributions (event_id, volunteer_id, volunteer_name, volunteer_contact, 
-                                   volunteer_hours, cash_donation, material_description, material_value)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
-        event_id,
-        volunteer_id,
-        volunteer_name,
-        volunteer_contact,
-        request.form.get('volunteer_hours') or 0,
-        request.form.get('cash_donation') or 0,
-        request.form.get('material_description'),
-        request.form.get('material_value') or 0
-    ))
-    conn.commit()
-    conn.close()
+    # Committed on return (batched with concurrent inserts in group-commit mode)
+    try:
+        contribution_writes.add(conn, (
+            event_id,
+            volunteer_id,
+            volunteer_name,
+            volunteer_contact,
+            request.form.get('volunteer_hours') or 0,
+            request.form.get('cash_donation') or 0,
+            request.form.get('material_description'),
+            request.form.get('material_value') or 0
+        ))
+    except sqlite3.IntegrityError:
+        # The event or the chosen volunteer was deleted after the form loaded
+        flash('That event or volunteer no longer exists', 'error')
+        return redirect(url_for('edit_event', event_id=event_id))
+    if not volunteer_id:
+        queue_identity_run()
+    dashboard_cache.clear()
     flash('Contribution added successfully!', 'success')
     return redirect(url_for('edit_event', event_id=event_id))
 
@@ -246,12 +302,18 @@ def delete_contribution(contribution_id):
     """Delete contribution"""
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('SELECT event_id FROM contributions WHERE id = ?', (contribution_id,))
-    result = cursor.fetchone()
-    event_id = result['event_id'] if result else None
-    cursor.execute('DELETE FROM contributions WHERE id = ?', (contribution_id,))
-    conn.commit()
-    conn.close()
+    with transaction(conn):
+        cursor.execute('SELECT event_id FROM contributions WHERE id = ?', (contribution_id,))
+        result = cursor.fetchone()
+        if result is None:
+            # Archived contributions are only in their year's read-only archive
+            flash('That contribution is archived or no longer exists', 'error')
+            return redirect(request.referrer or url_for('event_list'))
+        event_id = result['event_id']
+        rollups.remove_contribution(cursor, contribution_id)
+        cursor.execute('DELETE FROM contributions WHERE id = ?', (contribution_id,))
+        changefeed.publish(cursor, 'contribution.deleted', {'id': contribution_id, 'event_id': event_id})
+    dashboard_cache.clear()
     flash('Contribution deleted', 'success')
     return redirect(url_for('edit_event', event_id=event_id))
 
@@ -259,118 +321,139 @@ def delete_contribution(contribution_id):
 # ========== Volunteers (Individual Accounts) ==========
 @app.route('/volunteers')
 def volunteer_list():
-    """Volunteer list"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('''
-        SELECT v.*, 
-               COALESCE(SUM(c.volunteer_hours), 0) as total_hours,
-               COALESCE(SUM(c.cash_donation), 0) as total_cash,
-               COALESCE(SUM(c.material_value), 0) as total_material,
-               COUNT(c.id) as contribution_count
-        FROM volunteers v
-        LEFT JOIN contributions c ON v.id = c.volunteer_id
-        GROUP BY v.id
-        ORDER BY v.name
-    ''')
-    volunteers = cursor.fetchall()
-    conn.close()
-    return render_template('volunteers.html', volunteers=volunteers)
+    """Volunteer list, by name, one keyset page at a time"""
+    limit = get_page_size()
+    
+    # Cursor is the (name, id) of the last row on the previous page
+    after_id = request.args.get('after_id', type=int)
+    volunteers, next_cursor = readpool.run('list', queries.volunteer_page, limit,
+                                           request.args.get('after_name'), after_id)
+    next_page = None
+    if next_cursor:
+        next_page = dict(limit=limit, after_name=next_cursor[0], after_id=next_cursor[1])
+    
+    return render_template('volunteers.html', volunteers=volunteers,
+                         next_page=next_page, is_first_page=after_id is None)
 
 @app.route('/volunteers/add', methods=['POST'])
 def add_volunteer():
     """Add volunteer"""
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO volunteers (name, phone, email, address, notes)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (
-        request.form['name'],
-        request.form.get('phone'),
-        request.form.get('email'),
-        request.form.get('address'),
-        request.form.get('notes')
-    ))
-    conn.commit()
-    conn.close()
+    with transaction(conn):
+        cursor.execute('''
+            INSERT INTO volunteers (name, phone, email, address, notes)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (
+            request.form['name'],
+            request.form.get('phone'),
+            request.form.get('email'),
+            request.form.get('address'),
+            request.form.get('notes')
+        ))
+        vol_id = cursor.lastrowid
+    volunteer_index.index.add(cursor, vol_id, request.form['name'],
+                              request.form.get('email'), request.form.get('phone'))
+    # Earlier contributions typed in under this name may now find their owner
+    queue_identity_run(full=True)
     flash('Volunteer added successfully!', 'success')
     return redirect(url_for('volunteer_list'))
 
+@app.route('/volunteers/lookup')
+def lookup_volunteers():
+    """Typeahead: top volunteers whose name, email or phone starts with ?q="""
+    limit = request.args.get('limit', volunteer_index.DEFAULT_LIMIT, type=int)
+    matches = volunteer_index.index.lookup(get_db().cursor(), request.args.get('q', ''), limit)
+    return jsonify(matches)
+
 @app.route('/volunteers/<int:vol_id>')
 def view_volunteer(vol_id):
     """View volunteer details and contribution history"""
-    conn = get_db()
-    cursor = conn.cursor()
-    
-    cursor.execute('SELECT * FROM volunteers WHERE id = ?', (vol_id,))
-    volunteer = cursor.fetchone()
-    
-    if not volunteer:
-        flash('Volunteer not found', 'error')
-        return redirect(url_for('volunteer_list'))
-    
-    cursor.execute('''
-        SELECT c.*, ep.event_name, ep.event_date
-        FROM contributions c
-        JOIN event_profiles ep ON c.event_id = ep.id
-        WHERE c.volunteer_id = ?
-        ORDER BY ep.event_date DESC
-    ''', (vol_id,))
-    contributions = cursor.fetchall()
-    
-    cursor.execute('''
-        SELECT COALESCE(SUM(volunteer_hours), 0) as total_hours,
-               COALESCE(SUM(cash_donation), 0) as total_cash,
-               COALESCE(SUM(material_value), 0) as total_material
-        FROM contributions WHERE volunteer_id = ?
-    ''', (vol_id,))
-    totals = cursor.fetchone()
-    
-    conn.close()
-    return render_template('view_volunteer.html', volunteer=volunteer, contributions=contributions, totals=totals)
+    cursor = get_db().cursor()
+    
+    def render():
+        volunteer = queries.get_volunteer(cursor, vol_id)
+        if not volunteer:
+            flash('Volunteer not found', 'error')
+            return redirect(url_for('volunteer_list'))
+        contributions = queries.volunteer_contributions(cursor, vol_id)
+        return render_template('view_volunteer.html', volunteer=volunteer, contributions=contributions,
+                               totals=volunteer)
+    
+    return pagecache.cached(cursor, 'view_volunteer', vol_id, ('volunteer', vol_id), (), render)
 
 @app.route('/volunteers/<int:vol_id>/delete', methods=['POST'])
 def delete_volunteer(vol_id):
     """Delete volunteer"""
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('UPDATE contributions SET volunteer_id = NULL WHERE volunteer_id = ?', (vol_id,))
-    cursor.execute('DELETE FROM volunteers WHERE id = ?', (vol_id,))
-    conn.commit()
-    conn.close()
+    with transaction(conn):
+        cursor.execute('UPDATE contributions SET volunteer_id = NULL WHERE volunteer_id = ?', (vol_id,))
+        cursor.execute('DELETE FROM volunteers WHERE id = ?', (vol_id,))
+    dashboard_cache.clear()
+    volunteer_index.index.remove(cursor, vol_id)
+    queue_identity_run()
     flash('Volunteer deleted', 'success')
     return redirect(url_for('volunteer_list'))
 
+@app.route('/volunteers/matches')
+def volunteer_matches():
+    """Review queue: proposed links of free-text contributions, and recent automatic ones"""
+    cursor = get_db().cursor()
+    return render_template('volunteer_matches.html', pending=identity.matches(cursor, 'pending'),
+                           linked=identity.matches(cursor, 'linked', limit=50), counts=identity.counts(cursor),
+                           thresholds={'auto_link': identity.AUTO_LINK, 'review': identity.REVIEW})
+
+@app.route('/volunteers/matches/<int:contribution_id>/<int:vol_id>', methods=['POST'])
+def decide_volunteer_match(contribution_id, vol_id):
+    """Accept or reject a proposed link (rejecting an automatic one undoes it)"""
+    conn = get_db()
+    if request.form.get('action') == 'accept':
+        try:
+            linked = identity.accept(conn, contribution_id, vol_id)
+        except sqlite3.IntegrityError:
+            flash('That volunteer no longer exists', 'error')
+            return redirect(url_for('volunteer_matches'))
+        if linked:
+            flash('Contribution linked', 'success')
+        else:
+            flash('That contribution is already linked', 'error')
+    else:
+        identity.reject(conn, contribution_id, vol_id)
+        queue_identity_run()
+        flash('Match rejected', 'success')
+    return redirect(url_for('volunteer_matches'))
+
+@app.route('/volunteers/matches/run', methods=['POST'])
+def run_volunteer_matching():
+    """Re-check every unlinked contribution now"""
+    job = jobs.submit(get_db(), 'resolve_identities', {'full': True})
+    return redirect(url_for('job_status', job_id=job['id']))
+
 # ========== Organizations ==========
 @app.route('/organizations')
 def organization_list():
     """Organization list"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM organizations ORDER BY name')
-    organizations = cursor.fetchall()
-    conn.close()
-    return render_template('organizations.html', organizations=organizations)
+    return render_template('organizations.html', organizations=reference.organizations(get_db().cursor()))
 
 @app.route('/organizations/add', methods=['POST'])
 def add_organization():
     """Add organization"""
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO organizations (name, type, size, contact_name, contact_phone, contact_email)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (
-        request.form['name'],
-        request.form.get('type'),
-        request.form.get('size'),
-        request.form.get('contact_name'),
-        request.form.get('contact_phone'),
-        request.form.get('contact_email')
-    ))
-    conn.commit()
-    conn.close()
+    with transaction(conn):
+        cursor.execute('''
+            INSERT INTO organizations (name, type, size, contact_name, contact_phone, contact_email)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (
+            request.form['name'],
+            request.form.get('type'),
+            request.form.get('size'),
+            request.form.get('contact_name'),
+            request.form.get('contact_phone'),
+            request.form.get('contact_email')
+        ))
+    reference.invalidate('organizations')
     flash('Organization added successfully!', 'success')
     return redirect(url_for('organization_list'))
 
@@ -379,9 +462,11 @@ def delete_organization(org_id):
     """Delete organization"""
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('DELETE FROM organizations WHERE id = ?', (org_id,))
-    conn.commit()
-    conn.close()
+    with transaction(conn):
+        cursor.execute('UPDATE event_profiles SET organization_id = NULL WHERE organization_id = ?', (org_id,))
+        cursor.execute('DELETE FROM organizations WHERE id = ?', (org_id,))
+    dashboard_cache.clear()
+    reference.invalidate('organizations')
     flash('Organization deleted', 'success')
     return redirect(url_for('organization_list'))
 
@@ -389,12 +474,7 @@ def delete_organization(org_id):
 @app.route('/event-types')
 def event_type_list():
     """Event type list"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM event_types ORDER BY name')
-    event_types = cursor.fetchall()
-    conn.close()
-    return render_template('event_types.html', event_types=event_types)
+    return render_template('event_types.html', event_types=reference.event_types(get_db().cursor()))
 
 @app.route('/event-types/add', methods=['POST'])
 def add_event_type():
@@ -402,13 +482,13 @@ def add_event_type():
     conn = get_db()
     cursor = conn.cursor()
     try:
-        cursor.execute('INSERT INTO event_types (name, description) VALUES (?, ?)',
-                      (request.form['name'], request.form.get('description')))
-        conn.commit()
+        with transaction(conn):
+            cursor.execute('INSERT INTO event_types (name, description) VALUES (?, ?)',
+                          (request.form['name'], request.form.get('description')))
+        reference.invalidate('event_types')
         flash('Event type added successfully!', 'success')
     except:
         flash('This type already exists', 'error')
-    conn.close()
     return redirect(url_for('event_type_list'))
 
 @app.route('/event-types/<int:type_id>/delete', methods=['POST'])
@@ -416,9 +496,13 @@ def delete_event_type(type_id):
     """Delete event type"""
     conn = get_db()
     cursor = conn.cursor()
-    cursor.execute('DELETE FROM event_types WHERE id = ?', (type_id,))
-    conn.commit()
-    conn.close()
+    with transaction(conn):
+        # Events of a deleted type become untyped, and so do their rollups
+        cursor.execute('UPDATE event_profiles SET event_type_id = NULL WHERE event_type_id = ?', (type_id,))
+        rollups.reassign_event_type(cursor, type_id, 0)
+        cursor.execute('DELETE FROM event_types WHERE id = ?', (type_id,))
+    dashboard_cache.clear()
+    reference.invalidate('event_types')
     flash('Event type deleted', 'success')
     return redirect(url_for('event_type_list'))
 
@@ -427,68 +511,199 @@ def delete_event_type(type_id):
 @app.route('/reports')
 def reports():
     """Reports page"""
-    conn = get_db()
-    cursor = conn.cursor()
-    cursor.execute('SELECT DISTINCT quarter FROM event_profiles ORDER BY quarter DESC')
-    quarters = [row['quarter'] for row in cursor.fetchall()]
-    conn.close()
-    return render_template('reports.html', quarters=quarters)
+    return render_template('reports.html', quarters=queries.quarters(get_db().cursor()))
 
 @app.route('/reports/generate', methods=['POST'])
 def generate_report():
-    """Generate quarterly report"""
+    """Queue a quarterly report, or reuse the one already built from the current data"""
     quarter = request.form['quarter']
+    if not archive.QUARTER_RE.match(quarter):
+        flash('Quarters must look like 2024Q1', 'error')
+        return redirect(url_for('reports'))
     conn = get_db()
     cursor = conn.cursor()
-    
-    cursor.execute('''
-        SELECT ep.*, et.name as event_type_name
-        FROM event_profiles ep
-        LEFT JOIN event_types et ON ep.event_type_id = et.id
-        WHERE ep.quarter = ?
-        ORDER BY ep.event_date
-    ''', (quarter,))
-    events = cursor.fetchall()
-    
-    cursor.execute('SELECT COUNT(*) FROM event_profiles WHERE quarter = ?', (quarter,))
-    total_events = cursor.fetchone()[0]
-    
-    cursor.execute('''
-        SELECT COALESCE(SUM(c.volunteer_hours), 0) as total_hours,
-               COALESCE(SUM(c.cash_donation), 0) as total_cash,
-               COALESCE(SUM(c.material_value), 0) as total_material
-        FROM contributions c
-        JOIN event_profiles ep ON c.event_id = ep.id
-        WHERE ep.quarter = ?
-    ''', (quarter,))
-    totals = cursor.fetchone()
-    
-    cursor.execute('''
-        SELECT COALESCE(SUM(actual_participants), 0) FROM event_profiles WHERE quarter = ?
-    ''', (quarter,))
-    total_participants = cursor.fetchone()[0]
-    
-    cursor.execute('''
-        SELECT et.name, COUNT(*) as count,
-               COALESCE(SUM(ep.actual_participants), 0) as participants
-        FROM event_profiles ep
-        LEFT JOIN event_types et ON ep.event_type_id = et.id
-        WHERE ep.quarter = ?
-        GROUP BY et.name
-    ''', (quarter,))
-    by_type = cursor.fetchall()
-    
-    conn.close()
-    
-    return render_template('report_result.html', 
-                         quarter=quarter, events=events,
-                         total_events=total_events,
-                         total_hours=totals['total_hours'],
-                         total_cash=totals['total_cash'],
-                         total_material=totals['total_material'],
-                         total_participants=total_participants,
-                         by_type=by_type)
+    # The key moves whenever anything the report shows changes; it names
+    # both the job and the rendered page
+    key = jobs.report_key(cursor, quarter)
+    if not jobs.workers_alive(cursor):
+        # Nobody would pick a job up: build the report in this request
+        return pagecache.serve(key, lambda: render_template(
+            'report_result.html', **readpool.run('report', queries.quarter_report, quarter)))
+    page = pagecache.cache.get(key)
+    if page is not None:
+        return Response(page, mimetype='text/html')
+    job = jobs.submit(conn, 'report', {'quarter': quarter}, memo_key=key)
+    if job['status'] == 'done':
+        return redirect(url_for('job_result', job_id=job['id']))
+    return redirect(url_for('job_status', job_id=job['id']))
+
+@app.route('/reports/trends')
+def report_trends():
+    """Multi-quarter trends and rankings for ?start=2023Q1&end=2024Q4"""
+    cursor = get_db().cursor()
+    try:
+        result = readpool.run('analytics', analytics.analyze, request.args.get('start'),
+                              request.args.get('end'), request.args.get('top', type=int))
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('report_trends'))
+    return render_template('trends.html', result=result, quarters=queries.quarters(cursor),
+                         metrics=analytics.METRICS)
+
+# ========== Search ==========
+@app.route('/search')
+def search_all():
+    """Ranked prefix search over events, volunteers, organizations and contribution materials"""
+    query = request.args.get('q', '').strip()
+    limit = request.args.get('limit', search.DEFAULT_LIMIT, type=int) or search.DEFAULT_LIMIT
+    results = readpool.run('search', search.search, query, limit) if query else {}
+    return render_template('search.html', query=query, results=results)
+
+# ========== Live Dashboard ==========
+def stream_unavailable():
+    return Response('Too many live streams on this worker', status=503, mimetype='text/plain',
+                    headers={'Retry-After': '5'})
+
+@app.route('/stream')
+def stream():
+    """Server-Sent Events: dashboard totals and change deltas as they commit"""
+    if changefeed.bus.full():
+        return stream_unavailable()
+    # Read before subscribing; the stream skips what the snapshot covers
+    # EventSource sends Last-Event-ID when it reconnects; ?last_id= covers a new EventSource
+    last_id = request.headers.get('Last-Event-ID', type=int) or request.args.get('last_id', type=int)
+    since, initial = changefeed.snapshot(get_db().cursor(), last_id)
+    subscriber = changefeed.bus.subscribe(since)
+    if subscriber is None:
+        return stream_unavailable()
+    # No stream_with_context: the request's connection goes back to the pool
+    # now rather than being held for the life of the stream
+    return Response(changefeed.stream(subscriber, since, initial), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# ========== Exports ==========
+@app.route('/exports/contributions.<fmt>')
+def export_contributions(fmt):
+    """Stream the contribution ledger as CSV or NDJSON
+
+    Optional filters: ?quarter=2024Q1, ?year=2024, ?volunteer_id=, ?organization_id=
+    """
+    if fmt not in exports.FORMATS:
+        abort(404)
+    filters = {
+        'quarter': request.args.get('quarter'),
+        'year': request.args.get('year', type=int),
+        'volunteer_id': request.args.get('volunteer_id', type=int),
+        'organization_id': request.args.get('organization_id', type=int),
+    }
+    suffix = ''.join(f'_{key}-{value}' for key, value in filters.items() if value is not None)
+    filename = f'contributions{suffix}.{fmt}'
+    
+    cursor = get_db().cursor()
+    body = readpool.limited('export', exports.stream_ledger(cursor, fmt, **filters))
+    return Response(stream_with_context(body), mimetype=exports.FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+@app.route('/exports/contributions.<fmt>/job', methods=['POST'])
+def export_job(fmt):
+    """Build a ledger export in the background, for download when ready"""
+    if fmt not in exports.FORMATS:
+        abort(404)
+    filters = {key: request.form.get(key) for key in ('quarter', 'year', 'volunteer_id', 'organization_id')
+               if request.form.get(key)}
+    job = jobs.submit(get_db(), 'export', dict(filters, fmt=fmt))
+    return redirect(url_for('job_status', job_id=job['id']))
+
+# ========== Background Jobs ==========
+@app.route('/jobs/<int:job_id>')
+def job_status(job_id):
+    """A job's status and progress (JSON when asked for), polled until it finishes"""
+    job = jobs.get(get_db().cursor(), job_id)
+    if job is None:
+        abort(404)
+    status = dict(jobs.describe(job), result_url=url_for('job_result', job_id=job_id)
+                  if job['status'] == 'done' else None, workers_alive=jobs.workers_alive(get_db().cursor()))
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify(status)
+    if status['result_url']:
+        return redirect(status['result_url'])
+    return render_template('job.html', job=status)
+
+@app.route('/jobs/<int:job_id>/result')
+def job_result(job_id):
+    """A finished job's result: the rendered report, the export file, or JSON"""
+    job = jobs.get(get_db().cursor(), job_id)
+    if job is None:
+        abort(404)
+    if job['status'] != 'done':
+        return redirect(url_for('job_status', job_id=job_id))
+    result = json.loads(job['result'])
+    if job['kind'] == 'report':
+        return pagecache.serve(job['memo_key'] or f'job:{job_id}', lambda: render_template('report_result.html', **result))
+    if job['kind'] == 'resolve_identities':
+        return redirect(url_for('volunteer_matches'))
+    if job['kind'] == 'import':
+        return render_template('import.html', kinds=list(importer.KINDS), report=result)
+    if job['kind'] == 'export':
+        return send_file(result['path'], as_attachment=True, download_name=result['filename'],
+                         mimetype=exports.FORMATS[json.loads(job['params'])['fmt']])
+    return jsonify(result)
+
+# ========== Bulk Import ==========
+@app.route('/import', methods=['GET', 'POST'])
+def bulk_import():
+    """Bulk import events, volunteers or contributions from CSV / NDJSON"""
+    report = None
+    if request.method == 'POST':
+        kind = request.form.get('kind')
+        upload = request.files.get('file')
+        fmt = request.form.get('format') or (upload.filename.rsplit('.', 1)[-1].lower() if upload and upload.filename else '')
+        if kind not in importer.KINDS or not upload or fmt not in ('csv', 'ndjson'):
+            flash('Choose what to import and a .csv or .ndjson file', 'error')
+            return redirect(url_for('bulk_import'))
+        if jobs.workers_alive(get_db().cursor()):
+            # Large files take a while: a job worker imports the saved upload
+            directory = jobs.job_dir()
+            os.makedirs(directory, exist_ok=True)
+            fd, path = tempfile.mkstemp(dir=directory, prefix='import-', suffix=f'.{fmt}')
+            with os.fdopen(fd, 'wb') as f:
+                shutil.copyfileobj(upload.stream, f)
+            job = jobs.submit(get_db(), 'import', {'kind': kind, 'fmt': fmt, 'path': path})
+            if request.accept_mimetypes.best == 'application/json':
+                return jsonify(jobs.describe(job)), 202, {'Location': url_for('job_status', job_id=job['id'])}
+            return redirect(url_for('job_status', job_id=job['id']))
+        # No job worker running (the development server): import here, as reports do
+        report = importer.import_file(get_db(), kind, upload.stream, fmt)
+        dashboard_cache.clear()
+        if kind in ('volunteers', 'contributions') and report['inserted']:
+            queue_identity_run(full=kind == 'volunteers')
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify(report)
+    return render_template('import.html', kinds=list(importer.KINDS), report=report)
+
+# ========== Monitoring ==========
+@app.route('/stats/db-pool')
+def db_pool_stats():
+    """Connection pool counters for this worker"""
+    return jsonify(dict(pool.stats(), group_commit=contribution_writes.committer.stats(),
+                        read_pool=readpool.pool.stats(), change_feed=changefeed.bus.stats()))
+
+@app.route('/stats/cache')
+def cache_stats():
+    """Result cache counters for this worker"""
+    return jsonify({'dashboard': dashboard_cache.stats(), 'analytics': analytics.cache_stats(),
+                    'pages': pagecache.cache.stats()})
+
+@app.errorhandler(readpool.Overloaded)
+@app.errorhandler(readpool.QueryTimeout)
+def read_unavailable(error):
+    """A heavy read was turned away or cut off; ask the client to retry shortly"""
+    return Response(str(error), status=503, mimetype='text/plain', headers={'Retry-After': '1'})
 
 if __name__ == '__main__':
-    init_db()
+    ensure_schema()
+    # The development server runs jobs in-process; under gunicorn,
+    # gunicorn.conf.py starts `python jobs.py work` instead
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        jobs.Worker(threads=1).start()
     app.run(debug=True, port=5000)
@@ -0,0 +1,308 @@
+"""Closed quarters archived into attached read-only databases
+
+`python archive.py close 2023Q1` moves a finished quarter's events and
+their contributions out of the hot database into archive/archive-2023.db
+(one file per year) and records it in closed_quarters. The hot database
+keeps the open quarters plus everything small (rollups, volunteers with
+their running totals, reference tables), so it stays within the page cache
+however much history accumulates. Closed quarters are read-only: their
+events cannot be edited and no event can be added to them.
+
+Archives are ATTACHed read-only per connection, as schema a<year>, the
+first time a read needs them. SQLite attaches at most 10 databases per
+connection, so attach() makes room by detaching the archives attached
+longest ago that the caller does not need; any number of years can be
+archived. Reads route through this module:
+
+- partitions(cursor, start, end) names the schemas holding quarters
+  start..end, so a report for an open quarter never opens an archive and
+  one for a closed quarter reads only its year's file;
+- union() runs a SELECT written against `{s}.table` on each of those
+  schemas and combines the results with UNION ALL, each branch using its
+  own indexes. One statement can span only as many archives as can be
+  attached at once; past that partitions() raises TooManyArchives;
+- union_batches() does the same for whole-history reads as a series of
+  statements, each within the limit, to be run one after another.
+
+Archived events are read-only: the write routes check archived_event()
+and refuse. The archive tables are created from the hot tables' DDL when a
+year's file is first written; a migration that changes event_profiles or
+contributions must change existing archives too. Full-text search covers
+open quarters only.
+"""
+import os
+import pathlib
+import re
+import sqlite3
+from datetime import date
+
+QUARTER_RE = re.compile(r'^(\d{4})Q([1-4])$')
+
+TABLES = ('event_profiles', 'contributions')
+
+_SCHEMA_RE = re.compile(r'^a\d{4}$')
+
+
+class TooManyArchives(ValueError):
+    """One statement would need more archives than SQLite can attach at once"""
+
+
+def schema(year):
+    return f'a{int(year)}'
+
+
+def archive_dir(cursor):
+    """COMMUNITY_ARCHIVE_DIR, or archive/ beside the hot database"""
+    if os.environ.get('COMMUNITY_ARCHIVE_DIR'):
+        return os.environ['COMMUNITY_ARCHIVE_DIR']
+    return os.path.join(os.path.dirname(_main_path(cursor)), 'archive')
+
+
+def _main_path(cursor):
+    cursor.execute('PRAGMA database_list')
+    return next(row[2] for row in cursor.fetchall() if row[1] == 'main')
+
+
+def archive_path(cursor, year):
+    return os.path.join(archive_dir(cursor), f'archive-{int(year)}.db')
+
+
+def closed_quarters(cursor):
+    """{quarter: year} for every closed quarter"""
+    cursor.execute('SELECT quarter, year FROM closed_quarters')
+    return {row[0]: row[1] for row in cursor.fetchall()}
+
+
+def is_closed(cursor, quarter):
+    cursor.execute('SELECT 1 FROM closed_quarters WHERE quarter = ?', (quarter,))
+    return cursor.fetchone() is not None
+
+
+def archived_years(cursor):
+    """Every archived year, newest first"""
+    cursor.execute('SELECT DISTINCT year FROM closed_quarters ORDER BY year DESC')
+    return [row[0] for row in cursor.fetchall()]
+
+
+def archived_event(cursor, event_id):
+    """The year an event was archived in, or None for an open (or missing) event"""
+    cursor.execute('SELECT 1 FROM event_profiles WHERE id = ?', (event_id,))
+    if cursor.fetchone() is not None:
+        return None
+    for year in archived_years(cursor):
+        cursor.execute(f'SELECT 1 FROM {attach(cursor, [year])[0]}.event_profiles WHERE id = ?', (event_id,))
+        if cursor.fetchone() is not None:
+            return year
+    return None
+
+
+# ---------- Routing ----------
+
+def attach_limit(cursor):
+    return cursor.connection.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+
+
+def attach(cursor, years):
+    """Attach the archives for years that this connection lacks; return the
+    schemas, newest first.
+
+    When the connection is at SQLite's attachment limit, archives attached
+    longest ago that are not in years are detached first. Raises
+    TooManyArchives when years alone are over the limit.
+    """
+    if not years:
+        return []
+    wanted = {schema(year) for year in years}
+    limit = attach_limit(cursor)
+    if len(wanted) > limit:
+        raise TooManyArchives(f'{len(wanted)} archived years are needed at once; '
+                              f'SQLite can attach only {limit}. Choose a shorter range.')
+    cursor.execute('PRAGMA database_list')
+    # In the order they were attached
+    attached = [row[1] for row in cursor.fetchall() if _SCHEMA_RE.match(row[1])]
+    missing = sorted(wanted.difference(attached))
+    spare = [s for s in attached if s not in wanted]
+    for s in spare[:max(0, len(attached) + len(missing) - limit)]:
+        cursor.execute(f'DETACH DATABASE {s}')
+    directory = None
+    for s in missing:
+        directory = directory or archive_dir(cursor)
+        uri = pathlib.Path(directory, f'archive-{s[1:]}.db').absolute().as_uri() + '?mode=ro'
+        cursor.execute(f'ATTACH DATABASE ? AS {s}', (uri,))
+    return [schema(year) for year in sorted(years, reverse=True)]
+
+
+def schema_for(cursor, quarter):
+    """The schema holding quarter's events: its archive once closed, else main"""
+    if quarter:
+        cursor.execute('SELECT year FROM closed_quarters WHERE quarter = ?', (quarter,))
+        row = cursor.fetchone()
+        if row is not None:
+            return attach(cursor, [row[0]])[0]
+    return 'main'
+
+
+def _quarters_between(start, end):
+    first, last = QUARTER_RE.match(start), QUARTER_RE.match(end)
+    index = lambda m: int(m.group(1)) * 4 + int(m.group(2)) - 1
+    return [f'{i // 4}Q{i % 4 + 1}' for i in range(index(first), index(last) + 1)]
+
+
+def partition_years(cursor, start=None, end=None):
+    """(hot, years) for quarters start..end (inclusive; either end open):
+    whether main holds any of them, and the archived years that do"""
+    closed = closed_quarters(cursor)
+    in_range = lambda q: (start is None or q >= start) and (end is None or q <= end)
+    years = {year for quarter, year in closed.items() if in_range(quarter)}
+    bounded = start and end and QUARTER_RE.match(start) and QUARTER_RE.match(end)
+    # main is skipped only when every quarter in the range is archived
+    hot = not bounded or not all(q in closed for q in _quarters_between(start, end))
+    return hot, sorted(years)
+
+
+def partitions(cursor, start=None, end=None):
+    """Schemas holding the events of quarters start..end, attached, main
+    first then archives newest first"""
+    hot, years = partition_years(cursor, start, end)
+    return (['main'] if hot else []) + attach(cursor, years)
+
+
+def connect_readonly(cursor):
+    """A read-only connection of its own to the database cursor reads, for
+    reading archives one after another while cursor's statements run"""
+    uri = pathlib.Path(_main_path(cursor)).absolute().as_uri() + '?mode=ro'
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.row_factory = cursor.connection.row_factory
+    return conn
+
+
+def union(cursor, sql, params=(), start=None, end=None):
+    """(sql, params) running sql, written against `{s}.<table>`, on every
+    partition of start..end and combining the results with UNION ALL"""
+    schemas = partitions(cursor, start, end) or ['main']
+    return ' UNION ALL '.join(sql.format(s=s) for s in schemas), list(params) * len(schemas)
+
+
+def union_batches(cursor, sql, params=()):
+    """Yield (sql, params) like union() for main and every archive, in as
+    many statements as the attachment limit needs. Each batch's archives are
+    attached as it is yielded, so run it before asking for the next."""
+    years = archived_years(cursor)
+    limit = attach_limit(cursor)
+    groups = [years[i:i + limit] for i in range(0, len(years), limit)] or [[]]
+    for n, group in enumerate(groups):
+        schemas = (['main'] if n == 0 else []) + attach(cursor, group)
+        yield ' UNION ALL '.join(sql.format(s=s) for s in schemas), list(params) * len(schemas)
+
+
+# ---------- Closing quarters ----------
+
+def current_quarter(today=None):
+    today = today or date.today()
+    return f'{today.year}Q{(today.month - 1) // 3 + 1}'
+
+
+def _copy(cursor, path, quarter):
+    """Copy quarter's events and contributions into the archive at path"""
+    main_path = _main_path(cursor)
+    archive = sqlite3.connect(path, timeout=30)
+    try:
+        if not archive.execute("SELECT 1 FROM sqlite_master WHERE name = 'event_profiles'").fetchone():
+            # Same DDL as the hot tables, so SELECT * lines up in the union views
+            cursor.execute(f'''
+                SELECT sql FROM sqlite_master
+                WHERE tbl_name IN ({', '.join('?' * len(TABLES))}) AND type IN ('table', 'index')
+                      AND sql IS NOT NULL
+                ORDER BY type = 'index'
+            ''', TABLES)
+            for (sql,) in cursor.fetchall():
+                archive.execute(sql)
+        archive.execute('ATTACH DATABASE ? AS hot', (main_path,))
+        # OR REPLACE makes a retry after an interrupted close idempotent
+        archive.execute('INSERT OR REPLACE INTO event_profiles SELECT * FROM hot.event_profiles WHERE quarter = ?',
+                        (quarter,))
+        archive.execute('''
+            INSERT OR REPLACE INTO contributions
+            SELECT c.* FROM hot.contributions c JOIN hot.event_profiles ep ON ep.id = c.event_id
+            WHERE ep.quarter = ?
+        ''', (quarter,))
+        archive.commit()
+        archive.execute('DETACH DATABASE hot')
+        archive.execute('ANALYZE')
+        archive.commit()
+    finally:
+        archive.close()
+
+
+def close_quarter(conn, quarter, today=None):
+    """Archive a finished quarter; returns {'quarter', 'events', 'contributions'}.
+
+    Raises ValueError for a malformed, unfinished or already closed quarter.
+    """
+    match = QUARTER_RE.match(quarter or '')
+    if not match:
+        raise ValueError('Quarters must look like 2024Q1')
+    if quarter >= current_quarter(today):
+        raise ValueError(f'{quarter} has not finished yet')
+    cursor = conn.cursor()
+    if is_closed(cursor, quarter):
+        raise ValueError(f'{quarter} is already closed')
+    year = int(match.group(1))
+    path = archive_path(cursor, year)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Holding the write lock from the copy to the delete means nothing can
+    # be added to the quarter in between
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        _copy(cursor, path, quarter)
+        # Volunteer totals are all-time, so archived contributions stay counted
+        cursor.execute('''
+            SELECT SUM(c.volunteer_hours), SUM(c.cash_donation), SUM(c.material_value), COUNT(*), c.volunteer_id
+            FROM contributions c JOIN event_profiles ep ON ep.id = c.event_id
+            WHERE ep.quarter = ? AND c.volunteer_id IS NOT NULL
+            GROUP BY c.volunteer_id
+        ''', (quarter,))
+        kept = [tuple(row) for row in cursor.fetchall()]
+        cursor.execute('DELETE FROM contributions WHERE event_id IN (SELECT id FROM event_profiles WHERE quarter = ?)',
+                       (quarter,))
+        contributions = cursor.rowcount
+        cursor.execute('DELETE FROM event_profiles WHERE quarter = ?', (quarter,))
+        events = cursor.rowcount
+        cursor.executemany('''
+            UPDATE volunteers SET total_hours = total_hours + ?, total_cash = total_cash + ?,
+                                  total_material = total_material + ?, contribution_count = contribution_count + ?
+            WHERE id = ?
+        ''', kept)
+        cursor.execute('INSERT INTO closed_quarters (quarter, year, events, contributions) VALUES (?, ?, ?, ?)',
+                       (quarter, year, events, contributions))
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    return {'quarter': quarter, 'events': events, 'contributions': contributions}
+
+
+if __name__ == '__main__':
+    import argparse
+    from database import get_db
+    parser = argparse.ArgumentParser(description='Archive closed quarters')
+    sub = parser.add_subparsers(dest='command', required=True)
+    close_parser = sub.add_parser('close', help='archive one or more finished quarters')
+    close_parser.add_argument('quarters', nargs='+')
+    close_parser.add_argument('--vacuum', action='store_true', help='shrink the hot database file afterwards')
+    sub.add_parser('list', help='list closed quarters')
+    args = parser.parse_args()
+
+    conn = get_db()
+    if args.command == 'close':
+        for quarter in args.quarters:
+            result = close_quarter(conn, quarter)
+            print(f"{quarter}: archived {result['events']} events, {result['contributions']} contributions")
+        if args.vacuum:
+            conn.execute('VACUUM')
+    else:
+        for row in conn.execute('SELECT * FROM closed_quarters ORDER BY quarter'):
+            print(f"{row['quarter']}  {row['events']:>7} events  {row['contributions']:>9} contributions"
+                  f"  closed {row['closed_at']}")
+    conn.close()
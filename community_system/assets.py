@@ -0,0 +1,232 @@
+"""Self-hosted, fingerprinted static assets
+
+The Bootstrap and Bootstrap Icons files the templates use are vendored
+under static/vendor/ (`python assets.py fetch` downloads them once, on a
+machine with internet access, and both static/vendor/ and static/dist/ are
+committed). `python assets.py build` copies them to static/dist/ under
+content-hashed names, rewrites the font references in
+the CSS to match, writes .gz (and .br when the brotli package is installed)
+variants of the text files, and records the mapping in manifest.json. The
+app builds automatically at startup when the manifest is missing or older
+than the vendored files.
+
+Templates call asset_url('bootstrap.min.css'). Built files are served at
+/assets/ with a one-year immutable Cache-Control and the best precompressed
+variant the client accepts.
+
+Missing vendored files fail `python assets.py build` and `check`, which
+the deploy build runs, so nothing is downloaded at deploy time. The app
+itself still starts without them (a checkout without static/vendor/ must
+stay runnable for development and benchmarks): asset_url() then points at
+the CDN and startup logs an error naming the missing files. Setting
+ASSETS_CDN_FALLBACK=1 opts into the CDN and silences that error.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+import urllib.request
+
+from flask import abort, request, send_file, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+VENDOR_DIR = os.path.join(STATIC_DIR, 'vendor')
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+MANIFEST = os.path.join(DIST_DIR, 'manifest.json')
+
+# Logical name -> upstream URL; fonts come before the CSS that references them
+ASSETS = {
+    'fonts/bootstrap-icons.woff2':
+        'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.10.0/font/fonts/bootstrap-icons.woff2',
+    'fonts/bootstrap-icons.woff':
+        'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.10.0/font/fonts/bootstrap-icons.woff',
+    'bootstrap.min.css': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/css/bootstrap.min.css',
+    'bootstrap-icons.css': 'https://cdn.jsdelivr.net/npm/bootstrap-icons@1.10.0/font/bootstrap-icons.css',
+    'bootstrap.bundle.min.js': 'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js',
+}
+
+# Fonts are already compressed; only text formats get .gz/.br variants
+PRECOMPRESS = ('.css', '.js', '.svg', '.json')
+MAX_AGE = 365 * 24 * 3600
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+URL_RE = re.compile(r'''url\(\s*(["']?)([^"')?#]+)([?#][^"')]*)?\1\s*\)''')
+
+logger = logging.getLogger('community.assets')
+
+# Opt-in for development only; production must serve the vendored files
+CDN_FALLBACK = os.environ.get('ASSETS_CDN_FALLBACK', '').lower() in ('1', 'true', 'yes')
+
+_manifest = {}
+
+
+# ---------- Build ----------
+
+def fetch(names=ASSETS):
+    """Download the vendored files from their upstream URLs"""
+    for name in names:
+        path = os.path.join(VENDOR_DIR, name)
+        with urllib.request.urlopen(ASSETS[name], timeout=30) as response:
+            _write(path, response.read())
+        print(f'fetched {name}')
+
+
+def _write(path, data):
+    # Write then rename so a worker never serves a partial file
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+def _fingerprinted(name, data):
+    stem, ext = os.path.splitext(name)
+    return f'{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}'
+
+
+def _rewrite_urls(name, data, manifest):
+    """Point url(...) references in a CSS file at the fingerprinted files"""
+    base = os.path.dirname(name)
+
+    def replace(match):
+        quote, target, suffix = match.group(1), match.group(2), match.group(3) or ''
+        logical = os.path.normpath(os.path.join(base, target)).replace(os.sep, '/')
+        if logical not in manifest:
+            return match.group(0)
+        # The hash is in the name now, so the cache-busting query is dropped
+        relative = os.path.relpath(manifest[logical], base or '.').replace(os.sep, '/')
+        suffix = suffix if suffix.startswith('#') else ''
+        return f'url({quote}{relative}{suffix}{quote})'
+
+    return URL_RE.sub(replace, data.decode()).encode()
+
+
+def build():
+    """Fingerprint and precompress the vendored files; return the manifest"""
+    _require_vendored()
+    manifest = {}
+    for name in ASSETS:
+        with open(os.path.join(VENDOR_DIR, name), 'rb') as f:
+            data = f.read()
+        if name.endswith('.css'):
+            data = _rewrite_urls(name, data, manifest)
+        target = _fingerprinted(name, data)
+        path = os.path.join(DIST_DIR, target)
+        variants = {path: lambda: data}
+        if name.endswith(PRECOMPRESS):
+            variants[path + '.gz'] = lambda: gzip.compress(data, 9, mtime=0)
+            if brotli is not None:
+                variants[path + '.br'] = lambda: brotli.compress(data, quality=11)
+        for variant, encode in variants.items():
+            if not os.path.exists(variant):
+                _write(variant, encode())
+        manifest[name] = target
+    _write(MANIFEST, json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+def missing():
+    """Vendored files that are not on disk"""
+    return [name for name in ASSETS if not os.path.exists(os.path.join(VENDOR_DIR, name))]
+
+
+def vendored():
+    return not missing()
+
+
+def _require_vendored():
+    absent = missing()
+    if absent:
+        raise RuntimeError(f'Vendored assets missing from {VENDOR_DIR}: {", ".join(absent)}. '
+                           'Run `python assets.py fetch --missing` on a machine with internet access '
+                           'and commit static/vendor/ and static/dist/.')
+
+
+def _stale():
+    if not os.path.exists(MANIFEST):
+        return True
+    built = os.path.getmtime(MANIFEST)
+    return any(os.path.getmtime(os.path.join(VENDOR_DIR, name)) > built for name in ASSETS)
+
+
+def load_manifest():
+    """Build if needed, then load the manifest
+
+    With vendored files missing the manifest is empty, so pages use the CDN;
+    that is logged as an error unless ASSETS_CDN_FALLBACK opts into it.
+    """
+    global _manifest
+    if not vendored():
+        if not CDN_FALLBACK:
+            logger.error('Vendored assets missing from %s: %s; pages load them from the CDN. '
+                         'Run `python assets.py fetch` and commit static/vendor/ and static/dist/.',
+                         VENDOR_DIR, ', '.join(missing()))
+        _manifest = {}
+    else:
+        if _stale():
+            build()
+        with open(MANIFEST) as f:
+            _manifest = json.load(f)
+    return _manifest
+
+
+# ---------- Serving ----------
+
+def asset_url(name):
+    """URL of a vendored asset, or its CDN URL when it is not vendored"""
+    target = _manifest.get(name)
+    if target is None:
+        return ASSETS[name]
+    return url_for('asset', filename=target)
+
+
+def serve_asset(filename):
+    """Serve a built file, preferring a precompressed variant the client accepts"""
+    if filename not in _manifest.values():
+        abort(404)
+    path = os.path.join(DIST_DIR, filename)
+    encoding = None
+    for name, suffix in ENCODINGS:
+        if request.accept_encodings.quality(name) and os.path.exists(path + suffix):
+            path, encoding = path + suffix, name
+            break
+    response = send_file(path, mimetype=mimetypes.guess_type(filename)[0], download_name=os.path.basename(filename),
+                         conditional=True, etag=True)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if filename.endswith(PRECOMPRESS):
+        response.vary.add('Accept-Encoding')
+    # The name changes whenever the content does
+    response.headers['Cache-Control'] = f'public, max-age={MAX_AGE}, immutable'
+    return response
+
+
+def init_assets(app):
+    """Load (building if stale) the manifest and register /assets/ and asset_url"""
+    load_manifest()
+    app.add_url_rule('/assets/<path:filename>', 'asset', serve_asset)
+    app.add_template_global(asset_url)
+    return bool(_manifest)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Vendor and build static assets')
+    parser.add_argument('command', choices=('fetch', 'build'),
+                        help='fetch downloads the vendored files and builds; build only rebuilds static/dist')
+    parser.add_argument('--missing', action='store_true', help='with fetch, download only files not yet vendored')
+    args = parser.parse_args()
+    if args.command == 'fetch':
+        fetch(missing() if args.missing else ASSETS)
+    for name, target in build().items():
+        print(f'{name} -> {target}')
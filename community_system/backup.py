@@ -0,0 +1,381 @@
+"""Online backups through the SQLite backup API
+
+`python backup.py run` snapshots the live database while the app keeps
+serving: pages are copied BACKUP_STEP_PAGES at a time with a
+BACKUP_STEP_SLEEP pause after each step, so the copy never holds the disk
+or a lock for long. The source connection holds one read transaction for
+the whole copy. In WAL mode that blocks no writer, and every step reads
+the same snapshot. Without it, each commit by the app would restart the
+backup from page one, and under steady writes the copy would never finish.
+
+Each snapshot is a directory backups/snapshot-<timestamp>/ holding
+community.db, one file per archived year (archive.py) and manifest.json.
+It is written under a .partial name and renamed only once every file has
+passed `PRAGMA integrity_check`, which runs at BACKUP_NICE priority. A
+half-written snapshot is therefore never listed. The newest BACKUP_KEEP snapshots are kept. `schedule` takes one
+every --every seconds; gunicorn.conf.py starts it when
+COMMUNITY_BACKUP_INTERVAL is set.
+
+`restore <snapshot>` verifies the snapshot and first backs up the current
+state, so a restore can itself be undone. It then copies the snapshot back
+into the live files, again through the backup API, so open connections see
+the restored data on their next read. Finally it moves every data and
+entity version past the pre-restore values, so no page cache, ETag or
+versioned result cache can match the restored data against stale entries.
+"""
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import archive
+import database
+import versions
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+STEP_PAGES = int(os.environ.get('BACKUP_STEP_PAGES', 256))
+STEP_SLEEP = float(os.environ.get('BACKUP_STEP_SLEEP', 0.005))
+KEEP = int(os.environ.get('BACKUP_KEEP', 7))
+# `run` and `schedule` lower their CPU priority by this much: the integrity
+# check of a large copy is seconds of pure CPU that requests should win
+NICE = int(os.environ.get('BACKUP_NICE', 10))
+
+PREFIX = 'snapshot-'
+PARTIAL = '.partial'
+MAIN_FILE = 'community.db'
+
+
+def backup_dir():
+    """COMMUNITY_BACKUP_DIR, or backups/ beside the live database"""
+    if os.environ.get('COMMUNITY_BACKUP_DIR'):
+        return os.environ['COMMUNITY_BACKUP_DIR']
+    return os.path.join(os.path.dirname(os.path.abspath(database.DATABASE)), 'backups')
+
+
+@contextmanager
+def _backup_lock(directory):
+    """Refuse to start while another process is backing up or restoring"""
+    if fcntl is None:
+        yield
+        return
+    with open(os.path.join(directory, '.lock'), 'a') as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise RuntimeError('Another backup or restore is already running') from None
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+# ---------- Copying ----------
+
+def copy_database(source, target, pages=STEP_PAGES, sleep=STEP_SLEEP):
+    """Copy the database at source to target with the backup API, pausing
+    sleep seconds after every `pages` pages; returns the number of steps"""
+    src = sqlite3.connect(source, timeout=database.BUSY_TIMEOUT)
+    dst = sqlite3.connect(target)
+    steps = 0
+
+    def progress(status, remaining, total):
+        # sqlite3's own sleep= only applies when a step finds the source
+        # locked, so the pacing happens here
+        nonlocal steps
+        steps += 1
+        if remaining and sleep:
+            time.sleep(sleep)
+
+    try:
+        # One read transaction across all steps: the copy is a single
+        # consistent snapshot and the app's commits cannot restart it
+        src.execute('BEGIN')
+        src.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+        src.backup(dst, pages=pages, progress=progress)
+        src.rollback()
+        # A snapshot is one self-contained file, whatever the source's mode
+        dst.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        dst.close()
+        src.close()
+    return steps
+
+
+def verify_file(path):
+    """Problems PRAGMA integrity_check reports for the file (empty when sound)"""
+    conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    try:
+        rows = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+    except sqlite3.DatabaseError as e:
+        # Damage to the header or schema stops the check before it reports
+        return [str(e)]
+    finally:
+        conn.close()
+    return [] if rows == ['ok'] else rows
+
+
+def _trim_archive(path, quarters):
+    """Drop rows of quarters the main snapshot does not record as closed.
+
+    A quarter closed between copying the main database and its archive
+    would otherwise be in both.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        placeholders = ', '.join('?' * len(quarters))
+        conn.execute(f'DELETE FROM contributions WHERE event_id IN '
+                     f'(SELECT id FROM event_profiles WHERE quarter NOT IN ({placeholders}))', quarters)
+        conn.execute(f'DELETE FROM event_profiles WHERE quarter NOT IN ({placeholders})', quarters)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _snapshot_name(directory):
+    name = PREFIX + datetime.now().strftime('%Y%m%d-%H%M%S')
+    candidate, n = name, 1
+    while os.path.exists(os.path.join(directory, candidate)):
+        n += 1
+        candidate = f'{name}-{n}'
+    return candidate
+
+
+def create_backup(directory=None, pages=STEP_PAGES, sleep=STEP_SLEEP, keep=KEEP):
+    """Write, verify and publish one snapshot, then rotate; returns its manifest.
+
+    Raises RuntimeError when another backup is running or the copy fails
+    its integrity check.
+    """
+    directory = directory or backup_dir()
+    os.makedirs(directory, exist_ok=True)
+    with _backup_lock(directory):
+        _remove_partials(directory)
+        name = _snapshot_name(directory)
+        partial = os.path.join(directory, name + PARTIAL)
+        os.mkdir(partial)
+        try:
+            started = time.perf_counter()
+            main = os.path.join(partial, MAIN_FILE)
+            steps = copy_database(database.DATABASE, main, pages, sleep)
+
+            # Archives are read-only once written, so copying them after the
+            # main file only has to allow for a quarter closed in between
+            snapshot = sqlite3.connect(main)
+            closed = {}
+            if snapshot.execute("SELECT 1 FROM sqlite_master WHERE name = 'closed_quarters'").fetchone():
+                for quarter, year in snapshot.execute('SELECT quarter, year FROM closed_quarters'):
+                    closed.setdefault(year, []).append(quarter)
+            schema_version = snapshot.execute('PRAGMA user_version').fetchone()[0]
+            snapshot.close()
+            live = database.connect()
+            try:
+                archive_paths = {year: archive.archive_path(live.cursor(), year) for year in closed}
+            finally:
+                live.close()
+            files = [MAIN_FILE]
+            for year, quarters in sorted(closed.items()):
+                target = os.path.basename(archive_paths[year])
+                steps += copy_database(archive_paths[year], os.path.join(partial, target), pages, sleep)
+                _trim_archive(os.path.join(partial, target), quarters)
+                files.append(target)
+
+            for filename in files:
+                problems = verify_file(os.path.join(partial, filename))
+                if problems:
+                    raise RuntimeError(f'{filename} failed its integrity check: {problems[:5]}')
+            manifest = {
+                'name': name,
+                'created_at': datetime.now().isoformat(timespec='seconds'),
+                'source': os.path.abspath(database.DATABASE),
+                'schema_version': schema_version,
+                'files': {f: os.path.getsize(os.path.join(partial, f)) for f in files},
+                'steps': steps,
+                'seconds': round(time.perf_counter() - started, 3),
+                'integrity': 'ok',
+            }
+            with open(os.path.join(partial, 'manifest.json'), 'w') as f:
+                json.dump(manifest, f, indent=2)
+            os.rename(partial, os.path.join(directory, name))
+        except BaseException:
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+        rotate(directory, keep)
+    return manifest
+
+
+def _remove_partials(directory):
+    # Caller holds the lock, so any .partial left is from a crashed run
+    for entry in os.listdir(directory):
+        if entry.startswith(PREFIX) and entry.endswith(PARTIAL):
+            shutil.rmtree(os.path.join(directory, entry), ignore_errors=True)
+
+
+# ---------- Rotation and listing ----------
+
+def snapshots(directory=None):
+    """Published snapshot paths, oldest first"""
+    directory = directory or backup_dir()
+    if not os.path.isdir(directory):
+        return []
+    names = sorted(n for n in os.listdir(directory) if n.startswith(PREFIX) and not n.endswith(PARTIAL))
+    return [os.path.join(directory, n) for n in names]
+
+
+def rotate(directory=None, keep=KEEP):
+    """Delete all but the newest `keep` snapshots; returns the deleted paths"""
+    doomed = snapshots(directory)[:-keep] if keep > 0 else []
+    for path in doomed:
+        shutil.rmtree(path)
+    return doomed
+
+
+def read_manifest(snapshot):
+    with open(os.path.join(snapshot, 'manifest.json')) as f:
+        return json.load(f)
+
+
+def verify(snapshot):
+    """{filename: problems} for every file of a snapshot that fails its check"""
+    manifest = read_manifest(snapshot)
+    failed = {}
+    for filename in manifest['files']:
+        path = os.path.join(snapshot, filename)
+        problems = verify_file(path) if os.path.exists(path) else ['missing']
+        if problems:
+            failed[filename] = problems
+    return failed
+
+
+# ---------- Restore ----------
+
+def restore(snapshot, safety_backup=True):
+    """Replace the live database and archives with a verified snapshot.
+
+    Raises ValueError when the snapshot fails verification or was written
+    by a newer schema than this code knows.
+    """
+    failed = verify(snapshot)
+    if failed:
+        raise ValueError(f'{os.path.basename(snapshot)} failed verification: {failed}')
+    manifest = read_manifest(snapshot)
+    if manifest['schema_version'] > database.SCHEMA_VERSION:
+        raise ValueError(f"{os.path.basename(snapshot)} has schema version {manifest['schema_version']}, "
+                         f'newer than this code ({database.SCHEMA_VERSION})')
+    if safety_backup:
+        create_backup(keep=max(KEEP, len(snapshots()) + 1))
+
+    directory = backup_dir()
+    os.makedirs(directory, exist_ok=True)
+    with _backup_lock(directory):
+        conn = database.connect()
+        try:
+            cursor = conn.cursor()
+            floor = versions.max_version(cursor)
+            archive_dir = archive.archive_dir(cursor)
+            live_keys = versions.entity_keys(cursor)
+            # Archive files the snapshot does not have belong to quarters it
+            # does not record as closed; they are set aside, not deleted
+            restored = {f for f in manifest['files'] if f != MAIN_FILE}
+            if os.path.isdir(archive_dir):
+                stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+                for entry in os.listdir(archive_dir):
+                    if entry.endswith('.db') and entry not in restored:
+                        os.rename(os.path.join(archive_dir, entry),
+                                  os.path.join(archive_dir, f'{entry}.replaced-{stamp}'))
+            os.makedirs(archive_dir, exist_ok=True)
+            for filename in sorted(restored):
+                _restore_file(os.path.join(snapshot, filename), os.path.join(archive_dir, filename))
+            _restore_file(os.path.join(snapshot, MAIN_FILE), database.DATABASE)
+
+            with database.transaction(conn):
+                versions.advance_past(cursor, floor, live_keys)
+        finally:
+            conn.close()
+    # An older snapshot is brought up to the current schema
+    database.ensure_schema()
+    return manifest
+
+
+def _restore_file(source, target):
+    # One step, so readers switch from the old contents to the new at once
+    src = sqlite3.connect(f'file:{source}?mode=ro', uri=True)
+    dst = database.connect() if os.path.abspath(target) == os.path.abspath(database.DATABASE) \
+        else sqlite3.connect(target, timeout=database.BUSY_TIMEOUT)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+# ---------- Schedule ----------
+
+def schedule(every, directory=None, keep=KEEP):
+    """Take a snapshot every `every` seconds until interrupted"""
+    while True:
+        started = time.monotonic()
+        try:
+            manifest = create_backup(directory, keep=keep)
+            print(f"{manifest['name']}: {sum(manifest['files'].values())} bytes in {manifest['seconds']}s",
+                  flush=True)
+        except (RuntimeError, sqlite3.Error, OSError) as e:
+            # A failed run is reported and retried at the next interval
+            print(f'backup failed: {e}', file=sys.stderr, flush=True)
+        time.sleep(max(0.0, every - (time.monotonic() - started)))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Online backups of the live database')
+    sub = parser.add_subparsers(dest='command', required=True)
+    run_parser = sub.add_parser('run', help='take one snapshot now')
+    run_parser.add_argument('--keep', type=int, default=KEEP, help='snapshots to keep')
+    run_parser.add_argument('--pages', type=int, default=STEP_PAGES, help='pages per step (-1: all at once)')
+    run_parser.add_argument('--sleep', type=float, default=STEP_SLEEP, help='seconds to pause after each step')
+    schedule_parser = sub.add_parser('schedule', help='take a snapshot every --every seconds')
+    schedule_parser.add_argument('--every', type=float, required=True)
+    schedule_parser.add_argument('--keep', type=int, default=KEEP)
+    sub.add_parser('list', help='list snapshots')
+    verify_parser = sub.add_parser('verify', help='integrity-check a snapshot (default: all of them)')
+    verify_parser.add_argument('snapshot', nargs='?')
+    restore_parser = sub.add_parser('restore', help='replace the live database with a snapshot')
+    restore_parser.add_argument('snapshot')
+    restore_parser.add_argument('--no-safety-backup', action='store_true',
+                                help='skip backing up the current state first')
+    args = parser.parse_args()
+
+    def resolve(name):
+        return name if os.path.isdir(name) else os.path.join(backup_dir(), name)
+
+    if args.command in ('run', 'schedule') and NICE and hasattr(os, 'nice'):
+        os.nice(NICE)
+    if args.command == 'run':
+        manifest = create_backup(pages=args.pages, sleep=args.sleep, keep=args.keep)
+        print(f"{manifest['name']}: {', '.join(manifest['files'])} in {manifest['seconds']}s "
+              f"({manifest['steps']} steps), integrity ok")
+    elif args.command == 'schedule':
+        schedule(args.every, keep=args.keep)
+    elif args.command == 'list':
+        for path in snapshots():
+            manifest = read_manifest(path)
+            print(f"{manifest['name']}  {sum(manifest['files'].values()):>12} bytes  "
+                  f"{len(manifest['files'])} files  schema {manifest['schema_version']}")
+    elif args.command == 'verify':
+        paths = [resolve(args.snapshot)] if args.snapshot else snapshots()
+        bad = 0
+        for path in paths:
+            failed = verify(path)
+            bad += bool(failed)
+            print(f"{os.path.basename(path)}: {'ok' if not failed else failed}")
+        sys.exit(1 if bad else 0)
+    else:
+        manifest = restore(resolve(args.snapshot), safety_backup=not args.no_safety_backup)
+        print(f"Restored {manifest['name']} ({', '.join(manifest['files'])})")
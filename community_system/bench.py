@@ -0,0 +1,749 @@
+"""Benchmark every route against a seeded database
+
+Drives each route of app.py (and the JSON API) through the Flask test
+client and, optionally, through gunicorn with concurrent HTTP clients.
+Per-route latency percentiles, throughput and peak RSS are written to a
+JSON file; compare two such files to spot regressions between commits.
+
+The benchmark runs on a scratch copy of the database, so the seeded file
+can be reused. Write routes are included: each run first creates the
+throwaway rows that its delete routes remove.
+
+Usage:
+    python seed.py /tmp/bench-100k.db --size 100k
+    python bench.py run /tmp/bench-100k.db --out before.json [--gunicorn --workers 4 --clients 16]
+    python bench.py compare before.json after.json
+    python bench.py startup /tmp/bench-100k.db [--samples 5] [--gunicorn]
+    python bench.py backup /tmp/bench-1m.db [--seconds 10 --rate 40] [--pages 256 --sleep 0.005]
+    python bench.py identity [--sizes 2500,5000,10000,20000]
+
+`startup` measures cold start to first response: each sample is a fresh
+interpreter (standing in for a new worker) that imports the app and serves
+its first page, against an empty database, a current one with a cold Jinja
+bytecode cache, and a current one with a warm cache. With --gunicorn it
+also times a whole server from launch to its first response, with and
+without --preload.
+
+`backup` keeps gunicorn under a fixed-rate read/write load and reports request
+latency with no backup running, while the database file is copied, during
+a paced backup (backup.py) and during one taken in a single step.
+
+`identity` times a full identity-matching run (identity.py) on synthetic
+volunteers and as many free-text contributions, typed with known
+variations, at growing sizes. Per-contribution time and comparisons
+staying flat show that blocking keeps matching near-linear. Precision and
+recall of the automatic links are scored against the known truth.
+"""
+import http.client
+import io
+import itertools
+import json
+import os
+import platform
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import urlencode
+
+import rollups
+
+# A checkout without static/vendor/ is still benchmarked: the in-process app
+# and every server started below (they inherit os.environ) link the CDN
+# instead of logging the missing assets. Vendored files are used when present.
+os.environ.setdefault('ASSETS_CDN_FALLBACK', '1')
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# Reported as a regression by `compare` when p95 grows by more than this
+REGRESSION_RATIO = 1.2
+
+
+class Fixtures:
+    """Ids sampled from the database plus throwaway rows for delete routes"""
+
+    def __init__(self, path, deletes):
+        conn = sqlite3.connect(path)
+        conn.row_factory = sqlite3.Row
+        self.events = [r[0] for r in conn.execute('SELECT id FROM event_profiles ORDER BY random() LIMIT 200')]
+        self.volunteers = [r[0] for r in conn.execute('SELECT id FROM volunteers ORDER BY random() LIMIT 200')]
+        self.quarters = [r[0] for r in conn.execute(
+            "SELECT year || 'Q' || quarter FROM quarterly_summaries ORDER BY year DESC, quarter DESC")]
+        self.names = [r[0] for r in conn.execute('SELECT name FROM volunteers ORDER BY random() LIMIT 50')]
+        self.type_id = conn.execute('SELECT MIN(id) FROM event_types').fetchone()[0]
+
+        # Rows for the delete routes, one per request, counted in the
+        # rollups like rows added through the app
+        cursor = conn.cursor()
+        self.doomed = {'event': [], 'contribution': [], 'volunteer': [], 'organization': [], 'event_type': []}
+        for i in range(deletes):
+            cursor.execute("INSERT INTO organizations (name) VALUES (?)", (f'bench org {i}',))
+            self.doomed['organization'].append(cursor.lastrowid)
+            cursor.execute("INSERT INTO event_types (name) VALUES (?)", (f'bench type {i}',))
+            self.doomed['event_type'].append(cursor.lastrowid)
+            cursor.execute("INSERT INTO volunteers (name) VALUES (?)", (f'bench volunteer {i}',))
+            self.doomed['volunteer'].append(cursor.lastrowid)
+            cursor.execute("INSERT INTO event_profiles (event_name, event_date, quarter) VALUES (?, ?, ?)",
+                           (f'bench event {i}', '2020-01-01', '2020Q1'))
+            self.doomed['event'].append(cursor.lastrowid)
+            rollups.add_event(cursor, cursor.lastrowid)
+            cursor.execute("INSERT INTO contributions (event_id, volunteer_name, volunteer_hours) VALUES (?, ?, 1)",
+                           (self.events[0], 'bench'))
+            self.doomed['contribution'].append(cursor.lastrowid)
+            rollups.add_contribution(cursor, cursor.lastrowid)
+        conn.commit()
+        conn.close()
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+
+    def pick(self, values):
+        with self._lock:
+            return values[next(self._counter) % len(values)]
+
+    def take(self, kind):
+        with self._lock:
+            return self.doomed[kind].pop() if self.doomed[kind] else 0
+
+    def unique(self):
+        with self._lock:
+            return next(self._counter)
+
+
+def _import_body():
+    return io.BytesIO(b'name,email\nBench Import,import@example.com\n')
+
+
+# name -> callable(fixtures) returning (method, path, form data or None).
+# Covers every route in app.py and the /api/v1 blueprint.
+CASES = {
+    'index': lambda f: ('GET', '/', None),
+    'event_list': lambda f: ('GET', '/events', None),
+    'event_list_filtered': lambda f: ('GET', '/events?' + urlencode({'quarter': f.pick(f.quarters)}), None),
+    'add_event_form': lambda f: ('GET', '/events/add', None),
+    'add_event': lambda f: ('POST', '/events/add', {
+        'event_name': f'Bench {f.unique()}', 'event_date': '2024-05-01', 'event_type_id': f.type_id,
+        'actual_participants': '10'}),
+    'view_event': lambda f: ('GET', f'/events/{f.pick(f.events)}', None),
+    'edit_event_form': lambda f: ('GET', f'/events/{f.pick(f.events)}/edit', None),
+    'edit_event': lambda f: ('POST', f'/events/{f.pick(f.events)}/edit', {
+        'event_name': f'Edited {f.unique()}', 'event_date': '2024-05-02', 'event_type_id': f.type_id}),
+    'delete_event': lambda f: ('POST', f"/events/{f.take('event')}/delete", {}),
+    'add_contribution': lambda f: ('POST', f'/events/{f.pick(f.events)}/contributions/add', {
+        'volunteer_id': f.pick(f.volunteers), 'volunteer_name': 'Bench', 'volunteer_hours': '2'}),
+    'delete_contribution': lambda f: ('POST', f"/contributions/{f.take('contribution')}/delete", {}),
+    'volunteer_list': lambda f: ('GET', '/volunteers', None),
+    'add_volunteer': lambda f: ('POST', '/volunteers/add', {'name': f'Bench Volunteer {f.unique()}'}),
+    'lookup_volunteers': lambda f: ('GET', '/volunteers/lookup?' + urlencode({'q': f.pick(f.names)[:3]}), None),
+    'view_volunteer': lambda f: ('GET', f'/volunteers/{f.pick(f.volunteers)}', None),
+    'delete_volunteer': lambda f: ('POST', f"/volunteers/{f.take('volunteer')}/delete", {}),
+    'organization_list': lambda f: ('GET', '/organizations', None),
+    'add_organization': lambda f: ('POST', '/organizations/add', {'name': f'Bench Org {f.unique()}'}),
+    'delete_organization': lambda f: ('POST', f"/organizations/{f.take('organization')}/delete", {}),
+    'event_type_list': lambda f: ('GET', '/event-types', None),
+    'add_event_type': lambda f: ('POST', '/event-types/add', {'name': f'Bench Type {f.unique()}'}),
+    'delete_event_type': lambda f: ('POST', f"/event-types/{f.take('event_type')}/delete", {}),
+    'reports': lambda f: ('GET', '/reports', None),
+    'generate_report': lambda f: ('POST', '/reports/generate', {'quarter': f.pick(f.quarters)}),
+    'report_trends': lambda f: ('GET', '/reports/trends', None),
+    'search': lambda f: ('GET', '/search?' + urlencode({'q': f.pick(f.names).split()[0]}), None),
+    'export_csv': lambda f: ('GET', '/exports/contributions.csv?' + urlencode({'quarter': f.pick(f.quarters)}), None),
+    'import_form': lambda f: ('GET', '/import', None),
+    'import': lambda f: ('POST', '/import', {'kind': 'volunteers', 'format': 'csv',
+                                             'file': (_import_body(), 'bench.csv')}),
+    'db_pool_stats': lambda f: ('GET', '/stats/db-pool', None),
+    'cache_stats': lambda f: ('GET', '/stats/cache', None),
+    'api_dashboard': lambda f: ('GET', '/api/v1/dashboard', None),
+    'api_events': lambda f: ('GET', '/api/v1/events', None),
+    'api_event': lambda f: ('GET', f'/api/v1/events/{f.pick(f.events)}', None),
+    'api_volunteers': lambda f: ('GET', '/api/v1/volunteers', None),
+    'api_volunteer': lambda f: ('GET', f'/api/v1/volunteers/{f.pick(f.volunteers)}', None),
+    'api_reports': lambda f: ('GET', '/api/v1/reports', None),
+    'api_report': lambda f: ('GET', f'/api/v1/reports/{f.pick(f.quarters)}', None),
+    'api_analytics': lambda f: ('GET', '/api/v1/analytics', None),
+}
+
+
+def summarize(samples, errors, seconds):
+    """Percentiles (ms), mean and throughput for one list of latencies"""
+    ordered = sorted(samples)
+    result = {'count': len(ordered), 'errors': errors}
+    if ordered:
+        for q in QUANTILES:
+            result[f'p{int(q * 100)}_ms'] = round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+        result['mean_ms'] = round(sum(ordered) / len(ordered) * 1000, 3)
+    result['rps'] = round(len(ordered) / seconds, 1) if seconds else None
+    return result
+
+
+def _peak_rss_kb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def run_test_client(path, requests, cases):
+    """Each case `requests` times in-process; returns per-route results"""
+    os.environ['COMMUNITY_DB'] = path
+    import database
+    database.DATABASE = path
+    from app import app
+
+    fixtures = Fixtures(path, requests)
+    client = app.test_client()
+    routes = {}
+    start = time.perf_counter()
+    for name in cases:
+        samples, errors = [], 0
+        case_start = time.perf_counter()
+        for _ in range(requests):
+            method, url, data = CASES[name](fixtures)
+            t = time.perf_counter()
+            response = client.open(url, method=method, data=data)
+            response.get_data()
+            samples.append(time.perf_counter() - t)
+            if response.status_code >= 400:
+                errors += 1
+        routes[name] = summarize(samples, errors, time.perf_counter() - case_start)
+    return {
+        'routes': routes,
+        'seconds': round(time.perf_counter() - start, 2),
+        'peak_rss_kb': _peak_rss_kb(),
+    }
+
+
+def _process_tree(pid):
+    """pid plus all descendants (Linux /proc)"""
+    pids = [pid]
+    for p in pids:
+        try:
+            with open(f'/proc/{p}/task/{p}/children') as f:
+                pids.extend(int(c) for c in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def _vm_hwm_kb(pid):
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except OSError:
+        return None
+
+
+def _wait_for_port(port, timeout=15):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/stats/db-pool')
+            conn.getresponse().read()
+            return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f'gunicorn did not start on port {port}')
+
+
+def _encode_form(data):
+    """(body, content type) for form data, multipart when it holds a file"""
+    if not any(isinstance(v, tuple) for v in data.values()):
+        return urlencode(data).encode(), 'application/x-www-form-urlencoded'
+    boundary = 'benchboundary'
+    parts = []
+    for key, value in data.items():
+        if isinstance(value, tuple):
+            stream, filename = value
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"; '
+                         f'filename="{filename}"\r\n\r\n'.encode() + stream.read() + b'\r\n')
+        else:
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n'
+                         f'{value}\r\n'.encode())
+    return b''.join(parts) + f'--{boundary}--\r\n'.encode(), f'multipart/form-data; boundary={boundary}'
+
+
+def run_gunicorn(path, requests, cases, workers, clients, port):
+    """Each case `requests` times spread over `clients` keep-alive HTTP clients"""
+    fixtures = Fixtures(path, requests)
+    env = dict(os.environ, COMMUNITY_DB=path)
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:app', '--workers', str(workers),
+         '--threads', '2', '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    try:
+        _wait_for_port(port)
+        routes = {}
+        start = time.perf_counter()
+        for name in cases:
+            samples, errors = [], []
+            lock = threading.Lock()
+            remaining = itertools.count()
+
+            def worker():
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                local, failed = [], 0
+                while next(remaining) < requests:
+                    method, url, data = CASES[name](fixtures)
+                    body, headers = None, {}
+                    if data is not None:
+                        body, headers['Content-Type'] = _encode_form(data)
+                    t = time.perf_counter()
+                    try:
+                        conn.request(method, url, body=body, headers=headers)
+                        response = conn.getresponse()
+                        response.read()
+                        if response.status >= 400:
+                            failed += 1
+                    except (OSError, http.client.HTTPException):
+                        failed += 1
+                        conn.close()
+                        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                    local.append(time.perf_counter() - t)
+                conn.close()
+                with lock:
+                    samples.extend(local)
+                    errors.append(failed)
+
+            case_start = time.perf_counter()
+            threads = [threading.Thread(target=worker) for _ in range(clients)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            routes[name] = summarize(samples, sum(errors), time.perf_counter() - case_start)
+        rss = {pid: _vm_hwm_kb(pid) for pid in _process_tree(server.pid)}
+        return {
+            'routes': routes,
+            'seconds': round(time.perf_counter() - start, 2),
+            'workers': workers,
+            'clients': clients,
+            'peak_rss_kb': max((v for v in rss.values() if v), default=None),
+            'peak_rss_total_kb': sum(v for v in rss.values() if v) or None,
+        }
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+# Runs in a fresh interpreter; argv[1] is the parent's clock at spawn
+STARTUP_PROBE = '''
+import json, sys, time
+started = time.time()
+import app
+imported = time.time()
+status = app.app.test_client().get('/').status_code
+done = time.time()
+print(json.dumps({'spawn_ms': (started - float(sys.argv[1])) * 1000, 'import_ms': (imported - started) * 1000,
+                  'first_response_ms': (done - imported) * 1000, 'total_ms': (done - float(sys.argv[1])) * 1000,
+                  'status': status}))
+'''
+
+
+def _startup_sample(db, cache_dir):
+    env = dict(os.environ, COMMUNITY_DB=db, JINJA_CACHE_DIR=cache_dir)
+    out = subprocess.run([sys.executable, '-c', STARTUP_PROBE, repr(time.time())], env=env, check=True,
+                         capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    return json.loads(out.splitlines()[-1])
+
+
+def _median_phases(samples):
+    phases = {}
+    for key in ('spawn_ms', 'import_ms', 'first_response_ms', 'total_ms'):
+        values = sorted(s[key] for s in samples)
+        phases[key] = round(values[len(values) // 2], 1)
+    phases['errors'] = sum(s['status'] >= 400 for s in samples)
+    return phases
+
+
+def _gunicorn_startup(db, workers, port, preload):
+    env = dict(os.environ, COMMUNITY_DB=db, GUNICORN_PRELOAD='1' if preload else '0')
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', 'app:app', '--workers', str(workers),
+         '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+        cwd=os.path.dirname(os.path.abspath(__file__)), env=env)
+    try:
+        _wait_for_port(port)
+        return round((time.perf_counter() - start) * 1000, 1)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+def startup(path, samples=5, gunicorn=False, workers=4, port=8765):
+    """Median cold-start phases per scenario, in milliseconds"""
+    result = {'meta': _metadata(path), 'samples': samples, 'scenarios': {}}
+    with tempfile.TemporaryDirectory() as scratch:
+        copy = os.path.join(scratch, 'bench.db')
+        shutil.copy(path, copy)
+        warm = os.path.join(scratch, 'jinja-warm')
+        os.mkdir(warm)
+        runs = {'empty database': [], 'current schema, cold templates': [], 'current schema, warm templates': []}
+        # Migrates the copy and primes the warm bytecode cache
+        _startup_sample(copy, warm)
+        for n in range(samples):
+            empty = os.path.join(scratch, f'empty-{n}.db')
+            cold = tempfile.mkdtemp(dir=scratch)
+            runs['empty database'].append(_startup_sample(empty, cold))
+            runs['current schema, cold templates'].append(_startup_sample(copy, tempfile.mkdtemp(dir=scratch)))
+            runs['current schema, warm templates'].append(_startup_sample(copy, warm))
+        result['scenarios'] = {name: _median_phases(runs[name]) for name in runs}
+        if gunicorn:
+            result['gunicorn_first_response_ms'] = {
+                f'{mode}': _gunicorn_startup(copy, workers, port, mode == 'preload')
+                for mode in ('no preload', 'preload')}
+    return result
+
+
+# A steady mix of page reads, API reads and contribution writes
+BACKUP_LOAD = ('view_event', 'view_volunteer', 'event_list', 'api_event', 'add_contribution')
+
+
+def _load(port, fixtures, clients, rate, stop):
+    """Run BACKUP_LOAD round-robin on `clients` threads at `rate` requests a
+    second in all until stop is set; returns (start time, latency, status)
+    per request, status None when the request failed outright"""
+    samples = []
+    lock = threading.Lock()
+    interval = clients / rate
+
+    def worker(offset):
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        local = []
+        due = time.perf_counter() + interval * offset / clients
+        for n in itertools.count(offset):
+            # A fixed schedule leaves the server headroom, like real traffic
+            time.sleep(max(0.0, due - time.perf_counter()))
+            due += interval
+            if stop.is_set():
+                break
+            method, url, data = CASES[BACKUP_LOAD[n % len(BACKUP_LOAD)]](fixtures)
+            body, headers = None, {}
+            if data is not None:
+                body, headers['Content-Type'] = _encode_form(data)
+            t = time.perf_counter()
+            try:
+                conn.request(method, url, body=body, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except (OSError, http.client.HTTPException):
+                status = None
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+            local.append((t, time.perf_counter() - t, status))
+        conn.close()
+        with lock:
+            samples.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(clients)]
+    for t in threads:
+        t.start()
+    return threads, samples
+
+
+def backup_latency(path, seconds=10, workers=4, clients=8, rate=40, port=8765, pages=None, sleep=None):
+    """Request latency under a read/write load with no backup running, while
+    the file is copied (the old practice), and during paced and one-step
+    backups; each phase repeats its operation for at least `seconds`"""
+    import backup
+    pages = backup.STEP_PAGES if pages is None else pages
+    sleep = backup.STEP_SLEEP if sleep is None else sleep
+    result = {'meta': _metadata(path), 'workers': workers, 'clients': clients, 'rate': rate,
+              'step_pages': pages, 'step_sleep': sleep, 'phases': {}}
+    with tempfile.TemporaryDirectory() as scratch:
+        copy = os.path.join(scratch, 'bench.db')
+        shutil.copy(path, copy)
+        here = os.path.dirname(os.path.abspath(__file__))
+        # Backups run as `backup.py run`, the way the schedule takes them
+        backup_env = dict(os.environ, COMMUNITY_DB=copy, COMMUNITY_BACKUP_DIR=os.path.join(scratch, 'backups'))
+
+        def take_backup(step_pages, step_sleep):
+            subprocess.run([sys.executable, 'backup.py', 'run', '--keep', '1', '--pages', str(step_pages),
+                            '--sleep', str(step_sleep)], cwd=here, env=backup_env, check=True, capture_output=True)
+
+        operations = {
+            'no backup': lambda: time.sleep(seconds),
+            'file copy': lambda: shutil.copyfile(copy, os.path.join(scratch, 'copy.db')),
+            'backup, paced': lambda: take_backup(pages, sleep),
+            'backup, one step': lambda: take_backup(-1, 0),
+        }
+        fixtures = Fixtures(copy, 0)
+        env = dict(os.environ, COMMUNITY_DB=copy)
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', 'app:app', '--workers', str(workers),
+             '--bind', f'127.0.0.1:{port}', '--log-level', 'warning'],
+            cwd=here, env=env)
+        stop = threading.Event()
+        try:
+            _wait_for_port(port)
+            threads, samples = _load(port, fixtures, clients, rate, stop)
+            time.sleep(2)  # warm the workers' caches first
+            windows = {}
+            for name, operation in operations.items():
+                start, runs = time.perf_counter(), []
+                while not runs or time.perf_counter() - start < seconds:
+                    t = time.perf_counter()
+                    operation()
+                    runs.append(time.perf_counter() - t)
+                windows[name] = (start, time.perf_counter(), runs)
+            stop.set()
+            for t in threads:
+                t.join()
+        finally:
+            stop.set()
+            server.terminate()
+            server.wait(timeout=10)
+        for name, (start, end, runs) in windows.items():
+            window = [(latency, status) for t, latency, status in samples if start <= t < end]
+            failed = [str(status) for _, status in window if status is None or status >= 400]
+            phase = summarize([latency for latency, _ in window], len(failed), end - start)
+            phase['max_ms'] = round(max((latency for latency, _ in window), default=0) * 1000, 3)
+            phase['error_statuses'] = {status: failed.count(status) for status in sorted(set(failed))}
+            if name != 'no backup':
+                phase['runs'] = len(runs)
+                phase['seconds_per_run'] = round(sum(runs) / len(runs), 3)
+            result['phases'][name] = phase
+    return result
+
+
+_SYLLABLES = ('ka', 'ri', 'mo', 'ten', 'sa', 'lu', 'ber', 'no', 'vi', 'an', 'del', 'go', 'shi', 'ra', 'wen',
+              'to', 'mar', 'li', 'son', 'fe', 'ya', 'kin', 'do', 'ze', 'ha', 'rus', 'pe', 'lo', 'mi', 'gan')
+
+
+def _identity_people(rng, n):
+    """n (first, last) names; about one in twenty is shared with someone else"""
+    word = lambda k: ''.join(rng.choice(_SYLLABLES) for _ in range(k)).capitalize()
+    people = [(word(2), word(rng.choice((2, 3)))) for _ in range(n)]
+    for i in rng.sample(range(n), n // 20):
+        people[i] = people[rng.randrange(n)]
+    return people
+
+
+def _typo(rng, text):
+    i = rng.randrange(1, len(text) - 2)
+    return text[:i] + text[i + 1] + text[i] + text[i + 2:]
+
+
+def _identity_rows(rng, people):
+    """Volunteers plus one free-text contribution each, typed the way people
+    do, with the volunteer index it belongs to (None for newcomers)"""
+    volunteers = [(f'{first} {last}', f'{first}.{last}{i}@example.org'.lower(), f'555-{1000000 + i:07d}')
+                  for i, (first, last) in enumerate(people)]
+    strangers = _identity_people(rng, len(people) // 8)
+    orphans = []
+    for i in range(len(people)):
+        if i % 8 == 7:
+            first, last = strangers[i // 8]
+            orphans.append((f'{first} {last}', '', None))
+            continue
+        v = rng.randrange(len(people))
+        first, last = people[v]
+        name, email, phone = volunteers[v]
+        orphans.append(rng.choice((
+            (name, '', v),
+            (f'{last}, {first}'.upper(), '', v),
+            (f'{_typo(rng, first)} {last}', '', v),
+            (f'{first[0]}. {last}', email.upper(), v),
+            (f'{first} {_typo(rng, last)}', phone[-7:], v),
+        )))
+    return volunteers, orphans
+
+
+def identity_matching(sizes=(2500, 5000, 10000, 20000), seed=42):
+    """A full identity-matching run per size on a scratch database"""
+    import random
+    import database
+    import identity
+    result = {'sizes': [], 'auto_link': identity.AUTO_LINK, 'review': identity.REVIEW}
+    for n in sizes:
+        rng = random.Random(seed)
+        volunteers, orphans = _identity_rows(rng, _identity_people(rng, n))
+        with tempfile.TemporaryDirectory() as scratch:
+            database.DATABASE = os.path.join(scratch, 'identity.db')
+            database.init_db()
+            conn = database.connect()
+            with database.transaction(conn):
+                conn.execute("INSERT INTO event_profiles (event_name, event_date) VALUES ('Bench', '2030-01-01')")
+                conn.executemany('INSERT INTO volunteers (name, email, phone) VALUES (?, ?, ?)', volunteers)
+                # Volunteer i has id i + 1
+                conn.executemany('INSERT INTO contributions (event_id, volunteer_name, volunteer_contact) '
+                                 'VALUES (1, ?, ?)', [row[:2] for row in orphans])
+            start = time.perf_counter()
+            counts = identity.resolve(conn)
+            seconds = time.perf_counter() - start
+            linked = conn.execute('SELECT id, volunteer_id FROM contributions WHERE volunteer_id IS NOT NULL')
+            truth = {i + 1: (None if row[2] is None else row[2] + 1) for i, row in enumerate(orphans)}
+            links = linked.fetchall()
+            correct = sum(truth[row[0]] == row[1] for row in links)
+            proposed = conn.execute("SELECT contribution_id, volunteer_id FROM identity_matches WHERE status = 'pending'")
+            found = correct + sum(truth[row[0]] == row[1] for row in proposed.fetchall())
+            conn.close()
+        matchable = sum(row[2] is not None for row in orphans)
+        result['sizes'].append({
+            'volunteers': n, 'contributions': len(orphans), 'seconds': round(seconds, 3),
+            'us_per_contribution': round(seconds / len(orphans) * 1e6, 1),
+            'comparisons': counts['comparisons'], 'all_pairs': n * len(orphans),
+            'linked': counts['linked'], 'for_review': counts['pending'], 'unmatched': counts['unmatched'],
+            'link_precision': round(correct / len(links), 4) if links else None,
+            'link_recall': round(correct / matchable, 4),
+            'recall_with_review': round(found / matchable, 4),
+        })
+    return result
+
+
+def _metadata(path):
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    conn = sqlite3.connect(path)
+    contributions = conn.execute('SELECT COUNT(*) FROM contributions').fetchone()[0]
+    conn.close()
+    return {
+        'commit': commit,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'platform': platform.platform(),
+        'database': os.path.abspath(path),
+        'contributions': contributions,
+    }
+
+
+def run(path, out, requests=50, cases=None, gunicorn=False, workers=4, clients=16, port=8765):
+    """Benchmark a scratch copy of the database at path and write JSON to out"""
+    cases = cases or list(CASES)
+    unknown = set(cases) - set(CASES)
+    if unknown:
+        raise ValueError(f"Unknown cases: {', '.join(sorted(unknown))}")
+    result = {'meta': _metadata(path), 'requests_per_route': requests}
+    with tempfile.TemporaryDirectory() as scratch:
+        copy = os.path.join(scratch, 'bench.db')
+        shutil.copy(path, copy)
+        if gunicorn:
+            # Before the in-process run, which would otherwise share this process's pool
+            result['gunicorn'] = run_gunicorn(copy, requests, cases, workers, clients, port)
+            shutil.copy(path, copy)
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(copy + suffix):
+                    os.remove(copy + suffix)
+        result['test_client'] = run_test_client(copy, requests, cases)
+    with open(out, 'w') as f:
+        json.dump(result, f, indent=2)
+    return result
+
+
+def compare(before, after):
+    """Yield (mode, route, before p95, after p95, ratio) for routes in both files"""
+    with open(before) as f:
+        old = json.load(f)
+    with open(after) as f:
+        new = json.load(f)
+    for mode in ('test_client', 'gunicorn'):
+        if mode not in old or mode not in new:
+            continue
+        for route, stats in new[mode]['routes'].items():
+            previous = old[mode]['routes'].get(route)
+            if not previous or 'p95_ms' not in previous or 'p95_ms' not in stats:
+                continue
+            ratio = stats['p95_ms'] / previous['p95_ms'] if previous['p95_ms'] else None
+            yield mode, route, previous['p95_ms'], stats['p95_ms'], ratio
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Benchmark the app against a seeded database')
+    sub = parser.add_subparsers(dest='command', required=True)
+    run_parser = sub.add_parser('run')
+    run_parser.add_argument('database')
+    run_parser.add_argument('--out', default='bench.json')
+    run_parser.add_argument('--requests', type=int, default=50, help='requests per route')
+    run_parser.add_argument('--cases', help='comma separated subset of routes')
+    run_parser.add_argument('--gunicorn', action='store_true', help='also benchmark over HTTP')
+    run_parser.add_argument('--workers', type=int, default=4)
+    run_parser.add_argument('--clients', type=int, default=16)
+    run_parser.add_argument('--port', type=int, default=8765)
+    startup_parser = sub.add_parser('startup')
+    startup_parser.add_argument('database')
+    startup_parser.add_argument('--samples', type=int, default=5)
+    startup_parser.add_argument('--out')
+    startup_parser.add_argument('--gunicorn', action='store_true', help='also time a gunicorn server to first response')
+    startup_parser.add_argument('--workers', type=int, default=4)
+    startup_parser.add_argument('--port', type=int, default=8765)
+    backup_parser = sub.add_parser('backup')
+    backup_parser.add_argument('database')
+    backup_parser.add_argument('--seconds', type=float, default=10, help='minimum length of each phase')
+    backup_parser.add_argument('--pages', type=int, help='pages per backup step (default BACKUP_STEP_PAGES)')
+    backup_parser.add_argument('--sleep', type=float, help='pause after each step (default BACKUP_STEP_SLEEP)')
+    backup_parser.add_argument('--out')
+    backup_parser.add_argument('--workers', type=int, default=4)
+    backup_parser.add_argument('--clients', type=int, default=8)
+    backup_parser.add_argument('--rate', type=float, default=40, help='requests per second across all clients')
+    backup_parser.add_argument('--port', type=int, default=8765)
+    identity_parser = sub.add_parser('identity')
+    identity_parser.add_argument('--sizes', default='2500,5000,10000,20000', help='volunteers per run')
+    identity_parser.add_argument('--out')
+    compare_parser = sub.add_parser('compare')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        result = run(args.database, args.out, args.requests, args.cases.split(',') if args.cases else None,
+                     args.gunicorn, args.workers, args.clients, args.port)
+        for mode in ('test_client', 'gunicorn'):
+            if mode in result:
+                print(f"{mode}: {result[mode]['seconds']}s, peak RSS {result[mode]['peak_rss_kb']} KiB")
+                for route, stats in result[mode]['routes'].items():
+                    print(f"  {route:24} p50 {stats.get('p50_ms', '-'):>9} ms  p95 {stats.get('p95_ms', '-'):>9} ms"
+                          f"  {stats['rps']:>8} req/s  errors {stats['errors']}")
+        print(f'Results written to {args.out}')
+    elif args.command == 'startup':
+        result = startup(args.database, args.samples, args.gunicorn, args.workers, args.port)
+        for name, phases in result['scenarios'].items():
+            print(f"{name:32} total {phases['total_ms']:>7} ms  (interpreter {phases['spawn_ms']}, "
+                  f"import {phases['import_ms']}, first response {phases['first_response_ms']})"
+                  f"  errors {phases['errors']}")
+        for mode, ms in result.get('gunicorn_first_response_ms', {}).items():
+            print(f'gunicorn {mode:23} first response after {ms} ms')
+        if args.out:
+            with open(args.out, 'w') as f:
+                json.dump(result, f, indent=2)
+    elif args.command == 'backup':
+        result = backup_latency(args.database, args.seconds, args.workers, args.clients, args.rate, args.port,
+                                args.pages, args.sleep)
+        for name, phase in result['phases'].items():
+            timing = f"  {phase['runs']} x {phase['seconds_per_run']}s" if 'runs' in phase else ''
+            print(f"{name:18} p50 {phase.get('p50_ms', '-'):>8} ms  p99 {phase.get('p99_ms', '-'):>8} ms"
+                  f"  max {phase['max_ms']:>8} ms  {phase['rps']:>7} req/s  errors {phase['errors']}{timing}")
+            if phase['error_statuses']:
+                print(f"{'':18} error statuses {phase['error_statuses']}")
+        if args.out:
+            with open(args.out, 'w') as f:
+                json.dump(result, f, indent=2)
+    elif args.command == 'identity':
+        result = identity_matching([int(n) for n in args.sizes.split(',')])
+        for size in result['sizes']:
+            print(f"{size['volunteers']:>7} volunteers  {size['seconds']:>7}s  "
+                  f"{size['us_per_contribution']:>6} us/contribution  {size['comparisons']:>8} comparisons"
+                  f" (all pairs {size['all_pairs']})  linked {size['linked']}, review {size['for_review']}, "
+                  f"unmatched {size['unmatched']}  precision {size['link_precision']}  recall {size['link_recall']}"
+                  f" ({size['recall_with_review']} with review)")
+        if args.out:
+            with open(args.out, 'w') as f:
+                json.dump(result, f, indent=2)
+    else:
+        regressions = 0
+        for mode, route, old_p95, new_p95, ratio in compare(args.before, args.after):
+            flag = ratio is not None and ratio > REGRESSION_RATIO
+            regressions += flag
+            print(f"{'SLOWER' if flag else '      '} {mode:11} {route:24} p95 {old_p95:>9} -> {new_p95:>9} ms"
+                  + (f'  x{ratio:.2f}' if ratio else ''))
+        sys.exit(1 if regressions else 0)
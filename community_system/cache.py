@@ -0,0 +1,93 @@
+"""In-process result caches"""
+import threading
+import time
+
+
+class TTLCache:
+    """Thread-safe key/value cache whose entries expire after `ttl` seconds.
+
+    get_or_compute() lets only one caller per key run the expensive
+    computation; concurrent callers wait for and share its result. clear()
+    also discards results computed concurrently with it, so a value read
+    before a write can never be stored after that write's invalidation.
+    Each gunicorn worker has its own copy, so other workers may serve a
+    value up to `ttl` seconds old after a write. With `maxsize`, storing
+    past that many entries drops expired ones and then the oldest. A key's
+    compute lock lives only while callers are computing or waiting on it.
+    """
+
+    def __init__(self, ttl, maxsize=None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = {}
+        self._lock = threading.Lock()
+        self._compute_locks = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _lookup(self, key):
+        entry = self._data.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            return True, entry[1]
+        return False, None
+
+    def _store(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        if self.maxsize is not None and len(self._data) > self.maxsize:
+            now = time.monotonic()
+            for stale in [k for k, (expires, _) in self._data.items() if expires <= now]:
+                del self._data[stale]
+            # Entries share one ttl, so the earliest expiry is the oldest entry
+            while len(self._data) > self.maxsize:
+                del self._data[min(self._data, key=lambda k: self._data[k][0])]
+
+    def get(self, key, default=None):
+        with self._lock:
+            found, value = self._lookup(key)
+        return value if found else default
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def get_or_compute(self, key, compute):
+        """Return the cached value for key, calling compute() at most once per expiry"""
+        with self._lock:
+            found, value = self._lookup(key)
+            if found:
+                self.hits += 1
+                return value
+            # [lock, callers using it]; dropped by the last caller out
+            entry = self._compute_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                with self._lock:
+                    # Another caller may have filled it while we waited
+                    found, value = self._lookup(key)
+                    if found:
+                        self.hits += 1
+                        return value
+                    self.misses += 1
+                    generation = self._generation
+                value = compute()
+                with self._lock:
+                    if generation == self._generation:
+                        self._store(key, value)
+                return value
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if entry[1] == 0:
+                    del self._compute_locks[key]
+
+    def clear(self):
+        """Drop every entry (call after a write that affects cached data)"""
+        with self._lock:
+            self._data.clear()
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._data), 'hits': self.hits, 'misses': self.misses}
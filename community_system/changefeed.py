@@ -0,0 +1,328 @@
+"""Live change feed for dashboards (Server-Sent Events)
+
+The write routes call publish() inside their transaction, appending a small
+delta (contribution added, event edited, ...) to the change_log table; it
+commits or rolls back with the write it describes. GET /stream pushes
+those deltas, plus refreshed dashboard totals, to every connected screen.
+
+Fan-out costs O(writes), not O(screens x polls): each worker runs one
+poller thread, only while it has subscribers, that checks
+`PRAGMA data_version` every STREAM_POLL_INTERVAL seconds. That pragma only
+changes when another connection has committed, so an idle database costs
+one pragma per interval per worker. After a commit the poller reads the
+new change_log rows and, when events or contributions changed, the
+dashboard figures, once, and hands the same messages to all of the
+worker's subscribers. Totals are pushed for any such change, including
+imports, archiving and restores, which publish no deltas.
+
+Each open stream occupies one gunicorn thread for as long as it is open.
+Under gunicorn the per-worker limit is therefore derived from the worker's
+real thread count (gunicorn.conf.py calls configure() after fork): every
+thread beyond STREAM_RESERVED_THREADS may hold a stream, and the reserved
+ones always remain for ordinary requests. Beyond the limit /stream answers
+503 and the page retries later. STREAM_MAX_SUBSCRIBERS overrides the
+derived limit. Each stream is closed after STREAM_MAX_SECONDS; EventSource
+reconnects by itself and, through Last-Event-ID, replays whatever it
+missed from change_log.
+
+The trade-off: more streams per worker means fewer threads for page
+requests, so raise GUNICORN_THREADS rather than the limit when more
+screens are needed. A shorter STREAM_MAX_SECONDS rotates threads between
+screens faster but costs a snapshot query per reconnect.
+"""
+import json
+import os
+import queue
+import threading
+import time
+
+import database
+import queries
+import versions
+
+POLL_INTERVAL = float(os.environ.get('STREAM_POLL_INTERVAL', 0.25))
+# Threads per worker that streams may never take
+RESERVED_THREADS = int(os.environ.get('STREAM_RESERVED_THREADS', 2))
+# Used as is outside gunicorn (the development server has no thread limit)
+MAX_SUBSCRIBERS = int(os.environ.get('STREAM_MAX_SUBSCRIBERS', 2))
+MAX_SECONDS = float(os.environ.get('STREAM_MAX_SECONDS', 300))
+HEARTBEAT = 15
+
+# change_log keeps about this many rows; older ones are trimmed by publish()
+KEEP = int(os.environ.get('CHANGE_LOG_KEEP', 10000))
+TRIM_EVERY = 500
+
+# Most rows replayed to a reconnecting client; beyond that it just reloads
+REPLAY_LIMIT = 500
+
+# A subscriber this many messages behind is dropped and told to reload
+QUEUE_SIZE = 1000
+
+DASHBOARD_TABLES = ('event_profiles', 'contributions')
+
+EVENT_FIELDS = ('id', 'event_name', 'event_date', 'quarter', 'status', 'event_type_id', 'organization_id')
+CONTRIBUTION_FIELDS = ('id', 'event_id', 'volunteer_id', 'volunteer_name', 'volunteer_hours', 'cash_donation',
+                       'material_description', 'material_value', 'created_at')
+
+
+# ---------- Publishing ----------
+
+def publish(cursor, kind, payload):
+    """Record a delta in the caller's transaction; returns its change id"""
+    cursor.execute('INSERT INTO change_log (kind, payload) VALUES (?, ?)', (kind, json.dumps(payload)))
+    change_id = cursor.lastrowid
+    if change_id % TRIM_EVERY == 0:
+        cursor.execute('DELETE FROM change_log WHERE id <= ?', (change_id - KEEP,))
+    return change_id
+
+
+def _row(cursor, table, fields, row_id):
+    cursor.execute(f"SELECT {', '.join(fields)} FROM {table} WHERE id = ?", (row_id,))
+    row = cursor.fetchone()
+    return dict(zip(fields, row)) if row else {'id': row_id}
+
+
+def publish_event(cursor, kind, event_id):
+    """Publish event.added / event.updated with the event's listed fields"""
+    return publish(cursor, kind, _row(cursor, 'event_profiles', EVENT_FIELDS, event_id))
+
+
+def publish_contribution(cursor, contribution_id):
+    """Publish contribution.added with the new row and its event's name"""
+    payload = _row(cursor, 'contributions', CONTRIBUTION_FIELDS, contribution_id)
+    cursor.execute('SELECT event_name FROM event_profiles WHERE id = ?', (payload.get('event_id'),))
+    row = cursor.fetchone()
+    payload['event_name'] = row[0] if row else None
+    return publish(cursor, 'contribution.added', payload)
+
+
+# ---------- Fan-out ----------
+
+def _dashboard_message(cursor):
+    dashboard = queries.dashboard(cursor)
+    return {
+        'total_events': dashboard['total_events'], 'total_hours': dashboard['total_hours'],
+        'total_cash': dashboard['total_cash'], 'total_material': dashboard['total_material'],
+        'recent_events': [{**{f: event[f] for f in EVENT_FIELDS}, 'event_type_name': event['event_type_name']}
+                          for event in dashboard['recent_events']],
+    }
+
+
+class ChangeBus:
+    """Per-process subscriber registry fed by one data_version poller"""
+
+    def __init__(self, interval=POLL_INTERVAL, max_subscribers=MAX_SUBSCRIBERS):
+        self.interval = interval
+        self.max_subscribers = max_subscribers
+        self._lock = threading.Lock()
+        self._pid = None
+        self.polls = 0
+        self.fetches = 0
+        self.messages = 0
+        self.dropped = 0
+
+    def _ensure_reset(self):
+        # Caller holds the lock. Threads do not survive fork(): each worker
+        # keeps its own subscribers and poller
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._subscribers = set()
+            self._thread = None
+            self._last_id = None
+            self._rewound = False
+            self._versions = None
+            self.polls = self.fetches = self.messages = self.dropped = 0
+
+    def full(self):
+        with self._lock:
+            self._ensure_reset()
+            return len(self._subscribers) >= self.max_subscribers
+
+    def subscribe(self, since):
+        """A queue of (id, event name, data) messages for changes after the
+        change id `since` (the caller's snapshot); None once full.
+
+        Changes up to `since` may be delivered again; stream() skips them.
+        """
+        with self._lock:
+            self._ensure_reset()
+            if len(self._subscribers) >= self.max_subscribers:
+                return None
+            subscriber = queue.Queue(QUEUE_SIZE)
+            self._subscribers.add(subscriber)
+            # Rewinding re-reads anything committed between the caller's
+            # snapshot and this call that the poller has already sent
+            if self._last_id is None or since < self._last_id:
+                self._last_id = since
+                self._rewound = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='change-feed', daemon=True)
+                self._thread.start()
+            return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._ensure_reset()
+            self._subscribers.discard(subscriber)
+
+    def _broadcast(self, messages):
+        with self._lock:
+            subscribers = list(self._subscribers)
+            self.messages += len(messages)
+        for subscriber in subscribers:
+            try:
+                for message in messages:
+                    subscriber.put_nowait(message)
+            except queue.Full:
+                # Too far behind to catch up; the client reloads instead
+                self.unsubscribe(subscriber)
+                with self._lock:
+                    self.dropped += 1
+                try:
+                    subscriber.get_nowait()
+                except queue.Empty:
+                    pass
+                subscriber.put_nowait((None, 'reload', {}))
+
+    def _run(self):
+        conn = database.connect()
+        try:
+            cursor = conn.cursor()
+            data_version = None
+            while True:
+                with self._lock:
+                    if not self._subscribers:
+                        self._thread = None
+                        return
+                current = cursor.execute('PRAGMA data_version').fetchone()[0]
+                with self._lock:
+                    self.polls += 1
+                    rewound, self._rewound = self._rewound, False
+                if current != data_version or rewound:
+                    data_version = current
+                    self._fetch(conn)
+                time.sleep(self.interval)
+        finally:
+            conn.close()
+
+    def _fetch(self, conn):
+        """New change_log rows and, if they changed, the dashboard figures"""
+        cursor = conn.cursor()
+        messages = []
+        # One read transaction, so the deltas and the totals agree
+        cursor.execute('BEGIN')
+        try:
+            cursor.execute('SELECT COALESCE(MAX(id), 0) FROM change_log')
+            newest = cursor.fetchone()[0]
+            with self._lock:
+                last_id = self._last_id
+            if newest < last_id:
+                # The log went backwards: a backup was restored
+                messages.append((None, 'reload', {}))
+                last_id = newest
+            cursor.execute('SELECT id, kind, payload FROM change_log WHERE id > ? ORDER BY id', (last_id,))
+            for change_id, kind, payload in cursor.fetchall():
+                messages.append((change_id, kind, json.loads(payload)))
+                last_id = change_id
+            with self._lock:
+                # A subscribe() meanwhile may have rewound further
+                if not self._rewound:
+                    self._last_id = last_id
+            current = versions.get_versions(cursor, DASHBOARD_TABLES)
+            if current != self._versions:
+                first = self._versions is None
+                self._versions = current
+                if not first or messages:
+                    messages.append((None, 'totals', _dashboard_message(cursor)))
+        finally:
+            conn.rollback()
+        with self._lock:
+            self.fetches += 1
+        if messages:
+            self._broadcast(messages)
+
+    def stats(self):
+        with self._lock:
+            self._ensure_reset()
+            return {'subscribers': len(self._subscribers), 'max_subscribers': self.max_subscribers,
+                    'polls': self.polls, 'fetches': self.fetches, 'messages': self.messages,
+                    'dropped': self.dropped}
+
+
+bus = ChangeBus()
+
+
+def subscriber_limit(threads):
+    """Streams a worker with `threads` request threads may hold"""
+    if os.environ.get('STREAM_MAX_SUBSCRIBERS'):
+        return MAX_SUBSCRIBERS
+    return max(threads - RESERVED_THREADS, 0)
+
+
+def configure(threads):
+    """Size this worker's stream limit from its request thread count"""
+    bus.max_subscribers = subscriber_limit(threads)
+
+
+# ---------- Streaming ----------
+
+def format_event(change_id, name, data):
+    lines = [f'id: {change_id}'] if change_id is not None else []
+    lines += [f'event: {name}', f'data: {json.dumps(data, separators=(",", ":"))}']
+    return '\n'.join(lines) + '\n\n'
+
+
+def replay(cursor, last_id):
+    """Messages after last_id still in change_log, or a reload when the
+    client has missed more than the log (or REPLAY_LIMIT) holds"""
+    cursor.execute('SELECT MIN(id), MAX(id) FROM change_log')
+    oldest, newest = cursor.fetchone()
+    if newest is None or last_id >= newest:
+        return [] if newest is None or last_id == newest else [(None, 'reload', {})]
+    if last_id < oldest - 1 or newest - last_id > REPLAY_LIMIT:
+        return [(None, 'reload', {})]
+    cursor.execute('SELECT id, kind, payload FROM change_log WHERE id > ? ORDER BY id', (last_id,))
+    return [(change_id, kind, json.loads(payload)) for change_id, kind, payload in cursor.fetchall()]
+
+
+def snapshot(cursor, last_id=None):
+    """(newest change id, initial messages) for a new stream: current
+    totals, plus what a reconnecting client missed since last_id"""
+    cursor.execute('BEGIN')
+    try:
+        cursor.execute('SELECT COALESCE(MAX(id), 0) FROM change_log')
+        newest = cursor.fetchone()[0]
+        messages = replay(cursor, last_id) if last_id is not None else []
+        messages.append((None, 'totals', _dashboard_message(cursor)))
+    finally:
+        cursor.connection.rollback()
+    return newest, messages
+
+
+def stream(subscriber, since, initial, max_seconds=MAX_SECONDS):
+    """SSE body: the initial messages, then the bus's messages for changes
+    after since, with a comment every HEARTBEAT seconds to keep proxies open"""
+    try:
+        yield 'retry: 3000\n\n'
+        for message in initial:
+            yield format_event(*message)
+        deadline = time.monotonic() + max_seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            try:
+                message = subscriber.get(timeout=min(HEARTBEAT, remaining))
+            except queue.Empty:
+                yield ': keepalive\n\n'
+                continue
+            change_id, name, _ = message
+            if change_id is not None:
+                if change_id <= since:
+                    continue
+                since = change_id
+            yield format_event(*message)
+            if name == 'reload':
+                return
+    finally:
+        bus.unsubscribe(subscriber)
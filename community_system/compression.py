@@ -0,0 +1,70 @@
+"""gzip / brotli compression of HTML and JSON responses
+
+Installed by app.py unless COMMUNITY_COMPRESS=0 (e.g. behind a proxy that
+compresses already). Brotli is used when the optional brotli package is
+installed and the client accepts it, gzip otherwise. Streamed responses
+(exports) and files served by send_file (assets, which have precompressed
+variants) are left alone, as are bodies too small to be worth it.
+
+A compressed body is a different representation, so a strong ETag on it is
+weakened; If-None-Match comparisons stay valid because they are weak.
+"""
+import gzip
+import os
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 512))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+MIMETYPES = {'text/html', 'application/json'}
+
+
+def enabled():
+    return os.environ.get('COMMUNITY_COMPRESS', '1').lower() in ('1', 'true', 'yes')
+
+
+def _encoding():
+    accepted = request.accept_encodings
+    if brotli is not None and accepted.quality('br'):
+        return 'br'
+    if accepted.quality('gzip'):
+        return 'gzip'
+    return None
+
+
+def compress_response(response):
+    """after_request hook compressing eligible bodies for the client"""
+    if (response.mimetype not in MIMETYPES or response.direct_passthrough or response.is_streamed
+            or 'Content-Encoding' in response.headers or response.status_code in (204, 304)):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = _encoding()
+    if encoding is None:
+        return response
+    body = response.get_data()
+    if len(body) < MIN_BYTES:
+        return response
+    if encoding == 'br':
+        body = brotli.compress(body, quality=BROTLI_QUALITY)
+    else:
+        body = gzip.compress(body, GZIP_LEVEL)
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    tag, weak = response.get_etag()
+    if tag and not weak:
+        response.set_etag(tag, weak=True)
+    return response
+
+
+def init_compression(app):
+    """Install the compression hook unless COMMUNITY_COMPRESS=0"""
+    if not enabled():
+        return False
+    app.after_request(compress_response)
+    return True
@@ -0,0 +1,133 @@
+"""Contribution inserts, optionally group-committed
+
+add() inserts one contribution (with its rollup update) and returns its id
+once committed. With CONTRIBUTION_GROUP_COMMIT=1, inserts from concurrent
+requests in this worker are queued for up to GROUP_COMMIT_WINDOW seconds
+and written in one transaction by a background thread, so a burst of
+sign-ups costs one fsync and one write lock instead of one each. Every
+caller still waits for the commit and gets its own id or its own error;
+a row that fails a constraint is rolled back alone via a savepoint.
+"""
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+import changefeed
+import database
+import rollups
+
+INSERT_SQL = '''
+    INSERT INTO contributions (event_id, volunteer_id, volunteer_name, volunteer_contact,
+                               volunteer_hours, cash_donation, material_description, material_value)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+GROUP_COMMIT = os.environ.get('CONTRIBUTION_GROUP_COMMIT', '').lower() in ('1', 'true', 'yes')
+GROUP_COMMIT_WINDOW = float(os.environ.get('GROUP_COMMIT_WINDOW', 0.005))
+GROUP_COMMIT_MAX = int(os.environ.get('GROUP_COMMIT_MAX', 200))
+
+# How long a request waits for its batch to commit
+SUBMIT_TIMEOUT = 30
+
+
+def insert(cursor, params):
+    """Insert one contribution inside the caller's transaction and return its id"""
+    cursor.execute(INSERT_SQL, params)
+    contribution_id = cursor.lastrowid
+    rollups.add_contribution(cursor, contribution_id)
+    changefeed.publish_contribution(cursor, contribution_id)
+    return contribution_id
+
+
+class GroupCommitter:
+    """Per-process queue of pending inserts drained by one writer thread"""
+
+    def __init__(self, window=GROUP_COMMIT_WINDOW, max_batch=GROUP_COMMIT_MAX):
+        self.window = window
+        self.max_batch = max_batch
+        self._lock = threading.Lock()
+        self._pid = None
+        self.batches = 0
+        self.rows = 0
+        self.largest_batch = 0
+
+    def _ensure_started(self):
+        # A thread and queue inherited across fork() are dead in the child
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._queue = queue.Queue()
+            threading.Thread(target=self._run, name='group-commit', daemon=True).start()
+
+    def submit(self, params, timeout=SUBMIT_TIMEOUT):
+        """Queue an insert and block until it is committed; returns the id"""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((params, future))
+        return future.result(timeout)
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        conn = database.connect()
+        while True:
+            self._commit(conn, self._collect())
+
+    def _commit(self, conn, batch):
+        cursor = conn.cursor()
+        done = []
+        try:
+            with database.transaction(conn):
+                for params, future in batch:
+                    cursor.execute('SAVEPOINT contribution')
+                    try:
+                        done.append((future, insert(cursor, params)))
+                        cursor.execute('RELEASE contribution')
+                    except sqlite3.IntegrityError as e:
+                        cursor.execute('ROLLBACK TO contribution')
+                        cursor.execute('RELEASE contribution')
+                        done.append((future, e))
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        with self._lock:
+            self.batches += 1
+            self.rows += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+        for future, result in done:
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self):
+        with self._lock:
+            return {'enabled': GROUP_COMMIT, 'batches': self.batches, 'rows': self.rows,
+                    'largest_batch': self.largest_batch}
+
+
+committer = GroupCommitter()
+
+
+def add(conn, params):
+    """Insert and commit one contribution; returns its id"""
+    if GROUP_COMMIT:
+        return committer.submit(params)
+    with database.transaction(conn):
+        return insert(conn.cursor(), params)
@@ -1,23 +1,284 @@
 """Database models and initialization"""
 import sqlite3
 import os
+import pathlib
+import queue
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
+from flask import g, has_app_context
+from rollups import rebuild_rollups
+from totals import total_steps
+from versions import entity_version_steps, version_steps
 
-# Use /data for Render persistent storage, fallback to local
-if os.path.exists('/data'):
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# COMMUNITY_DB overrides the path (benchmarks, scratch copies); otherwise
+# use /data for Render persistent storage, fallback to local
+if os.environ.get('COMMUNITY_DB'):
+    DATABASE = os.environ['COMMUNITY_DB']
+elif os.path.exists('/data'):
     DATABASE = '/data/community.db'
 else:
     DATABASE = 'community.db'
 
-def get_db():
-    """Get database connection"""
-    conn = sqlite3.connect(DATABASE)
+# Connection tuning, overridable per deployment
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 4))
+POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+CACHE_SIZE_KB = int(os.environ.get('DB_CACHE_KB', 16384))
+MMAP_SIZE = int(os.environ.get('DB_MMAP_BYTES', 64 * 1024 * 1024))
+# How long a statement waits on another connection's lock before failing,
+# then how often (and from what delay) transaction() retries taking the
+# write lock before giving up
+BUSY_TIMEOUT = float(os.environ.get('DB_BUSY_TIMEOUT', 5))
+WRITE_RETRIES = int(os.environ.get('DB_WRITE_RETRIES', 5))
+WRITE_BACKOFF = float(os.environ.get('DB_WRITE_BACKOFF', 0.05))
+
+def connect():
+    """Open a new connection configured for this app"""
+    # Opened by URI so archives can be ATTACHed read-only (archive.py)
+    conn = sqlite3.connect(pathlib.Path(DATABASE).absolute().as_uri(), uri=True,
+                           timeout=BUSY_TIMEOUT, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    conn.execute('PRAGMA journal_mode = WAL')
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute('PRAGMA foreign_keys = ON')
+    conn.execute('PRAGMA temp_store = MEMORY')
+    conn.execute(f'PRAGMA cache_size = -{CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size = {MMAP_SIZE}')
     return conn
 
+
+def is_busy(error):
+    """True for the lock errors another writer can cause"""
+    message = str(error)
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in message or 'busy' in message)
+
+
+def begin_immediate(conn, retries=None):
+    """Open a write transaction, retrying with jittered exponential backoff
+    while another connection holds the write lock past the busy timeout"""
+    retries = WRITE_RETRIES if retries is None else retries
+    delay = WRITE_BACKOFF
+    for attempt in range(retries + 1):
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            return
+        except sqlite3.OperationalError as e:
+            if not is_busy(e) or attempt == retries:
+                raise
+            time.sleep(delay * random.uniform(0.5, 1.5))
+            delay *= 2
+
+
+@contextmanager
+def transaction(conn):
+    """Run the block as one write transaction, committed on success.
+
+    The write lock is taken up front with BEGIN IMMEDIATE, so reads inside
+    the block see the state the writes apply to and the commit can never
+    fail on a lock upgrade; under WAL only taking the lock can be busy.
+    """
+    begin_immediate(conn)
+    try:
+        yield conn
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+class PoolExhausted(RuntimeError):
+    """No pooled connection became free within the pool timeout"""
+
+
+class ConnectionPool:
+    """Per-process pool of configured connections.
+
+    Connections are created lazily up to `size`; when all are in use callers
+    wait up to `timeout` seconds for one to be released. A pool inherited
+    across fork() is discarded in the child so workers never share sockets
+    or page caches with their parent.
+    """
+
+    def __init__(self, size=POOL_SIZE, timeout=POOL_TIMEOUT):
+        self.size = size
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self.hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def acquire(self):
+        """Take a connection from the pool, opening one if there is room"""
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            try:
+                conn = self._idle.get_nowait()
+                self.hits += 1
+                return conn
+            except queue.Empty:
+                pass
+            if self._created < self.size:
+                self._created += 1
+                self.misses += 1
+                create = True
+            else:
+                create = False
+        if create:
+            try:
+                return connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+        start = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolExhausted(f'No database connection free after {self.timeout}s')
+        waited = time.perf_counter() - start
+        with self._lock:
+            self.waits += 1
+            self.wait_time += waited
+            self.max_wait_time = max(self.max_wait_time, waited)
+        return conn
+
+    def release(self, conn):
+        """Return a connection, discarding any transaction left open"""
+        if self._pid != os.getpid():
+            conn.close()
+            return
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            with self._lock:
+                self._created -= 1
+            return
+        self._idle.put(conn)
+
+    def stats(self):
+        """Counters for monitoring pool efficiency"""
+        with self._lock:
+            return {
+                'size': self.size,
+                'open': self._created,
+                'idle': self._idle.qsize(),
+                'hits': self.hits,
+                'misses': self.misses,
+                'waits': self.waits,
+                'wait_time_total': round(self.wait_time, 6),
+                'wait_time_max': round(self.max_wait_time, 6),
+            }
+
+
+pool = ConnectionPool()
+
+# Optional callable(conn) -> connection-like proxy applied to request
+# connections; set by instrumentation.init_instrumentation() when enabled.
+connection_wrapper = None
+
+def get_db():
+    """Get database connection
+
+    Inside a Flask app context the connection comes from the pool and is
+    returned by close_db() at teardown, so callers must not close it.
+    Outside one (CLI scripts, init_db) a standalone connection is returned.
+    """
+    if not has_app_context():
+        return connect()
+    if 'db' not in g:
+        conn = pool.acquire()
+        g.db_raw = conn
+        g.db = connection_wrapper(conn) if connection_wrapper else conn
+    return g.db
+
+def close_db(exc=None):
+    """Return the request's connection to the pool"""
+    g.pop('db', None)
+    conn = g.pop('db_raw', None)
+    if conn is not None:
+        pool.release(conn)
+
+def init_app(app):
+    """Register schema bootstrap and connection teardown with the Flask app"""
+    app.before_request(_check_schema)
+    app.teardown_appcontext(close_db)
+
+def _check_schema():
+    # before_request hooks must return None to let the request through
+    ensure_schema()
+
+# ========== Schema bootstrap ==========
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+@contextmanager
+def _init_lock():
+    """Exclusive lock across processes, so workers booting together migrate once"""
+    if fcntl is None:
+        yield
+        return
+    with open(DATABASE + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+def _current_version():
+    conn = connect()
+    try:
+        return get_schema_version(conn)
+    finally:
+        conn.close()
+
+def ensure_schema():
+    """Create or migrate the schema unless PRAGMA user_version is current.
+
+    Checked once per process; afterwards this is a flag test, so it is cheap
+    enough to run before every request. gunicorn.conf.py calls it in the
+    master before forking, and workers inherit the result. Returns True when
+    DDL ran.
+    """
+    global _schema_ready
+    if _schema_ready:
+        return False
+    with _schema_lock:
+        if _schema_ready:
+            return False
+        ran = False
+        if _current_version() < SCHEMA_VERSION:
+            with _init_lock():
+                # Another process may have finished while we waited
+                if _current_version() < SCHEMA_VERSION:
+                    init_db()
+                    ran = True
+        _schema_ready = True
+        return ran
+
 def init_db():
     """Initialize database tables"""
-    conn = get_db()
+    # A standalone connection: this is closed at the end, and may run
+    # inside a request via ensure_schema()
+    conn = connect()
     cursor = conn.cursor()
     
     # Table 1: event_types
@@ -116,6 +377,23 @@ def init_db():
         )
     ''')
     
+    # Table 7: quarterly_type_summaries (per event type breakdown of quarterly_summaries)
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'quarterly_type_summaries'")
+    rollups_exist = cursor.fetchone() is not None
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS quarterly_type_summaries (
+            year INTEGER NOT NULL,
+            quarter INTEGER NOT NULL,
+            event_type_id INTEGER NOT NULL DEFAULT 0,
+            total_events INTEGER DEFAULT 0,
+            total_volunteer_hours REAL DEFAULT 0,
+            total_cash_donations REAL DEFAULT 0,
+            total_material_value REAL DEFAULT 0,
+            total_participants INTEGER DEFAULT 0,
+            PRIMARY KEY (year, quarter, event_type_id)
+        )
+    ''')
+    
     # Insert default event types
     default_types = [('School', 'School related activities'), ('Church', 'Church related activities'), 
                      ('Community', 'Community related activities'), ('Other', 'Other activities')]
@@ -123,8 +401,225 @@ def init_db():
         cursor.execute('INSERT OR IGNORE INTO event_types (name, description) VALUES (?, ?)', (name, desc))
     
     conn.commit()
+    
+    # Populate rollups once for databases created before they were maintained
+    if not rollups_exist:
+        with transaction(conn):
+            rebuild_rollups(conn)
+    migrate(conn)
     conn.close()
 
+# ========== Migrations ==========
+def fts_steps(fts_table, table, columns):
+    """SQL for an external-content FTS5 index over table.columns kept in sync by triggers"""
+    cols = ', '.join(columns)
+    new = ', '.join(f'new.{c}' for c in columns)
+    old = ', '.join(f'old.{c}' for c in columns)
+    return (
+        f'''CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table} USING fts5(
+               {cols}, content='{table}', content_rowid='id', tokenize='unicode61 remove_diacritics 2')''',
+        f'''CREATE TRIGGER IF NOT EXISTS {fts_table}_ai AFTER INSERT ON {table} BEGIN
+               INSERT INTO {fts_table}(rowid, {cols}) VALUES (new.id, {new});
+           END''',
+        f'''CREATE TRIGGER IF NOT EXISTS {fts_table}_ad AFTER DELETE ON {table} BEGIN
+               INSERT INTO {fts_table}({fts_table}, rowid, {cols}) VALUES ('delete', old.id, {old});
+           END''',
+        f'''CREATE TRIGGER IF NOT EXISTS {fts_table}_au AFTER UPDATE OF {cols} ON {table} BEGIN
+               INSERT INTO {fts_table}({fts_table}, rowid, {cols}) VALUES ('delete', old.id, {old});
+               INSERT INTO {fts_table}(rowid, {cols}) VALUES (new.id, {new});
+           END''',
+        # Index the rows that existed before the triggers
+        f"INSERT INTO {fts_table}({fts_table}) VALUES ('rebuild')",
+    )
+
+# Ordered schema steps applied on top of the base tables. Migration N runs
+# once, when PRAGMA user_version is below N; append new steps, never edit
+# or reorder released ones. A step is an SQL string or a callable(cursor).
+MIGRATIONS = [
+    # 1: indexes for the hot query paths
+    (
+        # view_event / edit_event contribution lists, per-event sums
+        'CREATE INDEX IF NOT EXISTS idx_contributions_event ON contributions(event_id)',
+        # view_volunteer and the volunteer_list join; covers the summed columns
+        '''CREATE INDEX IF NOT EXISTS idx_contributions_volunteer
+           ON contributions(volunteer_id, volunteer_hours, cash_donation, material_value)''',
+        # report queries filter by quarter and list events by date
+        'CREATE INDEX IF NOT EXISTS idx_events_quarter_date ON event_profiles(quarter, event_date)',
+        # dashboard and event list ORDER BY event_date DESC
+        'CREATE INDEX IF NOT EXISTS idx_events_date ON event_profiles(event_date)',
+    ),
+    # 2: planner statistics for the new indexes
+    (
+        'ANALYZE',
+    ),
+    # 3: keyset pagination of the event list (per filter) and volunteer list
+    (
+        'CREATE INDEX IF NOT EXISTS idx_events_type_date ON event_profiles(event_type_id, event_date)',
+        'CREATE INDEX IF NOT EXISTS idx_events_org_date ON event_profiles(organization_id, event_date)',
+        'CREATE INDEX IF NOT EXISTS idx_events_status_date ON event_profiles(status, event_date)',
+        'CREATE INDEX IF NOT EXISTS idx_volunteers_name ON volunteers(name)',
+        'ANALYZE',
+    ),
+    # 4: full-text search indexes
+    (
+        *fts_steps('events_fts', 'event_profiles', ('event_name', 'location', 'description')),
+        *fts_steps('volunteers_fts', 'volunteers', ('name', 'email', 'phone', 'notes')),
+        *fts_steps('organizations_fts', 'organizations', ('name', 'contact_name', 'contact_email')),
+        *fts_steps('contributions_fts', 'contributions', ('material_description',)),
+    ),
+    # 5: per-table change counters for ETags and cache validation
+    tuple(version_steps()),
+    # 6: running contribution totals on events and volunteers
+    tuple(total_steps()),
+    # 7: per-event, per-volunteer and per-quarter versions for the page cache
+    tuple(entity_version_steps()),
+    # 8: quarters moved to the read-only yearly archives (archive.py)
+    ('''CREATE TABLE IF NOT EXISTS closed_quarters (
+            quarter TEXT PRIMARY KEY,
+            year INTEGER NOT NULL,
+            events INTEGER NOT NULL DEFAULT 0,
+            contributions INTEGER NOT NULL DEFAULT 0,
+            closed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID''',),
+    # 9: deltas for the live dashboard stream (changefeed.py)
+    ('''CREATE TABLE IF NOT EXISTS change_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )''',),
+    # 10: background job queue (jobs.py)
+    ('''CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            kind TEXT NOT NULL,
+            params TEXT NOT NULL DEFAULT '{}',
+            memo_key TEXT,
+            priority INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 3,
+            run_after REAL NOT NULL,
+            progress REAL NOT NULL DEFAULT 0,
+            message TEXT,
+            result TEXT,
+            error TEXT,
+            worker TEXT,
+            heartbeat REAL,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL
+        )''',
+     # claim(): best queued job first
+     'CREATE INDEX IF NOT EXISTS idx_jobs_claim ON jobs(status, priority DESC, id)',
+     # One live or finished job per memo key; a failed one can be submitted again
+     "CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_memo ON jobs(memo_key) WHERE memo_key IS NOT NULL AND status != 'failed'"),
+    # 11: matching free-text contributions to volunteers (identity.py)
+    ('''CREATE TABLE IF NOT EXISTS volunteer_keys (
+            key TEXT NOT NULL,
+            volunteer_id INTEGER NOT NULL,
+            PRIMARY KEY (key, volunteer_id)
+        ) WITHOUT ROWID''',
+     'CREATE INDEX IF NOT EXISTS idx_volunteer_keys_volunteer ON volunteer_keys(volunteer_id)',
+     '''CREATE TABLE IF NOT EXISTS identity_matches (
+            contribution_id INTEGER NOT NULL,
+            volunteer_id INTEGER NOT NULL,
+            score REAL NOT NULL,
+            reasons TEXT,
+            status TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            decided_at TIMESTAMP,
+            PRIMARY KEY (contribution_id, volunteer_id)
+        ) WITHOUT ROWID''',
+     'CREATE INDEX IF NOT EXISTS idx_identity_matches_status ON identity_matches(status, score)',
+     'CREATE TABLE IF NOT EXISTS identity_queue (contribution_id INTEGER PRIMARY KEY)',
+     # Keys are recomputed by the next run; matches go with their volunteer
+     '''CREATE TRIGGER IF NOT EXISTS volunteers_identity_update AFTER UPDATE OF name, email, phone ON volunteers
+        BEGIN
+            DELETE FROM volunteer_keys WHERE volunteer_id = old.id;
+        END''',
+     '''CREATE TRIGGER IF NOT EXISTS volunteers_identity_delete AFTER DELETE ON volunteers BEGIN
+            DELETE FROM volunteer_keys WHERE volunteer_id = old.id;
+            DELETE FROM identity_matches WHERE volunteer_id = old.id;
+        END''',
+     # Contributions left without a volunteer, new or unlinked, wait for the next run
+     '''CREATE TRIGGER IF NOT EXISTS contributions_identity_insert AFTER INSERT ON contributions
+        WHEN new.volunteer_id IS NULL BEGIN
+            INSERT OR IGNORE INTO identity_queue (contribution_id) VALUES (new.id);
+        END''',
+     '''CREATE TRIGGER IF NOT EXISTS contributions_identity_unlink AFTER UPDATE OF volunteer_id ON contributions
+        WHEN new.volunteer_id IS NULL AND old.volunteer_id IS NOT NULL BEGIN
+            INSERT OR IGNORE INTO identity_queue (contribution_id) VALUES (new.id);
+        END''',
+     '''CREATE TRIGGER IF NOT EXISTS contributions_identity_delete AFTER DELETE ON contributions BEGIN
+            DELETE FROM identity_queue WHERE contribution_id = old.id;
+            DELETE FROM identity_matches WHERE contribution_id = old.id;
+        END''',
+     # Today's orphans make up the first run
+     'INSERT OR IGNORE INTO identity_queue (contribution_id) SELECT id FROM contributions WHERE volunteer_id IS NULL'),
+    # 12: job worker processes, each refreshing `seen` while it runs (jobs.workers_alive)
+    ('''CREATE TABLE IF NOT EXISTS job_workers (
+            name TEXT PRIMARY KEY,
+            threads INTEGER NOT NULL,
+            started_at REAL NOT NULL,
+            seen REAL NOT NULL
+        )''',),
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def get_schema_version(conn):
+    """Return the migration level recorded in PRAGMA user_version"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn):
+    """Apply pending migrations in order, each in its own transaction"""
+    current = get_schema_version(conn)
+    for version, steps in enumerate(MIGRATIONS, start=1):
+        if version <= current:
+            continue
+        cursor = conn.cursor()
+        cursor.execute('BEGIN')
+        try:
+            for step in steps:
+                if callable(step):
+                    step(cursor)
+                else:
+                    cursor.execute(step)
+            # PRAGMA does not accept bound parameters
+            cursor.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return get_schema_version(conn)
+
+# Tables that grow with the data; a plan must reach them through an index
+LARGE_TABLES = ('contributions', 'event_profiles', 'volunteers')
+_SCAN_RE = re.compile(r'^SCAN (?:\w+\.)?(\w+)(.*)$')
+
+def check_query_plans(conn):
+    """Return (name, plan, ok) for each query in queries.hot_queries(); ok
+    means no large table is read by a full scan. Walking an index in order
+    counts only under a LIMIT (the first page of a keyset list)."""
+    import queries
+
+    cursor = conn.cursor()
+    results = []
+    for name, sql, params in queries.hot_queries(cursor):
+        # Plans name tables by their alias in the statement
+        aliases = {}
+        for table, alias in re.findall(r'\b(?:FROM|JOIN)\s+(?:\w+\.)?(\w+)\s+(\w+)', sql):
+            aliases[alias] = table
+        plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params)]
+        ok = True
+        for detail in plan:
+            match = _SCAN_RE.match(detail)
+            if match and not ('INDEX' in match.group(2) and re.search(r'\bLIMIT\b', sql)):
+                table = aliases.get(match.group(1), match.group(1))
+                ok = ok and table not in LARGE_TABLES
+        results.append((name, plan, ok))
+    return results
+
 def calculate_quarter(date_str):
     """Calculate quarter from date"""
     date = datetime.strptime(date_str, '%Y-%m-%d')
@@ -132,5 +627,15 @@ def calculate_quarter(date_str):
     return f"{date.year}Q{quarter}"
 
 if __name__ == '__main__':
+    import sys
     init_db()
     print("Database initialized!")
+    if '--explain' in sys.argv:
+        conn = get_db()
+        results = check_query_plans(conn)
+        for name, plan, ok in results:
+            print(f"{'OK  ' if ok else 'SCAN'} {name}: {'; '.join(plan)}")
+        conn.close()
+        # Non-zero so a CI step or deploy check stops on a plan regression
+        if not all(ok for name, plan, ok in results):
+            sys.exit(1)
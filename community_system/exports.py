@@ -0,0 +1,153 @@
+"""Streaming CSV / NDJSON exports of contribution ledgers
+
+Rows are pulled from the SQLite cursor in small batches and encoded one at
+a time, so an export of any size holds only one batch in memory. When the
+filters reach archived quarters, the archived years are read one after
+another on a connection of their own (so any number of them can be
+attached in turn) and that stream is merged with the hot one.
+"""
+import csv
+import heapq
+import io
+import json
+
+import archive
+
+BATCH_SIZE = 500
+
+FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+LEDGER_COLUMNS = (
+    'contribution_id', 'event_id', 'event_name', 'event_date', 'quarter',
+    'event_type', 'organization_id', 'organization', 'volunteer_id',
+    'volunteer_name', 'volunteer_contact', 'volunteer_hours', 'cash_donation',
+    'material_description', 'material_value', 'created_at',
+)
+
+# Ordered by (event_date, event id, contribution id) so the planner can walk
+# the event_profiles indexes and contributions(event_id) without a big sort.
+# Quarter follows event_date, so quarter-filtered exports lead with it to
+# match idx_events_quarter_date.
+_LEDGER_SQL = '''
+    SELECT c.id as contribution_id, ep.id as event_id, ep.event_name, ep.event_date,
+           ep.quarter, et.name as event_type, ep.organization_id, o.name as organization,
+           c.volunteer_id, c.volunteer_name, c.volunteer_contact, c.volunteer_hours,
+           c.cash_donation, c.material_description, c.material_value, c.created_at
+    FROM {schema}.event_profiles ep
+    JOIN {schema}.contributions c ON c.event_id = ep.id
+    LEFT JOIN event_types et ON ep.event_type_id = et.id
+    LEFT JOIN organizations o ON ep.organization_id = o.id
+    {where}
+    ORDER BY {order}ep.event_date, ep.id, c.id
+'''
+
+
+def ledger_query(quarter=None, year=None, volunteer_id=None, organization_id=None, schema='main'):
+    """Build the ledger SQL and parameters for the given filters on one partition"""
+    where = []
+    params = []
+    if quarter:
+        where.append('ep.quarter = ?')
+        params.append(quarter)
+    if year:
+        # Range on the quarter string keeps idx_events_quarter_date usable
+        where.append('ep.quarter BETWEEN ? AND ?')
+        params.extend([f'{year}Q1', f'{year}Q4'])
+    if volunteer_id is not None:
+        where.append('c.volunteer_id = ?')
+        params.append(volunteer_id)
+    if organization_id is not None:
+        where.append('ep.organization_id = ?')
+        params.append(organization_id)
+    clause = 'WHERE ' + ' AND '.join(where) if where else ''
+    order = 'ep.quarter, ' if quarter or year else ''
+    return _LEDGER_SQL.format(where=clause, order=order, schema=schema), params
+
+
+def iter_rows(cursor, sql, params, batch_size=BATCH_SIZE):
+    """Yield result rows from cursor, fetching batch_size at a time"""
+    cursor.execute(sql, params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+
+def iter_csv(rows, columns):
+    """Encode rows as CSV text chunks, header first"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    for row in rows:
+        writer.writerow(row)
+        # Flush roughly every 64 KB rather than one chunk per row
+        if buffer.tell() >= 65536:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def iter_ndjson(rows, columns):
+    """Encode rows as newline-delimited JSON objects"""
+    for row in rows:
+        yield json.dumps(dict(zip(columns, row)), default=str) + '\n'
+
+
+def _quarter_range(quarter=None, year=None, **_):
+    if quarter:
+        return quarter, quarter
+    if year:
+        return f'{year}Q1', f'{year}Q4'
+    return None, None
+
+
+def _archived_rows(cursor, years, filters):
+    conn = archive.connect_readonly(cursor)
+    try:
+        archived = conn.cursor()
+        # Years hold disjoint dates, so reading them in order keeps ledger order
+        for year in years:
+            sql, params = ledger_query(**filters, schema=archive.attach(archived, [year])[0])
+            yield from iter_rows(archived, sql, params)
+    finally:
+        conn.close()
+
+
+def iter_ledger(cursor, **filters):
+    """Ledger rows for the filters from every partition they touch, in ledger order"""
+    hot, years = archive.partition_years(cursor, *_quarter_range(**filters))
+    streams = []
+    if hot:
+        streams.append(iter_rows(cursor, *ledger_query(**filters)))
+    if years:
+        streams.append(_archived_rows(cursor, years, filters))
+    if len(streams) == 1:
+        return streams[0]
+    by_quarter = bool(filters.get('quarter') or filters.get('year'))
+    return heapq.merge(*streams, key=lambda row: (row[4] if by_quarter else '', row[3], row[1], row[0]))
+
+
+def count_ledger(cursor, **filters):
+    """Number of ledger rows the filters select"""
+    def count(schema):
+        sql, params = ledger_query(**filters, schema=schema)
+        cursor.execute(f'SELECT COUNT(*) FROM ({sql})', params)
+        return cursor.fetchone()[0]
+
+    hot, years = archive.partition_years(cursor, *_quarter_range(**filters))
+    total = count('main') if hot else 0
+    # Archives are attached one at a time, however many there are
+    return total + sum(count(archive.attach(cursor, [year])[0]) for year in years)
+
+
+def stream_ledger(cursor, fmt, **filters):
+    """Yield an encoded ledger export for the given filters"""
+    rows = iter_ledger(cursor, **filters)
+    if fmt == 'csv':
+        return iter_csv(rows, LEDGER_COLUMNS)
+    return iter_ndjson(rows, LEDGER_COLUMNS)
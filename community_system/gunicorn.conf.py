@@ -0,0 +1,108 @@
+"""gunicorn preset, loaded automatically when gunicorn starts in this directory
+
+One process per core with a few threads each (gthread), so a slow report
+occupies one thread rather than a whole worker, and heavy reads go through
+the bounded read-only pool (readpool.py). Every value can be overridden on
+the command line or with the environment variables below.
+"""
+import multiprocessing
+import os
+import subprocess
+import sys
+import threading
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '8000')}")
+
+# SQLite has one writer at a time, so more processes than cores only adds
+# lock contention; threads cover concurrent I/O and waiting on reads.
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
+
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+# Recycle workers now and then so slow leaks cannot accumulate
+max_requests = 2000
+max_requests_jitter = 200
+
+raw_env = [f"COMMUNITY_READ_POOL={os.environ.get('COMMUNITY_READ_POOL', '1')}"]
+
+# Import the app once in the master and fork workers from it: they boot
+# without re-importing anything and share its memory copy-on-write. Pools,
+# the read pool and the group committer all reopen after fork.
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1').lower() in ('1', 'true', 'yes')
+
+
+def on_starting(server):
+    # Check (and if needed create or migrate) the schema once, before any
+    # worker exists; forked workers inherit the result and skip the check
+    import database
+    database.ensure_schema()
+
+
+def post_fork(server, worker):
+    # Live streams each hold a thread: size their limit from the threads this
+    # worker really has, keeping a reserve for page requests (changefeed.py)
+    import changefeed
+    changefeed.configure(server.cfg.threads)
+
+
+# Helper processes started beside the server for as long as the master lives:
+# - job workers (`jobs.py work`, JOB_THREADS threads each); COMMUNITY_JOB_WORKERS
+#   sets how many, 0 when they run elsewhere (see jobs.py)
+# - COMMUNITY_BACKUP_INTERVAL=<seconds> runs `backup.py schedule` (see backup.py)
+# A supervisor thread in the master checks them every CHILD_CHECK seconds and
+# restarts any that died, which also bounds a crash loop to one restart per
+# check. The master's own SIGCHLD handler reaps them, so their exit status is
+# lost; poll() still tells us they are gone.
+CHILD_CHECK = 10
+_children = []  # [args, description, Popen]
+_children_lock = threading.Lock()
+_stopping = threading.Event()
+
+
+def _spawn(server, args, what):
+    child = subprocess.Popen([sys.executable] + args, cwd=os.path.dirname(os.path.abspath(__file__)))
+    server.log.info('%s (pid %s)', what, child.pid)
+    return child
+
+
+def _supervise(server):
+    while not _stopping.wait(CHILD_CHECK):
+        with _children_lock:
+            if _stopping.is_set():
+                return
+            for entry in _children:
+                args, what, child = entry
+                if child.poll() is not None:
+                    server.log.error('Helper process %s exited: %s; restarting it', child.pid, what)
+                    entry[2] = _spawn(server, args, what)
+
+
+def when_ready(server):
+    helpers = [(['jobs.py', 'work'], 'Running background jobs')] * int(os.environ.get('COMMUNITY_JOB_WORKERS', 1))
+    interval = os.environ.get('COMMUNITY_BACKUP_INTERVAL')
+    if interval:
+        helpers.append((['backup.py', 'schedule', '--every', interval], f'Backing up every {interval}s'))
+    with _children_lock:
+        for args, what in helpers:
+            _children.append([args, what, _spawn(server, args, what)])
+    if _children:
+        threading.Thread(target=_supervise, args=(server,), name='helper-supervisor', daemon=True).start()
+
+
+def on_exit(server):
+    with _children_lock:
+        _stopping.set()
+        for _, _, child in _children:
+            if child.poll() is None:
+                child.terminate()
+        for _, what, child in _children:
+            try:
+                child.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                server.log.warning('Helper process %s did not stop; killing it: %s', child.pid, what)
+                child.kill()
+                child.wait()
@@ -0,0 +1,404 @@
+"""Linking free-text contributions to volunteer accounts
+
+A contribution typed in by name (no volunteer picked from the list), or
+left behind when its volunteer was deleted, has volunteer_id NULL and is
+missing from every volunteer's totals. resolve() links such orphans to
+volunteers by normalized name, email and phone:
+
+- Blocking. Each volunteer has a few blocking keys in volunteer_keys:
+  email, the last 7 phone digits, the sorted name words, a Soundex key and
+  a prefix key of the first and last name. An orphan is compared only with
+  the volunteers that share one of its keys, so a run costs
+  O(orphans x bucket size), not O(orphans x volunteers). Keys held by more
+  than MAX_BUCKET volunteers are too common to help and are skipped.
+- Scoring. A name similarity (0..1) is combined with email and phone
+  agreement. A differing email or phone counts against a match.
+- Deciding. A best score of at least AUTO_LINK, clear of the runner-up by
+  MARGIN, links the contribution. A score of at least REVIEW goes to the
+  review queue (/volunteers/matches) for someone to accept or reject.
+  Everything else stays unlinked. Auto links stay listed there and can be
+  undone. A rejected pair is never proposed again.
+
+Runs are incremental. Triggers put every contribution inserted without a
+volunteer, or unlinked later, into identity_queue, and resolve() works
+through the queue. Keys are recomputed for volunteers added or edited
+since the last run. The write routes queue a `resolve_identities` job
+(jobs.py) every BATCH_SECONDS at most. Adding volunteers queues a full
+run, which re-checks every orphan, since a new volunteer can match
+contributions made before they had an account. A full run also happens
+daily.
+
+Only open quarters are matched. Archived contributions are read-only.
+"""
+import os
+import re
+import unicodedata
+from difflib import SequenceMatcher
+
+import database
+
+AUTO_LINK = float(os.environ.get('IDENTITY_AUTO_LINK', 0.9))
+REVIEW = float(os.environ.get('IDENTITY_REVIEW', 0.5))
+MARGIN = float(os.environ.get('IDENTITY_MARGIN', 0.05))
+MAX_BUCKET = int(os.environ.get('IDENTITY_MAX_BUCKET', 200))
+
+# The write routes queue at most one incremental run per this many seconds
+BATCH_SECONDS = float(os.environ.get('IDENTITY_BATCH_SECONDS', 10))
+
+# Contributions decided per write transaction
+CHUNK_SIZE = 500
+
+STATUSES = ('pending', 'linked', 'accepted', 'rejected')
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+_EMAIL_RE = re.compile(r'[\w.+-]+@[\w-]+(?:\.[\w-]+)+', re.UNICODE)
+
+_SOUNDEX = {c: str(d) for d, letters in enumerate(('aeiouyhw', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r'))
+            for c in letters}
+
+
+# ---------- Normalization ----------
+
+def name_words(text):
+    """Name words in typed order, case- and accent-folded"""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return _WORD_RE.findall(text.casefold())
+
+
+def normalize_email(text):
+    """Lower-cased address without a +tag, or None"""
+    text = (text or '').strip().casefold()
+    local, _, domain = text.partition('@')
+    if not local or '.' not in domain:
+        return None
+    return f"{local.split('+')[0]}@{domain}"
+
+
+def normalize_phone(text):
+    """The last 10 digits, or None with fewer than 7"""
+    digits = re.sub(r'\D', '', text or '')
+    return digits[-10:] if len(digits) >= 7 else None
+
+
+def soundex(word):
+    letters = [c for c in word if c.isascii() and c.isalpha()]
+    if not letters:
+        return word
+    code, previous = letters[0].upper(), _SOUNDEX.get(letters[0], '')
+    for c in letters[1:]:
+        digit = _SOUNDEX.get(c, '')
+        if digit and digit != '0' and digit != previous:
+            code += digit
+        # h and w do not separate two letters with the same code
+        if c not in 'hw':
+            previous = digit
+    return (code + '000')[:4]
+
+
+class Identity:
+    """The normalized name, email and phone that one person is known by"""
+
+    __slots__ = ('name', 'words', 'email', 'phone')
+
+    def __init__(self, name, email=None, phone=None):
+        self.words = name_words(name)
+        self.name = ' '.join(sorted(self.words))
+        self.email = normalize_email(email)
+        self.phone = normalize_phone(phone)
+
+    @classmethod
+    def from_contribution(cls, name, contact):
+        """Split a free-text contact into an email and a phone number"""
+        emails = _EMAIL_RE.findall(contact or '')
+        return cls(name, emails[0] if emails else None, _EMAIL_RE.sub(' ', contact or ''))
+
+    def keys(self):
+        """Blocking keys; two records are compared only if they share one"""
+        keys = []
+        if self.email:
+            keys.append('e:' + self.email)
+        if self.phone:
+            keys.append('p:' + self.phone[-7:])
+        if self.name:
+            keys.append('n:' + self.name)
+        # Initials say little; first and last name in either order
+        words = [w for w in self.words if len(w) > 1]
+        if words:
+            ends = {words[0], words[-1]}
+            keys.append('s:' + '-'.join(sorted(soundex(w) for w in ends)))
+            keys.append('g:' + '-'.join(sorted(w[:3] for w in ends)))
+        return keys
+
+    def signature(self):
+        return self.name, self.email, self.phone
+
+
+def score(a, b):
+    """(0..1 confidence that a and b are the same person, reasons)"""
+    similarity = SequenceMatcher(None, a.name, b.name, autojunk=False).ratio() if a.name and b.name else 0
+    reasons = [f'name {similarity:.2f}']
+    same_email = bool(a.email and a.email == b.email)
+    # A number typed without its area code still matches
+    same_phone = bool(a.phone and b.phone and (a.phone.endswith(b.phone[-7:]) or b.phone.endswith(a.phone[-7:])))
+    if same_email and same_phone:
+        value = 0.8 + 0.2 * similarity
+    elif same_email:
+        value = 0.65 + 0.35 * similarity
+    elif same_phone:
+        value = 0.55 + 0.4 * similarity
+    else:
+        # On the name alone, at most an exact match reaches AUTO_LINK
+        value = 0.9 * similarity
+    if same_email:
+        reasons.append('same email')
+    elif a.email and b.email:
+        value -= 0.3
+        reasons.append('different email')
+    if same_phone:
+        reasons.append('same phone')
+    elif a.phone and b.phone:
+        value -= 0.2
+        reasons.append('different phone')
+    return max(value, 0), reasons
+
+
+# ---------- Blocking index ----------
+
+def sync_keys(conn):
+    """Compute keys for volunteers lacking them; returns how many.
+
+    The volunteers triggers drop a volunteer's keys when it is edited or
+    deleted, so this also refreshes edited ones.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT id, name, email, phone FROM volunteers v
+        WHERE NOT EXISTS (SELECT 1 FROM volunteer_keys k WHERE k.volunteer_id = v.id)
+    ''')
+    rows = cursor.fetchall()
+    for start in range(0, len(rows), CHUNK_SIZE):
+        with database.transaction(conn):
+            cursor.executemany('INSERT OR IGNORE INTO volunteer_keys (key, volunteer_id) VALUES (?, ?)', [
+                (key, row['id']) for row in rows[start:start + CHUNK_SIZE]
+                for key in Identity(row['name'], row['email'], row['phone']).keys() or ['n:']])
+    return len(rows)
+
+
+class _Matcher:
+    """Candidate lookups for one run, cached by key and by identity"""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+        self._buckets = {}
+        self._volunteers = {}
+        self._scored = {}
+        self.comparisons = 0
+
+    def _bucket(self, key):
+        if key not in self._buckets:
+            self.cursor.execute('SELECT volunteer_id FROM volunteer_keys WHERE key = ? LIMIT ?',
+                                (key, MAX_BUCKET + 1))
+            ids = [row[0] for row in self.cursor.fetchall()]
+            self._buckets[key] = ids if len(ids) <= MAX_BUCKET else []
+        return self._buckets[key]
+
+    def _identities(self, ids):
+        missing = [i for i in ids if i not in self._volunteers]
+        for start in range(0, len(missing), 500):
+            chunk = missing[start:start + 500]
+            self.cursor.execute(f"SELECT id, name, email, phone FROM volunteers WHERE id IN ({', '.join('?' * len(chunk))})",
+                                chunk)
+            for row in self.cursor.fetchall():
+                self._volunteers[row['id']] = Identity(row['name'], row['email'], row['phone'])
+        return [(i, self._volunteers[i]) for i in ids if i in self._volunteers]
+
+    def candidates(self, identity):
+        """[(score, volunteer id, reasons)] best first, for REVIEW and above"""
+        signature = identity.signature()
+        if signature not in self._scored:
+            ids = set()
+            for key in identity.keys():
+                ids.update(self._bucket(key))
+            scored = []
+            for vol_id, other in self._identities(sorted(ids)):
+                self.comparisons += 1
+                value, reasons = score(identity, other)
+                if value >= REVIEW:
+                    scored.append((value, vol_id, reasons))
+            scored.sort(key=lambda c: (-c[0], c[1]))
+            self._scored[signature] = scored
+        return self._scored[signature]
+
+
+# ---------- Resolving ----------
+
+def _decide(candidates):
+    """('linked' | 'pending' | None, best candidate or None)"""
+    if not candidates:
+        return None, None
+    best = candidates[0]
+    runner_up = candidates[1][0] if len(candidates) > 1 else 0
+    if best[0] >= AUTO_LINK and best[0] - runner_up >= MARGIN:
+        return 'linked', best
+    if len(candidates) > 1 and best[0] - runner_up < MARGIN:
+        best = (best[0], best[1], best[2] + [f'{len(candidates)} candidates'])
+    return 'pending', best
+
+
+def resolve(conn, full=False, progress=None):
+    """Link or queue for review the orphan contributions in identity_queue
+    (every orphan with full=True); returns counts for the run"""
+    cursor = conn.cursor()
+    indexed = sync_keys(conn)
+    if full:
+        with database.transaction(conn):
+            cursor.execute('INSERT OR IGNORE INTO identity_queue (contribution_id) '
+                           'SELECT id FROM contributions WHERE volunteer_id IS NULL')
+    cursor.execute('SELECT COUNT(*) FROM identity_queue')
+    total = cursor.fetchone()[0]
+    matcher = _Matcher(cursor)
+    counts = {'processed': 0, 'linked': 0, 'pending': 0, 'unmatched': 0}
+    last = 0
+    while True:
+        cursor.execute('''
+            SELECT q.contribution_id, c.volunteer_id, c.volunteer_name, c.volunteer_contact
+            FROM identity_queue q LEFT JOIN contributions c ON c.id = q.contribution_id
+            WHERE q.contribution_id > ? ORDER BY q.contribution_id LIMIT ?
+        ''', (last, CHUNK_SIZE))
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        last = rows[-1][0]
+        ids = [row[0] for row in rows]
+        # The unary + keeps SQLite on the primary key: the status index would
+        # scan every match with that status
+        cursor.execute(f"SELECT contribution_id, volunteer_id FROM identity_matches "
+                       f"WHERE +status = 'rejected' AND contribution_id IN ({', '.join('?' * len(ids))})", ids)
+        rejected = {(row[0], row[1]) for row in cursor.fetchall()}
+
+        # Scored outside the write transaction, which only applies the outcome
+        decisions = []
+        for contribution_id, volunteer_id, name, contact in rows:
+            if volunteer_id is not None or name is None:
+                continue
+            candidates = [c for c in matcher.candidates(Identity.from_contribution(name, contact))
+                          if (contribution_id, c[1]) not in rejected]
+            status, best = _decide(candidates)
+            counts[status or 'unmatched'] += 1
+            decisions.append((contribution_id, status, best))
+
+        with database.transaction(conn):
+            for contribution_id, status, best in decisions:
+                cursor.execute("DELETE FROM identity_matches WHERE contribution_id = ? AND +status = 'pending'",
+                               (contribution_id,))
+                if status is None:
+                    continue
+                if status == 'linked':
+                    # Someone may have picked a volunteer meanwhile
+                    cursor.execute('UPDATE contributions SET volunteer_id = ? WHERE id = ? AND volunteer_id IS NULL',
+                                   (best[1], contribution_id))
+                    if not cursor.rowcount:
+                        continue
+                cursor.execute('''
+                    INSERT OR REPLACE INTO identity_matches
+                        (contribution_id, volunteer_id, score, reasons, status, decided_at)
+                    VALUES (?, ?, ?, ?, ?, CASE WHEN ? = 'linked' THEN CURRENT_TIMESTAMP END)
+                ''', (contribution_id, best[1], round(best[0], 3), ', '.join(best[2]), status, status))
+            cursor.executemany('DELETE FROM identity_queue WHERE contribution_id = ?', [(i,) for i in ids])
+        counts['processed'] += len(rows)
+        if progress:
+            progress(counts['processed'] / total if total else 1,
+                     f"{counts['processed']} of {total} contributions, {counts['linked']} linked")
+    return dict(counts, volunteers_indexed=indexed, comparisons=matcher.comparisons)
+
+
+# ---------- Review ----------
+
+def _match_status(cursor, contribution_id, volunteer_id):
+    cursor.execute('SELECT status FROM identity_matches WHERE contribution_id = ? AND volunteer_id = ?',
+                   (contribution_id, volunteer_id))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def accept(conn, contribution_id, volunteer_id):
+    """Link a contribution as proposed; False if it is no longer unlinked"""
+    cursor = conn.cursor()
+    with database.transaction(conn):
+        cursor.execute('UPDATE contributions SET volunteer_id = ? WHERE id = ? AND volunteer_id IS NULL',
+                       (volunteer_id, contribution_id))
+        if not cursor.rowcount:
+            cursor.execute("DELETE FROM identity_matches WHERE contribution_id = ? AND +status = 'pending'",
+                           (contribution_id,))
+            return False
+        cursor.execute('''
+            UPDATE identity_matches SET status = 'accepted', decided_at = CURRENT_TIMESTAMP
+            WHERE contribution_id = ? AND volunteer_id = ?
+        ''', (contribution_id, volunteer_id))
+    return True
+
+
+def reject(conn, contribution_id, volunteer_id):
+    """Never propose this pair again; undoes the link if it was automatic"""
+    cursor = conn.cursor()
+    with database.transaction(conn):
+        if _match_status(cursor, contribution_id, volunteer_id) in ('linked', 'accepted'):
+            # The unlink queues the contribution again for other candidates
+            cursor.execute('UPDATE contributions SET volunteer_id = NULL WHERE id = ? AND volunteer_id = ?',
+                           (contribution_id, volunteer_id))
+        cursor.execute('''
+            UPDATE identity_matches SET status = 'rejected', decided_at = CURRENT_TIMESTAMP
+            WHERE contribution_id = ? AND volunteer_id = ?
+        ''', (contribution_id, volunteer_id))
+
+
+def matches(cursor, status='pending', limit=100):
+    """Matches with the contribution and volunteer they pair, best first
+    for pending ones and newest first otherwise"""
+    order = 'm.score DESC, m.contribution_id' if status == 'pending' else 'm.decided_at DESC, m.contribution_id DESC'
+    cursor.execute(f'''
+        SELECT m.*, c.volunteer_name, c.volunteer_contact, c.volunteer_hours, c.cash_donation,
+               c.material_value, c.event_id, ep.event_name, ep.event_date,
+               v.name as candidate_name, v.email as candidate_email, v.phone as candidate_phone
+        FROM identity_matches m
+        JOIN contributions c ON c.id = m.contribution_id
+        JOIN event_profiles ep ON ep.id = c.event_id
+        JOIN volunteers v ON v.id = m.volunteer_id
+        WHERE m.status = ? {"AND c.volunteer_id IS NULL" if status == 'pending' else ''}
+        ORDER BY {order}
+        LIMIT ?
+    ''', (status, limit))
+    return cursor.fetchall()
+
+
+def counts(cursor):
+    """{status: matches} plus the orphans still waiting in the queue"""
+    cursor.execute('SELECT status, COUNT(*) FROM identity_matches GROUP BY status')
+    result = dict.fromkeys(STATUSES, 0)
+    result.update({row[0]: row[1] for row in cursor.fetchall()})
+    cursor.execute('SELECT COUNT(*) FROM identity_queue')
+    result['queued'] = cursor.fetchone()[0]
+    return result
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Link free-text contributions to volunteer accounts')
+    sub = parser.add_subparsers(dest='command', required=True)
+    run_parser = sub.add_parser('run', help='match the queued orphan contributions')
+    run_parser.add_argument('--full', action='store_true', help='re-check every orphan contribution')
+    sub.add_parser('stats', help='count matches by status')
+    args = parser.parse_args()
+
+    database.ensure_schema()
+    conn = database.connect()
+    if args.command == 'run':
+        result = resolve(conn, full=args.full)
+        print(f"{result['processed']} contributions: {result['linked']} linked, {result['pending']} for review, "
+              f"{result['unmatched']} unmatched ({result['comparisons']} comparisons, "
+              f"{result['volunteers_indexed']} volunteers indexed)")
+    else:
+        for status, count in counts(conn.cursor()).items():
+            print(f'{status:10} {count}')
+    conn.close()
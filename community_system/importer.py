@@ -0,0 +1,326 @@
+"""Bulk import of events, volunteers and contributions from CSV / NDJSON
+
+Rows are validated in memory, names are resolved to ids through lookup maps
+loaded once per import, and valid rows are inserted with executemany() in
+chunked transactions. A bad row is reported with its line number and
+skipped; it never aborts the rest of the import.
+
+Usage: python importer.py <events|volunteers|contributions> <file.csv|file.ndjson>
+"""
+import csv
+import io
+import json
+import time
+import sqlite3
+from datetime import datetime
+
+import archive
+import rollups
+from database import begin_immediate, calculate_quarter
+
+CHUNK_SIZE = 1000
+
+# Only the first errors are kept in the report; the count covers all of them
+MAX_REPORTED_ERRORS = 1000
+
+
+class RowError(ValueError):
+    """A row failed validation"""
+
+
+def read_rows(stream, fmt):
+    """Yield (line_number, dict) from a text stream in csv or ndjson format"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == 'ndjson':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_number, RowError(f'Invalid JSON: {e}')
+                continue
+            yield line_number, row
+    else:
+        raise ValueError(f'Unsupported format: {fmt}')
+
+
+def _text(row, field, required=False):
+    value = row.get(field)
+    if value is None or str(value).strip() == '':
+        if required:
+            raise RowError(f'{field} is required')
+        return None
+    return str(value).strip()
+
+
+def _number(row, field, cast=float):
+    value = _text(row, field)
+    if value is None:
+        return 0
+    try:
+        return cast(value)
+    except ValueError:
+        raise RowError(f'{field} is not a number: {value!r}')
+
+
+def _date(row, field):
+    value = _text(row, field, required=True)
+    try:
+        datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise RowError(f'{field} must be YYYY-MM-DD: {value!r}')
+    return value
+
+
+def _key(name):
+    return name.strip().casefold()
+
+
+def _unique(pairs):
+    """Map each key to its id, or to None when several rows share the key"""
+    mapping = {}
+    for key, row_id in pairs:
+        mapping[key] = None if key in mapping else row_id
+    return mapping
+
+
+class Lookups:
+    """Name -> id maps loaded once per import instead of a query per row.
+
+    Only the tables named in `tables` are loaded. A name shared by several
+    rows maps to None and is reported as ambiguous rather than resolved to
+    one of them.
+    """
+
+    def __init__(self, cursor, tables):
+        if 'event_types' in tables:
+            cursor.execute('SELECT id, name FROM event_types')
+            self.event_types = _unique((_key(r['name']), r['id']) for r in cursor.fetchall())
+        if 'organizations' in tables:
+            cursor.execute('SELECT id, name FROM organizations')
+            self.organizations = _unique((_key(r['name']), r['id']) for r in cursor.fetchall())
+        if 'volunteers' in tables:
+            cursor.execute('SELECT id, name FROM volunteers')
+            rows = cursor.fetchall()
+            self.volunteers = _unique((_key(r['name']), r['id']) for r in rows)
+            self.volunteer_names = {r['id']: r['name'] for r in rows}
+        if 'closed_quarters' in tables:
+            self.closed = set(archive.closed_quarters(cursor))
+        if 'event_profiles' in tables:
+            cursor.execute('SELECT id, event_name, event_date, quarter, event_type_id FROM event_profiles')
+            rows = cursor.fetchall()
+            self.events = {r['id']: (r['quarter'], r['event_type_id'] or 0) for r in rows}
+            self.event_keys = _unique(((_key(r['event_name']), r['event_date']), r['id']) for r in rows)
+
+    def resolve(self, row, id_field, name_field, mapping, label):
+        """Return the id given directly in id_field or looked up by name_field"""
+        raw_id = _text(row, id_field)
+        if raw_id is not None:
+            try:
+                return int(raw_id)
+            except ValueError:
+                raise RowError(f'{id_field} is not an integer: {raw_id!r}')
+        name = _text(row, name_field)
+        if name is None:
+            return None
+        if _key(name) not in mapping:
+            raise RowError(f'Unknown {label}: {name!r}')
+        if mapping[_key(name)] is None:
+            raise RowError(f'Ambiguous {label}: several are named {name!r}; give {id_field} instead')
+        return mapping[_key(name)]
+
+
+# ---------- Per-kind row handling ----------
+# Each kind maps a validated row to an INSERT parameter tuple and, for
+# kinds that affect the rollups, to a rollup delta.
+
+def _event_params(row, lookups):
+    event_date = _date(row, 'event_date')
+    event_type_id = lookups.resolve(row, 'event_type_id', 'event_type', lookups.event_types, 'event type')
+    organization_id = lookups.resolve(row, 'organization_id', 'organization', lookups.organizations, 'organization')
+    quarter = calculate_quarter(event_date)
+    if quarter in lookups.closed:
+        raise RowError(f'{quarter} is closed and archived')
+    actual_participants = _number(row, 'actual_participants', int)
+    params = (
+        _text(row, 'event_name', required=True), event_date, event_type_id,
+        _text(row, 'location'), _text(row, 'description'), organization_id,
+        _text(row, 'coordinator_name'), _text(row, 'coordinator_phone'), _text(row, 'coordinator_email'),
+        _number(row, 'expected_participants', int), actual_participants,
+        _number(row, 'income'), _number(row, 'expense'), _text(row, 'notes'),
+        _text(row, 'status') or 'In Progress', quarter,
+    )
+    return params, (quarter, event_type_id or 0, 1, actual_participants, 0, 0, 0)
+
+
+def _volunteer_params(row, lookups):
+    params = (
+        _text(row, 'name', required=True), _text(row, 'phone'), _text(row, 'email'),
+        _text(row, 'address'), _text(row, 'notes'),
+    )
+    return params, None
+
+
+def _contribution_params(row, lookups):
+    event_id = _text(row, 'event_id')
+    if event_id is not None:
+        try:
+            event_id = int(event_id)
+        except ValueError:
+            raise RowError(f'event_id is not an integer: {event_id!r}')
+    else:
+        name = _text(row, 'event_name', required=True)
+        event_date = _date(row, 'event_date')
+        key = (_key(name), event_date)
+        if key not in lookups.event_keys:
+            raise RowError(f'Unknown event: {name!r} on {event_date}')
+        event_id = lookups.event_keys[key]
+        if event_id is None:
+            raise RowError(f'Ambiguous event: several are named {name!r} on {event_date}; give event_id instead')
+    if event_id not in lookups.events:
+        raise RowError(f'Unknown event id: {event_id}')
+
+    volunteer_id = lookups.resolve(row, 'volunteer_id', 'volunteer', lookups.volunteers, 'volunteer')
+    if volunteer_id is not None and volunteer_id not in lookups.volunteer_names:
+        raise RowError(f'Unknown volunteer id: {volunteer_id}')
+    volunteer_name = lookups.volunteer_names.get(volunteer_id) or _text(row, 'volunteer_name', required=True)
+
+    hours = _number(row, 'volunteer_hours')
+    cash = _number(row, 'cash_donation')
+    material = _number(row, 'material_value')
+    params = (
+        event_id, volunteer_id, volunteer_name, _text(row, 'volunteer_contact'),
+        hours, cash, _text(row, 'material_description'), material,
+    )
+    quarter, event_type_id = lookups.events[event_id]
+    return params, (quarter, event_type_id, 0, 0, hours, cash, material)
+
+
+# kind -> (row builder, INSERT statement, tables its lookups need)
+KINDS = {
+    'events': (_event_params, '''
+        INSERT INTO event_profiles
+        (event_name, event_date, event_type_id, location, description,
+         organization_id, coordinator_name, coordinator_phone, coordinator_email,
+         expected_participants, actual_participants, income, expense, notes, status, quarter)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', ('event_types', 'organizations', 'closed_quarters')),
+    'volunteers': (_volunteer_params, '''
+        INSERT INTO volunteers (name, phone, email, address, notes)
+        VALUES (?, ?, ?, ?, ?)
+    ''', ()),
+    'contributions': (_contribution_params, '''
+        INSERT INTO contributions (event_id, volunteer_id, volunteer_name, volunteer_contact,
+                                   volunteer_hours, cash_donation, material_description, material_value)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', ('volunteers', 'event_profiles')),
+}
+
+
+def _write_chunk(conn, sql, chunk, errors):
+    """Insert a validated chunk in one transaction; returns rows inserted.
+
+    If the batch insert hits a constraint, the chunk is retried row by row
+    so only the offending rows are reported and skipped.
+    """
+    cursor = conn.cursor()
+    begin_immediate(conn)
+    try:
+        cursor.executemany(sql, [params for _, params, _ in chunk])
+        rollups.apply_deltas(cursor, [delta for _, _, delta in chunk if delta])
+        conn.commit()
+        return len(chunk)
+    except sqlite3.IntegrityError:
+        conn.rollback()
+    inserted = []
+    begin_immediate(conn)
+    for line_number, params, delta in chunk:
+        try:
+            cursor.execute('SAVEPOINT import_row')
+            cursor.execute(sql, params)
+            cursor.execute('RELEASE import_row')
+            inserted.append(delta)
+        except sqlite3.IntegrityError as e:
+            cursor.execute('ROLLBACK TO import_row')
+            cursor.execute('RELEASE import_row')
+            errors.append((line_number, str(e)))
+    rollups.apply_deltas(cursor, [delta for delta in inserted if delta])
+    conn.commit()
+    return len(inserted)
+
+
+def import_rows(conn, kind, rows, chunk_size=CHUNK_SIZE, progress=None):
+    """Import (line_number, dict) rows of the given kind and return a report dict
+
+    progress(rows_read, inserted) is called after each chunk is written.
+    """
+    if kind not in KINDS:
+        raise ValueError(f'Unknown import kind: {kind}')
+    build, sql, tables = KINDS[kind]
+    start = time.perf_counter()
+    lookups = Lookups(conn.cursor(), tables)
+    errors = []
+    inserted = 0
+    total = 0
+    chunk = []
+    for line_number, row in rows:
+        total += 1
+        try:
+            if isinstance(row, Exception):
+                raise row
+            if not isinstance(row, dict):
+                raise RowError('Row is not an object')
+            params, delta = build(row, lookups)
+        except RowError as e:
+            errors.append((line_number, str(e)))
+            continue
+        chunk.append((line_number, params, delta))
+        if len(chunk) >= chunk_size:
+            inserted += _write_chunk(conn, sql, chunk, errors)
+            chunk = []
+            if progress:
+                progress(total, inserted)
+    if chunk:
+        inserted += _write_chunk(conn, sql, chunk, errors)
+
+    elapsed = time.perf_counter() - start
+    errors.sort()
+    return {
+        'kind': kind,
+        'rows': total,
+        'inserted': inserted,
+        'failed': len(errors),
+        'errors': errors[:MAX_REPORTED_ERRORS],
+        'seconds': round(elapsed, 3),
+        'rows_per_sec': round(total / elapsed, 1) if elapsed else None,
+    }
+
+
+def import_file(conn, kind, stream, fmt, chunk_size=CHUNK_SIZE, progress=None):
+    """Import a binary or text file object in csv or ndjson format"""
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    return import_rows(conn, kind, read_rows(stream, fmt), chunk_size, progress)
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+    from database import get_db
+    if len(sys.argv) != 3 or sys.argv[1] not in KINDS:
+        print(__doc__.strip().splitlines()[-1])
+        sys.exit(2)
+    kind, path = sys.argv[1], sys.argv[2]
+    fmt = os.path.splitext(path)[1].lstrip('.').lower()
+    conn = get_db()
+    with open(path, 'rb') as f:
+        report = import_file(conn, kind, f, fmt)
+    conn.close()
+    for line_number, message in report['errors']:
+        print(f"line {line_number}: {message}")
+    print(f"{report['inserted']}/{report['rows']} {kind} imported, {report['failed']} failed, "
+          f"{report['rows_per_sec']} rows/sec")
@@ -0,0 +1,241 @@
+"""Optional per-request profiling and SQL instrumentation
+
+Enabled with COMMUNITY_PROFILE=1. When enabled, every request connection is
+wrapped so each statement's text, duration and row count are recorded, and
+template rendering is timed separately. Each response gets a Server-Timing
+header, a structured log line is written to the `community.profile` logger,
+and rolling per-endpoint latency percentiles are served at /metrics in
+Prometheus text format. When disabled nothing is installed, so requests pay
+nothing for it.
+
+Metrics are per process; under gunicorn each worker reports its own.
+"""
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from flask import g, request, Response
+from flask.signals import before_render_template, template_rendered
+
+import database
+
+logger = logging.getLogger('community.profile')
+
+# Recent samples kept per endpoint for the rolling percentiles
+WINDOW = 1024
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+def enabled():
+    return os.environ.get('COMMUNITY_PROFILE', '').lower() in ('1', 'true', 'yes')
+
+
+# ---------- SQL tracing ----------
+
+class TracedCursor:
+    """Cursor proxy that charges execute and fetch time to the current statement"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+        self._entry = None
+
+    def _run(self, method, sql, params):
+        start = time.perf_counter()
+        try:
+            return method(sql, params)
+        finally:
+            self._entry = {'sql': ' '.join(sql.split()), 'seconds': time.perf_counter() - start, 'rows': 0}
+            statements = g.get('sql_statements')
+            if statements is not None:
+                statements.append(self._entry)
+
+    def execute(self, sql, params=()):
+        self._run(self._cursor.execute, sql, params)
+        if self._entry is not None and self._cursor.rowcount > 0:
+            self._entry['rows'] = self._cursor.rowcount
+        return self
+
+    def executemany(self, sql, seq_of_params):
+        self._run(self._cursor.executemany, sql, seq_of_params)
+        if self._entry is not None and self._cursor.rowcount > 0:
+            self._entry['rows'] = self._cursor.rowcount
+        return self
+
+    def _fetch(self, method, *args):
+        start = time.perf_counter()
+        result = method(*args)
+        if self._entry is not None:
+            self._entry['seconds'] += time.perf_counter() - start
+            if isinstance(result, list):
+                self._entry['rows'] += len(result)
+            elif result is not None:
+                self._entry['rows'] += 1
+        return result
+
+    def fetchone(self):
+        return self._fetch(self._cursor.fetchone)
+
+    def fetchall(self):
+        return self._fetch(self._cursor.fetchall)
+
+    def fetchmany(self, size=None):
+        return self._fetch(self._cursor.fetchmany, size or self._cursor.arraysize)
+
+    def __iter__(self):
+        while True:
+            row = self.fetchone()
+            if row is None:
+                return
+            yield row
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TracedConnection:
+    """Connection proxy whose cursors and shortcut execute() are traced"""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self):
+        return TracedCursor(self._conn.cursor())
+
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+# ---------- Rolling metrics ----------
+
+class Metrics:
+    """Per-endpoint rolling latency samples plus lifetime counts and sums"""
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, name, endpoint, seconds):
+        with self._lock:
+            series = self._series.setdefault((name, endpoint), [deque(maxlen=self.window), 0, 0.0])
+            series[0].append(seconds)
+            series[1] += 1
+            series[2] += seconds
+
+    def snapshot(self):
+        """[(name, endpoint, {quantile: value}, count, total)] for every series"""
+        with self._lock:
+            items = [(name, endpoint, sorted(samples), count, total)
+                     for (name, endpoint), (samples, count, total) in self._series.items()]
+        result = []
+        for name, endpoint, samples, count, total in sorted(items):
+            quantiles = {q: samples[min(len(samples) - 1, int(q * len(samples)))] for q in QUANTILES}
+            result.append((name, endpoint, quantiles, count, total))
+        return result
+
+
+metrics = Metrics()
+
+_HELP = {
+    'request_duration_seconds': 'Request latency per endpoint',
+    'sql_duration_seconds': 'Time spent in SQL per request',
+    'template_duration_seconds': 'Time spent rendering templates per request',
+}
+
+
+def render_prometheus():
+    """Current metrics in Prometheus text exposition format"""
+    lines = []
+    current = None
+    for name, endpoint, quantiles, count, total in metrics.snapshot():
+        metric = f'community_{name}'
+        if name != current:
+            current = name
+            lines.append(f'# HELP {metric} {_HELP.get(name, name)}')
+            lines.append(f'# TYPE {metric} summary')
+        label = endpoint.replace('\\', '\\\\').replace('"', '\\"')
+        for q, value in quantiles.items():
+            lines.append(f'{metric}{{endpoint="{label}",quantile="{q}"}} {value:.6f}')
+        lines.append(f'{metric}_sum{{endpoint="{label}"}} {total:.6f}')
+        lines.append(f'{metric}_count{{endpoint="{label}"}} {count}')
+    for key, value in database.pool.stats().items():
+        metric = f'community_db_pool_{key}'
+        lines.append(f'# TYPE {metric} gauge')
+        lines.append(f'{metric} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+# ---------- Flask hooks ----------
+
+def _start_request():
+    g.profile_start = time.perf_counter()
+    g.sql_statements = []
+    g.template_seconds = 0.0
+
+
+def _before_render(sender, template, context, **extra):
+    g.template_start = time.perf_counter()
+
+
+def _after_render(sender, template, context, **extra):
+    start = g.pop('template_start', None)
+    if start is not None:
+        g.template_seconds = g.get('template_seconds', 0.0) + time.perf_counter() - start
+
+
+def _finish_request(response):
+    start = g.get('profile_start')
+    if start is None:
+        return response
+    total = time.perf_counter() - start
+    statements = g.get('sql_statements', [])
+    sql_seconds = sum(s['seconds'] for s in statements)
+    template_seconds = g.get('template_seconds', 0.0)
+    endpoint = request.endpoint or 'unknown'
+
+    response.headers['Server-Timing'] = ', '.join([
+        f'db;dur={sql_seconds * 1000:.2f};desc="{len(statements)} queries"',
+        f'tpl;dur={template_seconds * 1000:.2f}',
+        f'total;dur={total * 1000:.2f}',
+    ])
+    metrics.observe('request_duration_seconds', endpoint, total)
+    metrics.observe('sql_duration_seconds', endpoint, sql_seconds)
+    metrics.observe('template_duration_seconds', endpoint, template_seconds)
+    logger.info(json.dumps({
+        'method': request.method,
+        'path': request.path,
+        'endpoint': endpoint,
+        'status': response.status_code,
+        'ms': round(total * 1000, 2),
+        'sql_ms': round(sql_seconds * 1000, 2),
+        'template_ms': round(template_seconds * 1000, 2),
+        'queries': [{'sql': s['sql'][:200], 'ms': round(s['seconds'] * 1000, 3), 'rows': s['rows']}
+                    for s in statements],
+    }))
+    return response
+
+
+def init_instrumentation(app):
+    """Install profiling hooks and /metrics if COMMUNITY_PROFILE is set"""
+    if not enabled():
+        return False
+    database.connection_wrapper = TracedConnection
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+    app.add_url_rule('/metrics', 'metrics',
+                     lambda: Response(render_prometheus(), mimetype='text/plain; version=0.0.4'))
+    if not logger.handlers and not logging.getLogger().handlers:
+        logging.basicConfig(level=logging.INFO)
+    logger.setLevel(logging.INFO)
+    return True
@@ -0,0 +1,566 @@
+"""Background jobs queued in a SQLite table
+
+Heavy or recurring work runs in job workers (`python jobs.py work`, which
+gunicorn.conf.py starts beside the server), never in a web worker. A
+request queues a job and gets its id; the browser polls /jobs/<id> and is
+sent on to /jobs/<id>/result once it is done.
+
+- Claims are atomic across processes: one UPDATE ... RETURNING under
+  BEGIN IMMEDIATE moves the best queued job (highest priority, then
+  oldest) to running.
+- A running job's heartbeat is refreshed while it runs; a job whose
+  heartbeat is older than JOB_LEASE_SECONDS lost its worker and is retried.
+- Each worker process also records itself in job_workers every
+  WORKER_BEAT seconds, so the web app can tell when nobody would pick a
+  job up (workers_alive()) and do the work itself instead of waiting.
+- A job that raises, or returns a result that is not JSON, is retried
+  after JOB_RETRY_DELAY, doubling each attempt, until max_attempts; then
+  it is failed with the error kept.
+- A worker thread survives errors outside handlers too (a claim that finds
+  the database locked): it logs them and backs off, up to
+  MAX_ERROR_BACKOFF, instead of dying.
+- Handlers report progress (0..1 and a message) through their context.
+- A memo_key makes submit() return the queued, running or finished job
+  with the same key instead of adding another. Reports are keyed by
+  quarter and the versions the report shows, so a report is computed once
+  per change to its data.
+
+RECURRING jobs (rollup rebuilds, ANALYZE, incremental vacuum, a full
+identity-matching pass, pruning old jobs) are queued by the workers themselves, once per interval, with the
+interval bucket as memo key so several workers queue each run only once.
+"""
+import json
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import database
+import exports
+import identity
+import importer
+import queries
+import rollups
+import versions
+
+POLL_INTERVAL = float(os.environ.get('JOB_POLL_INTERVAL', 0.5))
+THREADS = int(os.environ.get('JOB_THREADS', 2))
+LEASE_SECONDS = float(os.environ.get('JOB_LEASE_SECONDS', 300))
+RETRY_DELAY = float(os.environ.get('JOB_RETRY_DELAY', 5))
+KEEP_DAYS = float(os.environ.get('JOB_KEEP_DAYS', 7))
+# A worker loop that hits an error (e.g. database is locked) waits this long,
+# doubling up to MAX_ERROR_BACKOFF while the errors continue
+ERROR_BACKOFF = 1
+MAX_ERROR_BACKOFF = 60
+
+# Seconds between a worker process's heartbeats; after three missed beats
+# workers_alive() stops counting it
+WORKER_BEAT = min(10, LEASE_SECONDS / 3)
+
+# Progress is written at most this often (the final update always is)
+PROGRESS_EVERY = 0.5
+
+# kind -> seconds between runs; JOB_RECURRING="analyze=3600,vacuum=0" overrides (0 disables)
+RECURRING = {'rebuild_rollups': 24 * 3600, 'analyze': 24 * 3600, 'vacuum': 7 * 24 * 3600, 'prune_jobs': 24 * 3600,
+             'resolve_identities': 24 * 3600}
+RECURRING.update({kind: int(every) for kind, every in
+                  (item.split('=') for item in os.environ.get('JOB_RECURRING', '').split(',') if '=' in item)})
+RECURRING_CHECK = 60
+# Parameters of the recurring runs, where not the handler's defaults
+RECURRING_PARAMS = {'resolve_identities': {'full': True}}
+
+STATUSES = ('queued', 'running', 'done', 'failed')
+
+# kind -> (function, default priority, default max attempts)
+HANDLERS = {}
+
+logger = logging.getLogger('community.jobs')
+
+
+def handler(kind, priority=0, max_attempts=3):
+    """Register fn(ctx, **params) as the handler of a job kind; its return
+    value, which must be JSON-serializable, is the job's result"""
+    def register(fn):
+        HANDLERS[kind] = (fn, priority, max_attempts)
+        return fn
+    return register
+
+
+def job_dir():
+    """COMMUNITY_JOB_DIR, or jobs/ beside the database; holds result files"""
+    if os.environ.get('COMMUNITY_JOB_DIR'):
+        return os.environ['COMMUNITY_JOB_DIR']
+    return os.path.join(os.path.dirname(os.path.abspath(database.DATABASE)), 'jobs')
+
+
+# ---------- Queue ----------
+
+def submit(conn, kind, params=None, memo_key=None, priority=None, max_attempts=None, delay=0, debounce=None):
+    """Queue a job and return its row as a dict.
+
+    With memo_key, a queued, running or finished job with that key is
+    returned instead of queueing another. With debounce=<seconds>, all
+    submissions in the same window share one job, run when the window ends,
+    so it sees everything submitted during it; the window is part of the
+    memo key, so this holds across processes. A memo key that already has
+    its job is found with a plain read and never takes the write lock.
+    Raises ValueError for an unknown kind.
+    """
+    if kind not in HANDLERS:
+        raise ValueError(f'Unknown job kind: {kind}')
+    _, default_priority, default_attempts = HANDLERS[kind]
+    now = time.time()
+    cursor = conn.cursor()
+    if debounce:
+        window = int(now // debounce)
+        memo_key = f'{kind}{json.dumps(params or {}, sort_keys=True)}@debounce:{window}'
+        delay = (window + 1) * debounce - now
+    if memo_key is not None:
+        cursor.execute("SELECT * FROM jobs WHERE memo_key = ? AND status != 'failed'", (memo_key,))
+        row = cursor.fetchone()
+        if row is not None:
+            return dict(row)
+    with database.transaction(conn):
+        # The partial unique index on memo_key turns a duplicate into a no-op
+        cursor.execute('''
+            INSERT OR IGNORE INTO jobs (kind, params, memo_key, priority, max_attempts, run_after, created_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', (kind, json.dumps(params or {}, sort_keys=True), memo_key,
+              default_priority if priority is None else priority,
+              default_attempts if max_attempts is None else max_attempts, now + delay, now))
+        if cursor.rowcount:
+            cursor.execute('SELECT * FROM jobs WHERE id = ?', (cursor.lastrowid,))
+        else:
+            cursor.execute("SELECT * FROM jobs WHERE memo_key = ? AND status != 'failed'", (memo_key,))
+        return dict(cursor.fetchone())
+
+
+def get(cursor, job_id):
+    cursor.execute('SELECT * FROM jobs WHERE id = ?', (job_id,))
+    row = cursor.fetchone()
+    return dict(row) if row else None
+
+
+def workers_alive(cursor, now=None):
+    """Whether any job worker process has checked in recently"""
+    now = time.time() if now is None else now
+    cursor.execute('SELECT EXISTS(SELECT 1 FROM job_workers WHERE seen > ?)', (now - 3 * WORKER_BEAT,))
+    return bool(cursor.fetchone()[0])
+
+
+def describe(job):
+    """A job as shown to clients polling it (the result payload left out)"""
+    return {
+        'id': job['id'], 'kind': job['kind'], 'params': json.loads(job['params']), 'status': job['status'],
+        'progress': job['progress'], 'message': job['message'], 'attempts': job['attempts'],
+        'max_attempts': job['max_attempts'], 'error': job['error'], 'created_at': job['created_at'],
+        'started_at': job['started_at'], 'finished_at': job['finished_at'],
+    }
+
+
+def claim(conn, worker, now=None):
+    """Atomically take the best ready job for worker; returns it or None"""
+    now = time.time() if now is None else now
+    cursor = conn.cursor()
+    # A plain read first, so idle workers never take the write lock
+    cursor.execute('''
+        SELECT EXISTS(SELECT 1 FROM jobs WHERE status = 'queued' AND run_after <= ?),
+               EXISTS(SELECT 1 FROM jobs WHERE status = 'running' AND heartbeat < ?)
+    ''', (now, now - LEASE_SECONDS))
+    ready, stale = cursor.fetchone()
+    if not ready and not stale:
+        return None
+    with database.transaction(conn):
+        if stale:
+            # Their worker died mid-job; each counts as a failed attempt
+            cursor.execute('''
+                UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+                                finished_at = CASE WHEN attempts >= max_attempts THEN ? END,
+                                error = 'Worker stopped responding', worker = NULL, run_after = ?
+                WHERE status = 'running' AND heartbeat < ?
+            ''', (now, now, now - LEASE_SECONDS))
+        cursor.execute('''
+            UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, started_at = ?,
+                            heartbeat = ?, progress = 0, message = NULL
+            WHERE id = (SELECT id FROM jobs WHERE status = 'queued' AND run_after <= ?
+                        ORDER BY priority DESC, id LIMIT 1)
+            RETURNING *
+        ''', (worker, now, now, now))
+        rows = cursor.fetchall()
+    return dict(rows[0]) if rows else None
+
+
+def _finish(conn, job, worker, result=None, error=None):
+    """Record a job's outcome; result is its already-serialized JSON"""
+    now = time.time()
+    cursor = conn.cursor()
+    # Only while still ours: a job whose lease expired may be running elsewhere
+    with database.transaction(conn):
+        if error is None:
+            cursor.execute('''
+                UPDATE jobs SET status = 'done', progress = 1, result = ?, error = NULL, finished_at = ?
+                WHERE id = ? AND status = 'running' AND worker = ?
+            ''', (result, now, job['id'], worker))
+        elif job['attempts'] < job['max_attempts']:
+            cursor.execute('''
+                UPDATE jobs SET status = 'queued', error = ?, worker = NULL, run_after = ?
+                WHERE id = ? AND status = 'running' AND worker = ?
+            ''', (error, now + RETRY_DELAY * 2 ** (job['attempts'] - 1), job['id'], worker))
+        else:
+            cursor.execute('''
+                UPDATE jobs SET status = 'failed', error = ?, finished_at = ?
+                WHERE id = ? AND status = 'running' AND worker = ?
+            ''', (error, now, job['id'], worker))
+
+
+def queue_recurring(conn, now=None):
+    """Queue this interval's run of each RECURRING kind not yet queued"""
+    now = time.time() if now is None else now
+    keys = {kind: f'{kind}@{int(now // every)}' for kind, every in RECURRING.items() if every > 0}
+    if not keys:
+        return []
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT memo_key FROM jobs WHERE memo_key IN ({', '.join('?' * len(keys))})",
+                   tuple(keys.values()))
+    present = {row[0] for row in cursor.fetchall()}
+    return [submit(conn, kind, RECURRING_PARAMS.get(kind), memo_key=key)
+            for kind, key in keys.items() if key not in present]
+
+
+# ---------- Workers ----------
+
+class JobContext:
+    """What a handler gets: its own connection and a progress reporter"""
+
+    def __init__(self, job, conn, control, worker):
+        self.job = job
+        self.conn = conn
+        self._control = control
+        self._worker = worker
+        self._reported = 0
+
+    @property
+    def cursor(self):
+        return self.conn.cursor()
+
+    def progress(self, fraction, message=None):
+        """Record progress (0..1); also refreshes the job's heartbeat"""
+        now = time.monotonic()
+        if fraction < 1 and now - self._reported < PROGRESS_EVERY:
+            return
+        self._reported = now
+        # On the worker's control connection, outside the handler's transaction
+        with database.transaction(self._control):
+            self._control.execute('''
+                UPDATE jobs SET progress = ?, message = ?, heartbeat = ?
+                WHERE id = ? AND status = 'running' AND worker = ?
+            ''', (min(max(fraction, 0), 1), message, time.time(), self.job['id'], self._worker))
+
+
+class Worker:
+    """Job-running threads plus one heartbeat thread, in this process"""
+
+    def __init__(self, threads=THREADS, recurring=True):
+        self.threads = threads
+        self.recurring = recurring
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._running = {}
+        self._threads = []
+
+    def _name(self, n):
+        return f'{socket.gethostname()}:{os.getpid()}:{n}'
+
+    def start(self):
+        for n in range(self.threads):
+            self._threads.append(threading.Thread(target=self._loop, args=(n,), name=f'job-{n}', daemon=True))
+        self._threads.append(threading.Thread(target=self._heartbeat, name='job-heartbeat', daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        """Stop claiming; jobs already running finish first"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _loop(self, n):
+        control, conn = database.connect(), database.connect()
+        worker = self._name(n)
+        next_recurring = 0
+        backoff = ERROR_BACKOFF
+        try:
+            while not self._stop.is_set():
+                try:
+                    if self.recurring and n == 0 and time.monotonic() >= next_recurring:
+                        queue_recurring(control)
+                        next_recurring = time.monotonic() + RECURRING_CHECK
+                    job = claim(control, worker)
+                    if job is None:
+                        self._stop.wait(POLL_INTERVAL)
+                    else:
+                        self.run(job, conn, control, worker)
+                    backoff = ERROR_BACKOFF
+                except Exception:
+                    logger.exception('Job worker %s failed; retrying in %ss', worker, backoff)
+                    for c in (control, conn):
+                        if c.in_transaction:
+                            c.rollback()
+                    self._stop.wait(backoff)
+                    backoff = min(backoff * 2, MAX_ERROR_BACKOFF)
+        finally:
+            control.close()
+            conn.close()
+
+    def run(self, job, conn, control, worker):
+        """Run one claimed job and record its outcome.
+
+        Anything the handler raises, including an unknown kind or a result
+        that cannot be serialized, fails this attempt. If the outcome itself
+        cannot be recorded the error propagates; the job's heartbeat then
+        stops and its lease expiry requeues it.
+        """
+        with self._lock:
+            self._running[job['id']] = worker
+        try:
+            fn = HANDLERS[job['kind']][0]
+            result = json.dumps(fn(JobContext(job, conn, control, worker), **json.loads(job['params'])))
+        except Exception as e:
+            if conn.in_transaction:
+                conn.rollback()
+            logger.exception('Job %s (%s) failed', job['id'], job['kind'])
+            _finish(control, job, worker, error=f'{type(e).__name__}: {e}')
+        else:
+            _finish(control, job, worker, result=result)
+        finally:
+            with self._lock:
+                del self._running[job['id']]
+
+    def _heartbeat(self):
+        conn = database.connect()
+        name = f'{socket.gethostname()}:{os.getpid()}'
+        started = time.time()
+        try:
+            while True:
+                try:
+                    now = time.time()
+                    with self._lock:
+                        running = list(self._running.items())
+                    with database.transaction(conn):
+                        conn.execute('''
+                            INSERT INTO job_workers (name, threads, started_at, seen) VALUES (?, ?, ?, ?)
+                            ON CONFLICT (name) DO UPDATE SET seen = excluded.seen
+                        ''', (name, self.threads, started, now))
+                        conn.executemany("UPDATE jobs SET heartbeat = ? WHERE id = ? AND worker = ?",
+                                         [(now, job_id, worker) for job_id, worker in running])
+                except Exception:
+                    logger.exception('Job worker heartbeat failed')
+                if self._stop.wait(WORKER_BEAT):
+                    break
+            with database.transaction(conn):
+                conn.execute('DELETE FROM job_workers WHERE name = ?', (name,))
+        finally:
+            conn.close()
+
+
+def run_pending(conn=None):
+    """Run every ready job in this thread until none is left; returns how many ran"""
+    control = database.connect()
+    conn = conn or database.connect()
+    worker = Worker(threads=0)
+    name = worker._name('inline')
+    ran = 0
+    try:
+        while True:
+            job = claim(control, name)
+            if job is None:
+                return ran
+            worker.run(job, conn, control, name)
+            ran += 1
+    finally:
+        control.close()
+
+
+# ---------- Handlers ----------
+
+def report_key(cursor, quarter):
+    """Memo key for a quarter's report: changes whenever what it shows does"""
+    event_types = versions.get_versions(cursor, ['event_types']).get('event_types', 0)
+    return f"report:{quarter}:{versions.get_entity_version(cursor, 'quarter', quarter)}:{event_types}"
+
+
+@handler('report', priority=10)
+def quarter_report(ctx, quarter):
+    ctx.progress(0.1, 'Reading events')
+    report = queries.quarter_report(ctx.cursor, quarter)
+    ctx.progress(0.9, f"{len(report['events'])} events read")
+    report['events'] = [dict(row) for row in report['events']]
+    report['by_type'] = [dict(row) for row in report['by_type']]
+    return report
+
+
+@handler('export', priority=5)
+def export_ledger(ctx, fmt='csv', **filters):
+    """Write a ledger export to a file under job_dir() for download"""
+    if fmt not in exports.FORMATS:
+        raise ValueError(f'Unknown export format: {fmt}')
+    cursor = ctx.cursor
+    total = exports.count_ledger(cursor, **filters)
+    suffix = ''.join(f'_{key}-{value}' for key, value in sorted(filters.items()) if value is not None)
+    filename = f'contributions{suffix}.{fmt}'
+    directory = job_dir()
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"job-{ctx.job['id']}-{filename}")
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    rows = 0
+    try:
+        with os.fdopen(fd, 'w', newline='') as f:
+            for chunk in exports.stream_ledger(cursor, fmt, **filters):
+                f.write(chunk)
+                # Lines, not rows: close enough for a progress bar
+                rows = min(rows + chunk.count('\n'), total)
+                ctx.progress(rows / total if total else 1, f'{rows} of {total} rows')
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return {'path': path, 'filename': filename, 'rows': total, 'bytes': os.path.getsize(path)}
+
+
+@handler('import', priority=5, max_attempts=1)
+def import_upload(ctx, kind, fmt, path):
+    """Import a file the /import page saved under job_dir(), then delete it.
+
+    Not retried: rows are committed a chunk at a time, so a second attempt
+    would insert the chunks the first one already wrote.
+    """
+    size = os.path.getsize(path)
+    try:
+        with open(path, 'rb') as f:
+            report = importer.import_file(
+                ctx.conn, kind, f, fmt,
+                progress=lambda rows, inserted: ctx.progress(f.tell() / size if size else 1,
+                                                             f'{rows} rows read, {inserted} imported'))
+    finally:
+        os.remove(path)
+    if kind in ('volunteers', 'contributions') and report['inserted']:
+        # As the write routes do: new volunteers can match older orphans
+        submit(ctx.conn, 'resolve_identities', {'full': True} if kind == 'volunteers' else None,
+               debounce=identity.BATCH_SECONDS)
+    return report
+
+
+@handler('rebuild_rollups')
+def rebuild_rollups(ctx):
+    ctx.progress(0.1, 'Recomputing rollups')
+    with database.transaction(ctx.conn):
+        drift = rollups.rebuild_rollups(ctx.conn)
+    return {'drifted_rows': len(drift)}
+
+
+@handler('analyze')
+def analyze(ctx):
+    """Refresh planner statistics one table at a time"""
+    cursor = ctx.cursor
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' "
+                   "AND sql NOT LIKE 'CREATE VIRTUAL%'")
+    tables = [row[0] for row in cursor.fetchall()]
+    for n, table in enumerate(tables):
+        ctx.progress(n / len(tables), f'ANALYZE {table}')
+        cursor.execute(f'ANALYZE "{table}"')
+    return {'tables': len(tables)}
+
+
+@handler('vacuum')
+def vacuum(ctx, pages=1000, enable=False):
+    """Return free pages to the filesystem a chunk at a time.
+
+    Needs auto_vacuum = INCREMENTAL; `enable` switches to it with one full
+    VACUUM, which holds the write lock throughout, so submit it off-hours.
+    """
+    cursor = ctx.cursor
+    if enable:
+        ctx.progress(0.1, 'Rebuilding the database file (VACUUM)')
+        cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        cursor.execute('VACUUM')
+    if cursor.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        return {'skipped': 'auto_vacuum is not INCREMENTAL (submit vacuum with {"enable": true} once)'}
+    free = start = cursor.execute('PRAGMA freelist_count').fetchone()[0]
+    while free:
+        # Each chunk is its own short write transaction
+        cursor.execute(f'PRAGMA incremental_vacuum({int(pages)})').fetchall()
+        free = cursor.execute('PRAGMA freelist_count').fetchone()[0]
+        ctx.progress(1 - free / start, f'{start - free} of {start} free pages released')
+    return {'pages_released': start}
+
+
+@handler('resolve_identities', priority=3)
+def resolve_identities(ctx, full=False):
+    """Link orphan contributions to volunteers (see identity.py)"""
+    return identity.resolve(ctx.conn, full=full, progress=ctx.progress)
+
+
+@handler('prune_jobs')
+def prune_jobs(ctx, days=KEEP_DAYS):
+    """Delete finished jobs, and their result files, and worker records
+    older than `days`"""
+    cursor = ctx.cursor
+    cutoff = time.time() - days * 24 * 3600
+    cursor.execute("SELECT id, kind, result FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                   (cutoff,))
+    doomed = cursor.fetchall()
+    for job_id, kind, result in doomed:
+        if kind == 'export' and result:
+            try:
+                os.remove(json.loads(result)['path'])
+            except OSError:
+                pass
+    with database.transaction(ctx.conn):
+        cursor.executemany('DELETE FROM jobs WHERE id = ?', [(row[0],) for row in doomed])
+        cursor.execute('DELETE FROM job_workers WHERE seen < ?', (cutoff,))
+    return {'deleted': len(doomed)}
+
+
+if __name__ == '__main__':
+    import argparse
+    import signal
+    parser = argparse.ArgumentParser(description='Background job queue')
+    sub = parser.add_subparsers(dest='command', required=True)
+    work_parser = sub.add_parser('work', help='run jobs until interrupted')
+    work_parser.add_argument('--threads', type=int, default=THREADS)
+    work_parser.add_argument('--once', action='store_true', help='run the ready jobs, then exit')
+    work_parser.add_argument('--no-recurring', action='store_true', help='do not queue the recurring jobs')
+    submit_parser = sub.add_parser('submit', help='queue a job')
+    submit_parser.add_argument('kind', choices=sorted(HANDLERS))
+    submit_parser.add_argument('--params', default='{}', help='JSON object of handler arguments')
+    submit_parser.add_argument('--priority', type=int)
+    list_parser = sub.add_parser('list', help='list recent jobs')
+    list_parser.add_argument('--status', choices=STATUSES)
+    list_parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    database.ensure_schema()
+    if args.command == 'work':
+        if args.once:
+            print(f'{run_pending()} jobs run')
+        else:
+            logging.basicConfig(level=logging.INFO)
+            worker = Worker(args.threads, recurring=not args.no_recurring).start()
+            stopping = threading.Event()
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(sig, lambda *_: stopping.set())
+            stopping.wait()
+            worker.stop()
+    elif args.command == 'submit':
+        conn = database.connect()
+        job = submit(conn, args.kind, json.loads(args.params), priority=args.priority)
+        print(f"Queued job {job['id']} ({job['kind']})")
+    else:
+        conn = database.connect()
+        sql = 'SELECT * FROM jobs' + (' WHERE status = ?' if args.status else '') + ' ORDER BY id DESC LIMIT ?'
+        for row in conn.execute(sql, ((args.status,) if args.status else ()) + (args.limit,)):
+            print(f"{row['id']:>6}  {row['kind']:16} {row['status']:8} {row['progress'] * 100:>5.0f}%  "
+                  f"attempt {row['attempts']}/{row['max_attempts']}  {row['message'] or row['error'] or ''}")
@@ -0,0 +1,183 @@
+"""Rendered page cache keyed by data version
+
+Detail and report pages are cached as rendered HTML under a key made of
+the route, its parameters and the versions of the entity and tables the
+page shows (see versions.entity_version_steps). Writes never invalidate
+anything explicitly: they bump a version, later requests build a new key,
+and the stale entry ages out of the LRU.
+
+Entries are held in an in-process LRU bounded by PAGE_CACHE_BYTES. When
+PAGE_CACHE_DIR is set, entries are also written there so every gunicorn
+worker on the host shares them; the directory is pruned, oldest first, to
+PAGE_CACHE_DISK_BYTES.
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+from flask import Response, session
+
+import versions
+
+MEMORY_BYTES = int(os.environ.get('PAGE_CACHE_BYTES', 32 * 1024 * 1024))
+DISK_DIR = os.environ.get('PAGE_CACHE_DIR') or None
+DISK_BYTES = int(os.environ.get('PAGE_CACHE_DISK_BYTES', 256 * 1024 * 1024))
+
+# Disk usage is checked once per this many disk writes
+PRUNE_EVERY = 100
+
+
+class PageCache:
+    """Byte-bounded LRU of rendered pages with an optional shared disk tier"""
+
+    def __init__(self, max_bytes=MEMORY_BYTES, directory=DISK_DIR, disk_bytes=DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_bytes = disk_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._disk_writes = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode()).hexdigest() + '.html')
+
+    def _remember(self, key, body):
+        # Caller holds the lock
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= len(old)
+        if len(body) > self.max_bytes:
+            return
+        self._entries[key] = body
+        self.bytes += len(body)
+        while self.bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= len(evicted)
+
+    def get(self, key):
+        """Cached body for key, or None"""
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return body
+        if self.directory:
+            try:
+                with open(self._path(key), 'rb') as f:
+                    body = f.read()
+            except OSError:
+                body = None
+            if body is not None:
+                with self._lock:
+                    self._remember(key, body)
+                    self.disk_hits += 1
+                return body
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, body):
+        with self._lock:
+            self._remember(key, body)
+        if self.directory:
+            self._write(key, body)
+
+    def _write(self, key, body):
+        # Write then rename so other workers never read a partial file
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(body)
+            os.replace(tmp, self._path(key))
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._disk_writes += 1
+            prune = self._disk_writes % PRUNE_EVERY == 0
+        if prune:
+            self.prune_disk()
+
+    def prune_disk(self):
+        """Delete the oldest files until the directory fits disk_bytes"""
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.html'):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._entries), 'bytes': self.bytes, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses,
+                'hit_rate': round((self.hits + self.disk_hits) / lookups, 4) if lookups else None,
+                'directory': self.directory,
+            }
+
+
+cache = PageCache()
+
+
+def page_key(cursor, route, params, entity, tables=()):
+    """Cache key for a page about entity (kind, key) that also shows tables"""
+    kind, key = entity
+    parts = [route, repr(params), f'{kind}:{key}:{versions.get_entity_version(cursor, kind, key)}']
+    if tables:
+        current = versions.get_versions(cursor, tables)
+        parts.extend(f'{t}:{current.get(t, 0)}' for t in sorted(tables))
+    return '|'.join(parts)
+
+
+def cached(cursor, route, params, entity, tables, render):
+    """Serve render() through the cache under page_key(); see serve()"""
+    if session.get('_flashes'):
+        return render()
+    return serve(page_key(cursor, route, params, entity, tables), render)
+
+
+def serve(key, render):
+    """Serve render() through the cache under key; only plain HTML results are stored.
+
+    Requests with pending flash messages bypass the cache, since those are
+    rendered into the page.
+    """
+    if session.get('_flashes'):
+        return render()
+    body = cache.get(key)
+    if body is not None:
+        return Response(body, mimetype='text/html')
+    result = render()
+    if isinstance(result, str):
+        cache.set(key, result.encode())
+    return result
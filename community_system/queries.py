@@ -0,0 +1,242 @@
+"""Read queries shared by the HTML pages and the JSON API
+
+Events of closed quarters live in the yearly archives; the queries below
+route to them through archive.py.
+"""
+import archive
+import rollups
+import totals
+
+EVENT_FILTERS = ('quarter', 'event_type_id', 'organization_id', 'status')
+
+# List pages are keyset-paginated; requested sizes are clamped to MAX_PAGE_SIZE
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def clamp_page_size(limit):
+    """Bound a requested page size to 1..MAX_PAGE_SIZE"""
+    return max(1, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE))
+
+
+_RECENT_EVENTS_SQL = '''
+    SELECT ep.*, et.name as event_type_name
+    FROM event_profiles ep
+    LEFT JOIN event_types et ON ep.event_type_id = et.id
+    ORDER BY ep.event_date DESC LIMIT 5
+'''
+
+
+def dashboard(cursor):
+    """Dashboard totals and the five most recent events"""
+    # All-time totals from the rollups, which also cover archived quarters
+    cursor.execute('''
+        SELECT COALESCE(SUM(total_events), 0) as total_events,
+               COALESCE(SUM(total_volunteer_hours), 0) as total_hours,
+               COALESCE(SUM(total_cash_donations), 0) as total_cash,
+               COALESCE(SUM(total_material_value), 0) as total_material
+        FROM quarterly_summaries
+    ''')
+    result = dict(cursor.fetchone())
+    cursor.execute(_RECENT_EVENTS_SQL)
+    result['recent_events'] = cursor.fetchall()
+    return result
+
+
+def _event_page_sql(schema, filters, limit, after_date=None, after_id=None):
+    where = []
+    params = []
+    for field in EVENT_FILTERS:
+        if filters.get(field):
+            where.append(f'ep.{field} = ?')
+            params.append(filters[field])
+    if after_date and after_id is not None:
+        where.append('(ep.event_date, ep.id) < (?, ?)')
+        params.extend([after_date, after_id])
+
+    return f'''
+        SELECT ep.*, et.name as event_type_name, o.name as org_name
+        FROM {schema}.event_profiles ep
+        LEFT JOIN event_types et ON ep.event_type_id = et.id
+        LEFT JOIN organizations o ON ep.organization_id = o.id
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        ORDER BY ep.event_date DESC, ep.id DESC
+        LIMIT ?
+    ''', params + [limit + 1]
+
+
+def event_page(cursor, filters, limit, after_date=None, after_id=None):
+    """One keyset page of events, newest first.
+
+    Returns (events, cursor) where cursor is the (after_date, after_id) of
+    the next page, or None on the last page. Lists open quarters, or the
+    archive of the quarter filtered on when it is closed.
+    """
+    schema = archive.schema_for(cursor, filters.get('quarter'))
+    cursor.execute(*_event_page_sql(schema, filters, limit, after_date, after_id))
+    events = cursor.fetchall()
+    if len(events) > limit:
+        events = events[:limit]
+        return events, (events[-1]['event_date'], events[-1]['id'])
+    return events, None
+
+
+_EVENT_SQL = '''
+    SELECT ep.*, et.name as event_type_name, o.name as org_name, {year} as archived_year
+    FROM {schema}.event_profiles ep
+    LEFT JOIN event_types et ON ep.event_type_id = et.id
+    LEFT JOIN organizations o ON ep.organization_id = o.id
+    WHERE ep.id = ?
+'''
+
+
+def get_event(cursor, event_id):
+    """Event row with type and organization names, or None.
+
+    archived_year is set on events of closed quarters, which are read-only.
+    """
+    cursor.execute(_EVENT_SQL.format(year='NULL', schema='main'), (event_id,))
+    event = cursor.fetchone()
+    if event is None:
+        # Only ids missing from the hot database are looked up in the archives
+        for year in archive.archived_years(cursor):
+            cursor.execute(_EVENT_SQL.format(year=year, schema=archive.attach(cursor, [year])[0]), (event_id,))
+            event = cursor.fetchone()
+            if event is not None:
+                break
+    return event
+
+
+_EVENT_CONTRIBUTIONS_SQL = 'SELECT * FROM {schema}.contributions WHERE event_id = ?'
+
+
+def event_contributions(cursor, event_id, archived_year=None):
+    schema = archive.schema(archived_year) if archived_year else 'main'
+    cursor.execute(_EVENT_CONTRIBUTIONS_SQL.format(schema=schema), (event_id,))
+    return cursor.fetchall()
+
+
+def totals_of(row):
+    """The running contribution totals carried on an event or volunteer row"""
+    return {column: row[column] for column in totals.COLUMNS}
+
+
+def _volunteer_page_sql(limit, after_name=None, after_id=None):
+    where = ''
+    params = []
+    if after_name is not None and after_id is not None:
+        where = 'WHERE (name, id) > (?, ?)'
+        params = [after_name, after_id]
+    # Totals are maintained on the rows by triggers, so nothing is aggregated here
+    return f'SELECT * FROM volunteers {where} ORDER BY name, id LIMIT ?', params + [limit + 1]
+
+
+def volunteer_page(cursor, limit, after_name=None, after_id=None):
+    """One keyset page of volunteers by name, with their contribution totals.
+
+    Returns (volunteers, cursor) like event_page().
+    """
+    cursor.execute(*_volunteer_page_sql(limit, after_name, after_id))
+    volunteers = cursor.fetchall()
+    if len(volunteers) > limit:
+        volunteers = volunteers[:limit]
+        return volunteers, (volunteers[-1]['name'], volunteers[-1]['id'])
+    return volunteers, None
+
+
+def get_volunteer(cursor, vol_id):
+    cursor.execute('SELECT * FROM volunteers WHERE id = ?', (vol_id,))
+    return cursor.fetchone()
+
+
+_VOLUNTEER_CONTRIBUTIONS_SQL = '''
+    SELECT c.*, ep.event_name, ep.event_date
+    FROM {s}.contributions c
+    JOIN {s}.event_profiles ep ON c.event_id = ep.id
+    WHERE c.volunteer_id = ?
+'''
+_NEWEST_FIRST_SQL = 'SELECT * FROM ({sql}) ORDER BY event_date DESC'
+
+
+def volunteer_contributions(cursor, vol_id):
+    """A volunteer's contributions across every partition, newest first"""
+    rows = []
+    for sql, params in archive.union_batches(cursor, _VOLUNTEER_CONTRIBUTIONS_SQL, (vol_id,)):
+        cursor.execute(_NEWEST_FIRST_SQL.format(sql=sql), params)
+        rows.extend(cursor.fetchall())
+    # More archives than one statement can attach come back in several runs
+    rows.sort(key=lambda row: row['event_date'], reverse=True)
+    return rows
+
+
+def quarters(cursor):
+    """Quarters that have events, newest first, from the rollups"""
+    cursor.execute('SELECT year, quarter FROM quarterly_summaries ORDER BY year DESC, quarter DESC')
+    return [f"{row['year']}Q{row['quarter']}" for row in cursor.fetchall()]
+
+
+_QUARTER_EVENTS_SQL = '''
+    SELECT ep.*, et.name as event_type_name
+    FROM {schema}.event_profiles ep
+    LEFT JOIN event_types et ON ep.event_type_id = et.id
+    WHERE ep.quarter = ?
+    ORDER BY ep.event_date
+'''
+
+
+def quarter_report(cursor, quarter):
+    """Events, totals and per-type breakdown for one quarter"""
+    # A closed quarter is read from its year's archive alone
+    cursor.execute(_QUARTER_EVENTS_SQL.format(schema=archive.schema_for(cursor, quarter)), (quarter,))
+    events = cursor.fetchall()
+
+    # Totals come from the maintained rollups instead of rescanning the quarter
+    totals = rollups.get_quarter_totals(cursor, quarter)
+    return {
+        'quarter': quarter,
+        'events': events,
+        'total_events': totals['total_events'] if totals else 0,
+        'total_hours': totals['total_volunteer_hours'] if totals else 0,
+        'total_cash': totals['total_cash_donations'] if totals else 0,
+        'total_material': totals['total_material_value'] if totals else 0,
+        'total_participants': totals['total_participants'] if totals else 0,
+        'by_type': rollups.get_type_breakdown(cursor, quarter),
+    }
+
+
+# ---------- Query plans ----------
+
+def hot_queries(cursor):
+    """(name, sql, params) for the statements the pages above run, built
+    by the same code; database.check_query_plans() explains each one.
+
+    Archives are attached as a side effect, so the partition union is
+    checked as a real UNION once any quarter is closed.
+    """
+    after = ('2024-01-01', 1)
+    queries = [
+        ('dashboard recent events', _RECENT_EVENTS_SQL, ()),
+        ('event_page first page', *_event_page_sql('main', {}, DEFAULT_PAGE_SIZE)),
+        ('event_page next page', *_event_page_sql('main', {}, DEFAULT_PAGE_SIZE, *after)),
+    ]
+    for field, value in (('quarter', '2024Q1'), ('event_type_id', 1), ('organization_id', 1),
+                         ('status', 'completed')):
+        queries.append((f'event_page by {field}', *_event_page_sql('main', {field: value}, DEFAULT_PAGE_SIZE, *after)))
+    queries += [
+        ('get_event', _EVENT_SQL.format(year='NULL', schema='main'), (1,)),
+        ('event contributions', _EVENT_CONTRIBUTIONS_SQL.format(schema='main'), (1,)),
+        ('volunteer_page first page', *_volunteer_page_sql(DEFAULT_PAGE_SIZE)),
+        ('volunteer_page next page', *_volunteer_page_sql(DEFAULT_PAGE_SIZE, 'M', 1)),
+    ]
+    sql, params = next(archive.union_batches(cursor, _VOLUNTEER_CONTRIBUTIONS_SQL, (1,)))
+    queries.append(('volunteer contributions', _NEWEST_FIRST_SQL.format(sql=sql), params))
+    queries.append(('quarter report', _QUARTER_EVENTS_SQL.format(schema='main'), ('2024Q1',)))
+    years = archive.archived_years(cursor)
+    if years:
+        schema = archive.attach(cursor, years[:1])[0]
+        queries += [
+            ('event_page archived quarter', *_event_page_sql(schema, {'quarter': f'{years[0]}Q1'}, DEFAULT_PAGE_SIZE)),
+            ('archived event contributions', _EVENT_CONTRIBUTIONS_SQL.format(schema=schema), (1,)),
+            ('archived quarter report', _QUARTER_EVENTS_SQL.format(schema=schema), (f'{years[0]}Q1',)),
+        ]
+    return queries
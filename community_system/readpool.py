@@ -0,0 +1,171 @@
+"""Bounded pool for heavy read-only queries
+
+Enabled with COMMUNITY_READ_POOL=1 (the gunicorn.conf.py preset sets it).
+Heavy read routes hand their SQLite work to run(), which executes it on a
+small per-process thread pool of read-only connections (`mode=ro` URIs;
+under WAL they never block or get blocked by writers). Each route group has
+its own concurrency limit, so a burst of quarter reports cannot take every
+connection from the list pages, and every query gets a deadline enforced by
+a progress handler that interrupts it.
+
+When a group is full for longer than READ_QUEUE_TIMEOUT the request fails
+fast with Overloaded; a query past its deadline fails with QueryTimeout.
+When the pool is disabled run() calls the function inline on the request
+connection, with no limits or deadlines. Pool connections are wrapped with
+database.connection_wrapper like request connections, and run() carries the
+request's context onto the pool thread, so COMMUNITY_PROFILE sees their SQL.
+"""
+import contextvars
+import os
+import pathlib
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import database
+
+THREADS = int(os.environ.get('READ_POOL_THREADS', min(8, 2 * (os.cpu_count() or 1))))
+QUERY_TIMEOUT = float(os.environ.get('READ_QUERY_TIMEOUT', 15))
+QUEUE_TIMEOUT = float(os.environ.get('READ_QUEUE_TIMEOUT', 2))
+
+# Concurrent requests allowed per route group, e.g. READ_LIMITS="report=2,export=1"
+LIMITS = {'list': 4, 'report': 2, 'analytics': 2, 'export': 2, 'search': 4}
+LIMITS.update({name: int(value) for name, value in
+               (item.split('=') for item in os.environ.get('READ_LIMITS', '').split(',') if '=' in item)})
+
+# SQLite VM instructions between deadline checks
+PROGRESS_STEPS = 10000
+
+
+def enabled():
+    return os.environ.get('COMMUNITY_READ_POOL', '').lower() in ('1', 'true', 'yes')
+
+
+class Overloaded(RuntimeError):
+    """Too many requests of one route group are already running"""
+
+
+class QueryTimeout(RuntimeError):
+    """A query ran past its deadline and was interrupted"""
+
+
+class ReadPool:
+    """Per-process executor whose threads each own one read-only connection"""
+
+    def __init__(self, threads=THREADS, limits=LIMITS):
+        self.threads = threads
+        self.limits = dict(limits)
+        self._lock = threading.Lock()
+        self._pid = None
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _ensure_started(self):
+        # Threads do not survive fork(); each worker builds its own pool
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._local = threading.local()
+            self._executor = ThreadPoolExecutor(self.threads, thread_name_prefix='read')
+            self._semaphores = {name: threading.BoundedSemaphore(n) for name, n in self.limits.items()}
+            self.rejected = 0
+            self.timeouts = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            uri = pathlib.Path(database.DATABASE).absolute().as_uri() + '?mode=ro'
+            conn = sqlite3.connect(uri, uri=True, timeout=database.BUSY_TIMEOUT, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+            conn.execute(f'PRAGMA cache_size = -{database.CACHE_SIZE_KB}')
+            conn.execute(f'PRAGMA mmap_size = {database.MMAP_SIZE}')
+            self._local.deadline = None
+            conn.set_progress_handler(self._check_deadline, PROGRESS_STEPS)
+            self._local.conn = conn
+        return conn
+
+    def _check_deadline(self):
+        deadline = self._local.deadline
+        return 1 if deadline is not None and time.monotonic() > deadline else 0
+
+    def _execute(self, fn, args, timeout):
+        conn = self._connection()
+        self._local.deadline = time.monotonic() + timeout
+        if database.connection_wrapper:
+            conn = database.connection_wrapper(conn)
+        try:
+            return fn(conn.cursor(), *args)
+        except sqlite3.OperationalError as e:
+            if 'interrupted' in str(e):
+                with self._lock:
+                    self.timeouts += 1
+                raise QueryTimeout(f'Query took longer than {timeout}s') from e
+            raise
+        finally:
+            self._local.deadline = None
+
+    def acquire(self, group):
+        """Take a slot in a route group or raise Overloaded"""
+        self._ensure_started()
+        semaphore = self._semaphores.get(group)
+        if semaphore is not None and not semaphore.acquire(timeout=QUEUE_TIMEOUT):
+            with self._lock:
+                self.rejected += 1
+            raise Overloaded(f'Too many {group} requests in progress')
+        return semaphore
+
+    def run(self, group, fn, *args, timeout=QUERY_TIMEOUT):
+        """Return fn(cursor, *args) computed on a read-only pool connection"""
+        semaphore = self.acquire(group)
+        try:
+            # The copied context gives the pool thread the request's flask.g
+            context = contextvars.copy_context()
+            return self._executor.submit(context.run, self._execute, fn, args, timeout).result()
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+
+    def stats(self):
+        with self._lock:
+            return {'enabled': enabled(), 'threads': self.threads, 'limits': self.limits,
+                    'rejected': self.rejected, 'timeouts': self.timeouts}
+
+
+pool = ReadPool()
+
+
+def run(group, fn, *args):
+    """fn(cursor, *args) on the read pool when enabled, else on the request connection"""
+    if not enabled():
+        return fn(database.get_db().cursor(), *args)
+    return pool.run(group, fn, *args)
+
+
+class _Limited:
+    """Response body iterator that frees its group slot when closed"""
+
+    def __init__(self, body, semaphore):
+        self._body = iter(body)
+        self._semaphore = semaphore
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._body)
+
+    def close(self):
+        if hasattr(self._body, 'close'):
+            self._body.close()
+        if self._semaphore is not None:
+            self._semaphore.release()
+            self._semaphore = None
+
+
+def limited(group, body):
+    """Wrap a streamed response body so it holds a slot in group until closed"""
+    if not enabled():
+        return body
+    return _Limited(body, pool.acquire(group))
@@ -0,0 +1,53 @@
+"""Versioned in-process cache of the small reference tables
+
+event_types and organizations appear in every event form and filter bar
+but change rarely. Each worker keeps one copy of both lists and only
+reloads a list when its data_versions counter moves, so a form render costs
+one primary-key lookup instead of two table reads. The add/delete routes
+also call invalidate() so this worker reloads without waiting on the check.
+"""
+import threading
+
+import versions
+
+_QUERIES = {
+    'event_types': 'SELECT * FROM event_types ORDER BY name',
+    'organizations': 'SELECT * FROM organizations ORDER BY name',
+}
+
+
+class ReferenceCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = {}
+        self._versions = {}
+
+    def get(self, cursor, table):
+        """Rows of a reference table, reloaded only when the table changed"""
+        current = versions.get_versions(cursor, [table]).get(table)
+        with self._lock:
+            if self._versions.get(table) == current and table in self._data:
+                return self._data[table]
+        cursor.execute(_QUERIES[table])
+        rows = cursor.fetchall()
+        with self._lock:
+            self._data[table] = rows
+            self._versions[table] = current
+        return rows
+
+    def event_types(self, cursor):
+        return self.get(cursor, 'event_types')
+
+    def organizations(self, cursor):
+        return self.get(cursor, 'organizations')
+
+    def invalidate(self, table=None):
+        """Force a reload of one table (or both) on next use"""
+        with self._lock:
+            if table is None:
+                self._versions.clear()
+            else:
+                self._versions.pop(table, None)
+
+
+reference = ReferenceCache()
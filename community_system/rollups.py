@@ -0,0 +1,256 @@
+"""Incrementally maintained quarterly rollups
+
+`quarterly_summaries` holds one row per quarter and `quarterly_type_summaries`
+one row per (quarter, event type). The routes that change events or
+contributions call the helpers below inside their own transaction, so the
+rollups commit (or roll back) together with the data they describe.
+"""
+
+# Column order shared by both rollup tables and by the delta tuples below:
+# (events, participants, volunteer_hours, cash_donations, material_value)
+_EVENT_DELTA_SQL = '''
+    SELECT ep.quarter, COALESCE(ep.event_type_id, 0) as event_type_id,
+           1, COALESCE(ep.actual_participants, 0) + 0,
+           COALESCE(SUM(c.volunteer_hours), 0),
+           COALESCE(SUM(c.cash_donation), 0),
+           COALESCE(SUM(c.material_value), 0)
+    FROM event_profiles ep
+    LEFT JOIN contributions c ON c.event_id = ep.id
+    WHERE ep.id = ?
+    GROUP BY ep.id
+'''
+
+_CONTRIBUTION_DELTA_SQL = '''
+    SELECT ep.quarter, COALESCE(ep.event_type_id, 0) as event_type_id,
+           0, 0,
+           COALESCE(c.volunteer_hours, 0) + 0,
+           COALESCE(c.cash_donation, 0) + 0,
+           COALESCE(c.material_value, 0) + 0
+    FROM contributions c
+    JOIN event_profiles ep ON c.event_id = ep.id
+    WHERE c.id = ?
+'''
+
+_UPSERT_QUARTER_SQL = '''
+    INSERT INTO quarterly_summaries
+        (year, quarter, total_events, total_participants,
+         total_volunteer_hours, total_cash_donations, total_material_value)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(year, quarter) DO UPDATE SET
+        total_events = total_events + excluded.total_events,
+        total_participants = total_participants + excluded.total_participants,
+        total_volunteer_hours = total_volunteer_hours + excluded.total_volunteer_hours,
+        total_cash_donations = total_cash_donations + excluded.total_cash_donations,
+        total_material_value = total_material_value + excluded.total_material_value,
+        generated_at = CURRENT_TIMESTAMP
+'''
+
+_UPSERT_TYPE_SQL = '''
+    INSERT INTO quarterly_type_summaries
+        (year, quarter, event_type_id, total_events, total_participants,
+         total_volunteer_hours, total_cash_donations, total_material_value)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(year, quarter, event_type_id) DO UPDATE SET
+        total_events = total_events + excluded.total_events,
+        total_participants = total_participants + excluded.total_participants,
+        total_volunteer_hours = total_volunteer_hours + excluded.total_volunteer_hours,
+        total_cash_donations = total_cash_donations + excluded.total_cash_donations,
+        total_material_value = total_material_value + excluded.total_material_value
+'''
+
+# Full recompute, grouped the same way the rollup tables are keyed
+_RECOMPUTE_TYPE_SQL = '''
+    SELECT ep.quarter, COALESCE(ep.event_type_id, 0) as event_type_id,
+           COUNT(*) as total_events,
+           COALESCE(SUM(ep.actual_participants), 0) as total_participants,
+           COALESCE(SUM(c.hours), 0) as total_volunteer_hours,
+           COALESCE(SUM(c.cash), 0) as total_cash_donations,
+           COALESCE(SUM(c.material), 0) as total_material_value
+    FROM event_profiles ep
+    LEFT JOIN (
+        SELECT event_id, SUM(volunteer_hours) as hours,
+               SUM(cash_donation) as cash, SUM(material_value) as material
+        FROM contributions GROUP BY event_id
+    ) c ON c.event_id = ep.id
+    WHERE ep.quarter IS NOT NULL
+    GROUP BY ep.quarter, COALESCE(ep.event_type_id, 0)
+'''
+
+TOTAL_COLUMNS = ('total_events', 'total_participants', 'total_volunteer_hours',
+                 'total_cash_donations', 'total_material_value')
+
+# Float sums drift slightly under repeated add/subtract
+TOLERANCE = 1e-6
+
+
+def split_quarter(quarter):
+    """Split '2024Q3' into (2024, 3)"""
+    year, q = quarter.split('Q')
+    return int(year), int(q)
+
+
+def apply_deltas(cursor, deltas):
+    """Add (quarter, event_type_id, events, participants, hours, cash, material) rows to the rollups"""
+    quarter_rows = []
+    type_rows = []
+    for quarter, event_type_id, *totals in deltas:
+        if not quarter:
+            continue
+        year, q = split_quarter(quarter)
+        quarter_rows.append((year, q, *totals))
+        type_rows.append((year, q, event_type_id, *totals))
+    if not quarter_rows:
+        return
+    cursor.executemany(_UPSERT_QUARTER_SQL, quarter_rows)
+    cursor.executemany(_UPSERT_TYPE_SQL, type_rows)
+    # Drop rollup rows whose quarter or type no longer has any event
+    cursor.execute('DELETE FROM quarterly_summaries WHERE total_events <= 0')
+    cursor.execute('DELETE FROM quarterly_type_summaries WHERE total_events <= 0')
+
+
+def _apply_row(cursor, sql, row_id, sign):
+    cursor.execute(sql, (row_id,))
+    row = cursor.fetchone()
+    if row is None:
+        return
+    quarter, event_type_id, *totals = tuple(row)
+    apply_deltas(cursor, [(quarter, event_type_id, *(sign * t for t in totals))])
+
+
+def add_event(cursor, event_id):
+    """Count an event (and any contributions it already has) into its quarter"""
+    _apply_row(cursor, _EVENT_DELTA_SQL, event_id, 1)
+
+
+def remove_event(cursor, event_id):
+    """Take an event and its contributions out of its quarter.
+
+    Call before the event row is updated or deleted; pair it with
+    add_event() after an update so a quarter or type change moves the totals.
+    """
+    _apply_row(cursor, _EVENT_DELTA_SQL, event_id, -1)
+
+
+def add_contribution(cursor, contribution_id):
+    """Count a newly inserted contribution into its event's quarter"""
+    _apply_row(cursor, _CONTRIBUTION_DELTA_SQL, contribution_id, 1)
+
+
+def remove_contribution(cursor, contribution_id):
+    """Take a contribution out of its event's quarter; call before deleting it"""
+    _apply_row(cursor, _CONTRIBUTION_DELTA_SQL, contribution_id, -1)
+
+
+def reassign_event_type(cursor, old_type_id, new_type_id):
+    """Merge the per-type rollups of old_type_id into new_type_id (0 = no type)"""
+    cursor.execute('''
+        SELECT year, quarter, total_events, total_participants,
+               total_volunteer_hours, total_cash_donations, total_material_value
+        FROM quarterly_type_summaries WHERE event_type_id = ?
+    ''', (old_type_id,))
+    rows = [(year, q, new_type_id, *totals) for year, q, *totals in map(tuple, cursor.fetchall())]
+    cursor.execute('DELETE FROM quarterly_type_summaries WHERE event_type_id = ?', (old_type_id,))
+    cursor.executemany(_UPSERT_TYPE_SQL, rows)
+
+
+def get_quarter_totals(cursor, quarter):
+    """Return the stored summary row for a quarter, or None when it has no events"""
+    year, q = split_quarter(quarter)
+    cursor.execute('SELECT * FROM quarterly_summaries WHERE year = ? AND quarter = ?', (year, q))
+    return cursor.fetchone()
+
+
+def get_type_breakdown(cursor, quarter):
+    """Return per-event-type rows (name, count, participants, ...) for a quarter"""
+    year, q = split_quarter(quarter)
+    cursor.execute('''
+        SELECT et.name, SUM(qt.total_events) as count,
+               SUM(qt.total_participants) as participants,
+               SUM(qt.total_volunteer_hours) as total_hours,
+               SUM(qt.total_cash_donations) as total_cash,
+               SUM(qt.total_material_value) as total_material
+        FROM quarterly_type_summaries qt
+        LEFT JOIN event_types et ON qt.event_type_id = et.id
+        WHERE qt.year = ? AND qt.quarter = ?
+        GROUP BY et.name
+    ''', (year, q))
+    return cursor.fetchall()
+
+
+def _differs(a, b):
+    return any(abs((x or 0) - (y or 0)) > TOLERANCE for x, y in zip(a, b))
+
+
+def _closed_quarters(cursor):
+    # The table does not exist yet when init_db() builds the first rollups
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'closed_quarters'")
+    if cursor.fetchone() is None:
+        return []
+    cursor.execute('SELECT quarter FROM closed_quarters')
+    return [split_quarter(row[0]) for row in cursor.fetchall()]
+
+
+def rebuild_rollups(conn):
+    """Recompute every rollup from scratch, replace the stored rows and return the drift found.
+
+    Each drift entry is (table, key, stored_totals, expected_totals); an empty
+    list means the incremental rollups matched the full recompute. Runs in
+    the caller's transaction and leaves the commit to it, so wrap the call
+    in database.transaction() to make the recompute and replace atomic.
+    """
+    cursor = conn.cursor()
+    cursor.execute(_RECOMPUTE_TYPE_SQL)
+    expected_type = {}
+    expected_quarter = {}
+    for quarter, event_type_id, *totals in map(tuple, cursor.fetchall()):
+        year, q = split_quarter(quarter)
+        expected_type[(year, q, event_type_id)] = tuple(totals)
+        current = expected_quarter.get((year, q), (0,) * len(totals))
+        expected_quarter[(year, q)] = tuple(a + b for a, b in zip(current, totals))
+
+    columns = ', '.join(TOTAL_COLUMNS)
+    cursor.execute(f'SELECT year, quarter, {columns} FROM quarterly_summaries')
+    stored_quarter = {(r[0], r[1]): tuple(r[2:]) for r in cursor.fetchall()}
+    cursor.execute(f'SELECT year, quarter, event_type_id, {columns} FROM quarterly_type_summaries')
+    stored_type = {(r[0], r[1], r[2]): tuple(r[3:]) for r in cursor.fetchall()}
+
+    # Closed quarters' events are archived, so their stored rollups are kept as they are
+    for year, q in _closed_quarters(cursor):
+        if (year, q) in stored_quarter:
+            expected_quarter[(year, q)] = stored_quarter[(year, q)]
+        for key, totals in stored_type.items():
+            if key[:2] == (year, q):
+                expected_type[key] = totals
+
+    drift = []
+    for table, stored, expected in (('quarterly_summaries', stored_quarter, expected_quarter),
+                                    ('quarterly_type_summaries', stored_type, expected_type)):
+        zero = (0,) * len(TOTAL_COLUMNS)
+        for key in sorted(set(stored) | set(expected)):
+            have = stored.get(key, zero)
+            want = expected.get(key, zero)
+            if _differs(have, want):
+                drift.append((table, key, have, want))
+
+    cursor.execute('DELETE FROM quarterly_summaries')
+    cursor.execute('DELETE FROM quarterly_type_summaries')
+    cursor.executemany(f'''
+        INSERT INTO quarterly_summaries (year, quarter, {columns})
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(*key, *totals) for key, totals in expected_quarter.items()])
+    cursor.executemany(f'''
+        INSERT INTO quarterly_type_summaries (year, quarter, event_type_id, {columns})
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(*key, *totals) for key, totals in expected_type.items()])
+    return drift
+
+
+if __name__ == '__main__':
+    from database import get_db, transaction
+    conn = get_db()
+    with transaction(conn):
+        drift = rebuild_rollups(conn)
+    conn.close()
+    for table, key, have, want in drift:
+        print(f"Drift in {table} {key}: stored {have}, expected {want}")
+    print(f"Rollups rebuilt ({len(drift)} drifted rows corrected)")
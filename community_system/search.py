@@ -0,0 +1,71 @@
+"""Full-text search over the FTS5 indexes created by migration 4"""
+import re
+
+from markupsafe import Markup, escape
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+
+# snippet() wraps matches in these, swapped for <mark> after escaping
+_OPEN, _CLOSE = '\x02', '\x03'
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# One ranked query per kind of result; each returns id, title, subtitle, snippet
+QUERIES = {
+    'events': f'''
+        SELECT ep.id, ep.event_name as title, ep.event_date as subtitle,
+               snippet(events_fts, -1, '{_OPEN}', '{_CLOSE}', '…', 12) as snippet
+        FROM events_fts JOIN event_profiles ep ON ep.id = events_fts.rowid
+        WHERE events_fts MATCH ? ORDER BY rank LIMIT ?
+    ''',
+    'volunteers': f'''
+        SELECT v.id, v.name as title, COALESCE(v.email, v.phone) as subtitle,
+               snippet(volunteers_fts, -1, '{_OPEN}', '{_CLOSE}', '…', 12) as snippet
+        FROM volunteers_fts JOIN volunteers v ON v.id = volunteers_fts.rowid
+        WHERE volunteers_fts MATCH ? ORDER BY rank LIMIT ?
+    ''',
+    'organizations': f'''
+        SELECT o.id, o.name as title, o.type as subtitle,
+               snippet(organizations_fts, -1, '{_OPEN}', '{_CLOSE}', '…', 12) as snippet
+        FROM organizations_fts JOIN organizations o ON o.id = organizations_fts.rowid
+        WHERE organizations_fts MATCH ? ORDER BY rank LIMIT ?
+    ''',
+    'contributions': f'''
+        SELECT c.event_id as id, c.volunteer_name as title, ep.event_name as subtitle,
+               snippet(contributions_fts, -1, '{_OPEN}', '{_CLOSE}', '…', 12) as snippet
+        FROM contributions_fts
+        JOIN contributions c ON c.id = contributions_fts.rowid
+        JOIN event_profiles ep ON ep.id = c.event_id
+        WHERE contributions_fts MATCH ? ORDER BY rank LIMIT ?
+    ''',
+}
+
+
+def build_match(text):
+    """Turn free text into an FTS5 query: every word must match as a prefix"""
+    tokens = _TOKEN_RE.findall(text or '')
+    if not tokens:
+        return None
+    # Quoting each token keeps FTS5 operators in user input literal
+    return ' '.join('"' + token.replace('"', '""') + '"*' for token in tokens)
+
+
+def highlight(snippet):
+    """Escape a snippet and mark the matched terms"""
+    if snippet is None:
+        return ''
+    return Markup(str(escape(snippet)).replace(_OPEN, '<mark>').replace(_CLOSE, '</mark>'))
+
+
+def search(cursor, text, limit=DEFAULT_LIMIT):
+    """Return {kind: [rows]} of ranked prefix matches, at most limit per kind"""
+    match = build_match(text)
+    if match is None:
+        return {}
+    limit = max(1, min(limit, MAX_LIMIT))
+    results = {}
+    for kind, sql in QUERIES.items():
+        cursor.execute(sql, (match, limit))
+        results[kind] = [dict(row, snippet=highlight(row['snippet'])) for row in cursor.fetchall()]
+    return results
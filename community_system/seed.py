@@ -0,0 +1,184 @@
+"""Seeded synthetic data for benchmarks
+
+Builds a fresh database with the full schema and a realistic spread of
+rows: a few busy event types and many small ones, a long tail of
+volunteers (a handful contribute to most events), events spread over
+several years with busier spring and autumn quarters, and contributions
+that are mostly hours with occasional cash or material donations. About
+one contribution in ten is typed in by name with no volunteer account.
+
+The same seed always produces the same database, so benchmark results from
+different commits are comparable.
+
+Usage: python seed.py <path.db> [--size 10k|100k|1m | --contributions N] [--seed N]
+"""
+import os
+import random
+import time
+from datetime import date, timedelta
+from itertools import accumulate
+
+import database
+import rollups
+
+SIZES = {'10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+CHUNK_SIZE = 5000
+YEARS = 5
+FIRST_YEAR = 2020
+
+FIRST_NAMES = ('Alex', 'Maria', 'James', 'Wei', 'Fatima', 'John', 'Aisha', 'Carlos', 'Mei', 'David',
+               'Sofia', 'Omar', 'Linda', 'Raj', 'Grace', 'Peter', 'Hana', 'Luis', 'Emma', 'Kofi')
+LAST_NAMES = ('Smith', 'Garcia', 'Chen', 'Khan', 'Johnson', 'Nguyen', 'Brown', 'Lopez', 'Kim', 'Patel',
+              'Wilson', 'Ali', 'Martin', 'Zhang', 'Davis', 'Silva', 'Taylor', 'Wang', 'Moore', 'Okafor')
+EVENT_WORDS = ('Food Drive', 'Park Cleanup', 'Book Fair', 'Fun Run', 'Coat Collection', 'Bake Sale',
+               'Tutoring Day', 'Toy Drive', 'Garden Build', 'Blood Drive', 'Health Fair', 'Concert')
+ORG_KINDS = ('School', 'Church', 'Club', 'Association', 'Foundation', 'Center')
+MATERIALS = ('Canned food', 'Winter coats', 'Books', 'School supplies', 'Toys', 'Blankets', 'Hygiene kits')
+EXTRA_TYPES = ('Sports', 'Arts', 'Health', 'Environment', 'Youth', 'Seniors')
+
+# Relative event volume per quarter of the year
+QUARTER_WEIGHTS = (0.8, 1.2, 0.7, 1.3)
+
+
+def _zipf_weights(n, s=1.1):
+    """Cumulative weights for rng.choices(), so each draw is a bisect"""
+    return list(accumulate(1 / (i + 1) ** s for i in range(n)))
+
+
+def _name(rng):
+    return f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+
+
+def _chunks(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _insert(conn, sql, rows):
+    for chunk in _chunks(rows):
+        conn.execute('BEGIN')
+        conn.executemany(sql, chunk)
+        conn.commit()
+
+
+def generate(path, contributions, seed=42):
+    """Create a database at path holding about `contributions` contributions.
+
+    Returns a dict of row counts and the seconds taken.
+    """
+    if os.path.exists(path):
+        raise FileExistsError(f'{path} already exists')
+    start = time.perf_counter()
+    rng = random.Random(seed)
+    database.DATABASE = path
+    database.init_db()
+
+    conn = database.connect()
+    conn.isolation_level = None
+    conn.execute('PRAGMA synchronous = OFF')
+
+    n_volunteers = max(50, contributions // 20)
+    n_organizations = max(20, contributions // 500)
+    n_events = max(20, contributions // 25)
+
+    _insert(conn, 'INSERT OR IGNORE INTO event_types (name, description) VALUES (?, ?)',
+            ((name, f'{name} activities') for name in EXTRA_TYPES))
+    type_ids = [row[0] for row in conn.execute('SELECT id FROM event_types ORDER BY id')]
+    type_weights = _zipf_weights(len(type_ids), 0.8)
+
+    def organizations():
+        for i in range(n_organizations):
+            kind = rng.choice(ORG_KINDS)
+            yield (f'{rng.choice(LAST_NAMES)} {kind} {i}', kind, rng.choice(('Small', 'Medium', 'Large')),
+                   _name(rng), f'555-{rng.randrange(10000):04d}', f'org{i}@example.org')
+    _insert(conn, '''
+        INSERT INTO organizations (name, type, size, contact_name, contact_phone, contact_email)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', organizations())
+    org_ids = [row[0] for row in conn.execute('SELECT id FROM organizations ORDER BY id')]
+
+    def volunteers():
+        for i in range(n_volunteers):
+            name = _name(rng)
+            yield (name, f'555-{rng.randrange(10_000_000):07d}' if rng.random() < 0.7 else None,
+                   f"{name.lower().replace(' ', '.')}{i}@example.com" if rng.random() < 0.6 else None,
+                   None, None)
+    _insert(conn, 'INSERT INTO volunteers (name, phone, email, address, notes) VALUES (?, ?, ?, ?, ?)',
+            volunteers())
+    volunteer_rows = conn.execute('SELECT id, name, phone FROM volunteers ORDER BY id').fetchall()
+    volunteer_weights = _zipf_weights(len(volunteer_rows))
+
+    quarter_slots = [(FIRST_YEAR + y, q) for y in range(YEARS) for q in range(1, 5)]
+    slot_weights = list(accumulate(QUARTER_WEIGHTS[q - 1] * (1 + 0.1 * (year - FIRST_YEAR))
+                                   for year, q in quarter_slots))
+
+    def events():
+        for i in range(n_events):
+            year, q = rng.choices(quarter_slots, cum_weights=slot_weights)[0]
+            day = date(year, 3 * q - 2, 1) + timedelta(days=rng.randrange(90))
+            expected = int(rng.lognormvariate(3.5, 0.8))
+            yield (f'{rng.choice(EVENT_WORDS)} #{i}', day.isoformat(),
+                   rng.choices(type_ids, cum_weights=type_weights)[0],
+                   f'{rng.randrange(1, 999)} Main St', None,
+                   rng.choice(org_ids) if rng.random() < 0.7 else None,
+                   _name(rng), None, None, expected, max(0, int(expected * rng.uniform(0.6, 1.2))),
+                   rng.choice(('Completed', 'Completed', 'Completed', 'In Progress', 'Planned')),
+                   f'{year}Q{q}')
+    _insert(conn, '''
+        INSERT INTO event_profiles (event_name, event_date, event_type_id, location, description,
+            organization_id, coordinator_name, coordinator_phone, coordinator_email,
+            expected_participants, actual_participants, status, quarter)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', events())
+    event_ids = [row[0] for row in conn.execute('SELECT id FROM event_profiles ORDER BY id')]
+
+    def contribution_rows():
+        # Events get a lognormal share of the contributions
+        weights = list(accumulate(rng.lognormvariate(0, 1) for _ in event_ids))
+        for _ in range(contributions):
+            event_id = rng.choices(event_ids, cum_weights=weights)[0]
+            if rng.random() < 0.9:
+                vol_id, name, phone = rng.choices(volunteer_rows, cum_weights=volunteer_weights)[0]
+            else:
+                vol_id, name, phone = None, _name(rng), None
+            cash = round(rng.lognormvariate(3, 1), 2) if rng.random() < 0.25 else 0
+            material = rng.random() < 0.15
+            yield (event_id, vol_id, name, phone, round(rng.lognormvariate(1, 0.6), 1), cash,
+                   rng.choice(MATERIALS) if material else None,
+                   round(rng.lognormvariate(3.5, 1), 2) if material else 0)
+    _insert(conn, '''
+        INSERT INTO contributions (event_id, volunteer_id, volunteer_name, volunteer_contact,
+                                   volunteer_hours, cash_donation, material_description, material_value)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', contribution_rows())
+
+    conn.isolation_level = ''
+    rollups.rebuild_rollups(conn)
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    conn.close()
+    return {
+        'event_types': len(type_ids), 'organizations': n_organizations, 'volunteers': n_volunteers,
+        'events': n_events, 'contributions': contributions,
+        'seconds': round(time.perf_counter() - start, 2),
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Generate a synthetic benchmark database')
+    parser.add_argument('path')
+    parser.add_argument('--size', choices=SIZES, default='10k')
+    parser.add_argument('--contributions', type=int, help='overrides --size')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+    counts = generate(args.path, args.contributions or SIZES[args.size], args.seed)
+    print(', '.join(f'{key}: {value}' for key, value in counts.items()))
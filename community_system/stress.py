@@ -0,0 +1,140 @@
+"""Concurrent contribution-insert stress test
+
+Several processes (standing in for gunicorn workers), each with several
+threads, insert contributions into a scratch copy of a database as fast as
+they can. Each write mode is run in turn and reported with its throughput,
+latency percentiles and lock errors:
+
+    legacy     implicit deferred transactions with no busy timeout,
+               the way the routes used to write
+    immediate  database.transaction(): BEGIN IMMEDIATE, busy timeout and
+               bounded retry with backoff
+    group      contribution_writes group commit: one transaction per batch
+               of concurrent inserts in each process
+
+Usage: python stress.py <seeded.db> [--processes 4] [--threads 8] [--inserts 200] [--out stress.json]
+"""
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+
+import contribution_writes
+import database
+import rollups
+
+MODES = ('legacy', 'immediate', 'group')
+
+
+def _legacy_insert(conn, params):
+    conn.execute(contribution_writes.INSERT_SQL, params)
+    rollups.add_contribution(conn.cursor(), conn.execute('SELECT last_insert_rowid()').fetchone()[0])
+    conn.commit()
+
+
+def _worker(path, mode, threads, inserts, event_ids, results):
+    database.DATABASE = path
+    latencies, errors, lock = [], [], threading.Lock()
+
+    def run(thread_number):
+        conn = None
+        if mode == 'legacy':
+            conn = sqlite3.connect(path, timeout=0, check_same_thread=False)
+            conn.row_factory = sqlite3.Row
+        elif mode == 'immediate':
+            conn = database.connect()
+        local, failed = [], 0
+        for i in range(inserts):
+            params = (event_ids[(thread_number + i) % len(event_ids)], None, 'Stress', None, 1, 0, None, 0)
+            start = time.perf_counter()
+            try:
+                if mode == 'legacy':
+                    _legacy_insert(conn, params)
+                elif mode == 'immediate':
+                    contribution_writes.add(conn, params)
+                else:
+                    contribution_writes.committer.submit(params)
+                local.append(time.perf_counter() - start)
+            except sqlite3.OperationalError as e:
+                if not database.is_busy(e):
+                    raise
+                failed += 1
+                if conn is not None and conn.in_transaction:
+                    conn.rollback()
+        with lock:
+            latencies.extend(local)
+            errors.append(failed)
+        if conn is not None:
+            conn.close()
+
+    pool = [threading.Thread(target=run, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    results.put((latencies, sum(errors)))
+
+
+def run_mode(source, mode, processes, threads, inserts):
+    """Stress one write mode on a fresh copy of source and return its figures"""
+    with tempfile.TemporaryDirectory() as scratch:
+        path = os.path.join(scratch, 'stress.db')
+        shutil.copy(source, path)
+        conn = sqlite3.connect(path)
+        event_ids = [r[0] for r in conn.execute('SELECT id FROM event_profiles ORDER BY id LIMIT 500')]
+        before = conn.execute('SELECT COUNT(*) FROM contributions').fetchone()[0]
+        conn.close()
+
+        results = multiprocessing.Queue()
+        start = time.perf_counter()
+        workers = [multiprocessing.Process(target=_worker, args=(path, mode, threads, inserts, event_ids, results))
+                   for _ in range(processes)]
+        for w in workers:
+            w.start()
+        outcomes = [results.get() for _ in workers]
+        for w in workers:
+            w.join()
+        seconds = time.perf_counter() - start
+
+        conn = sqlite3.connect(path)
+        written = conn.execute('SELECT COUNT(*) FROM contributions').fetchone()[0] - before
+        conn.close()
+
+    latencies = sorted(l for lat, _ in outcomes for l in lat)
+    pick = lambda q: round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 2) if latencies else None
+    return {
+        'attempted': processes * threads * inserts,
+        'committed': written,
+        'lock_errors': sum(e for _, e in outcomes),
+        'seconds': round(seconds, 2),
+        'inserts_per_sec': round(written / seconds, 1),
+        'p50_ms': pick(0.5),
+        'p95_ms': pick(0.95),
+        'p99_ms': pick(0.99),
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Concurrent contribution insert stress test')
+    parser.add_argument('database')
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--inserts', type=int, default=200, help='inserts per thread')
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--out')
+    args = parser.parse_args()
+
+    report = {}
+    for mode in args.modes.split(','):
+        report[mode] = run_mode(args.database, mode, args.processes, args.threads, args.inserts)
+        r = report[mode]
+        print(f"{mode:10} {r['inserts_per_sec']:>9} inserts/s  committed {r['committed']}/{r['attempted']}"
+              f"  lock errors {r['lock_errors']}  p50 {r['p50_ms']} ms  p99 {r['p99_ms']} ms")
+    if args.out:
+        with open(args.out, 'w') as f:
+            json.dump(report, f, indent=2)
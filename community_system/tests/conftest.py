@@ -0,0 +1,54 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'slow: long-running stress tests (deselect with -m "not slow")')
+
+
+def _reset_state():
+    """Forget everything the process cached about the previous database"""
+    import analytics
+    import app as app_module
+    import database
+    import pagecache
+    import readpool
+    import refdata
+    import volunteer_index
+
+    database._schema_ready = False
+    while not database.pool._idle.empty():
+        database.pool._idle.get_nowait().close()
+    database.pool._reset()
+    readpool.pool._pid = None
+    analytics._cache.clear()
+    app_module.dashboard_cache.clear()
+    pagecache.cache.clear()
+    refdata.reference.invalidate()
+    volunteer_index.index.version = None
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """A fresh, migrated database that the app and its modules point at"""
+    import database
+
+    path = str(tmp_path / 'community.db')
+    monkeypatch.setattr(database, 'DATABASE', path)
+    _reset_state()
+    database.ensure_schema()
+    yield path
+    _reset_state()
+
+
+@pytest.fixture
+def client(db_path):
+    import app as app_module
+
+    app_module.app.config['TESTING'] = True
+    with app_module.app.test_client() as client:
+        yield client
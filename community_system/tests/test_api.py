@@ -0,0 +1,46 @@
+import queries
+
+
+def _counting(monkeypatch, name):
+    calls = []
+    original = getattr(queries, name)
+
+    def counted(*args, **kwargs):
+        calls.append(args)
+        return original(*args, **kwargs)
+
+    monkeypatch.setattr(queries, name, counted)
+    return calls
+
+
+def test_etag_revalidation_skips_queries(client, monkeypatch):
+    client.post('/events/add', data={'event_name': 'Fair', 'event_date': '2024-02-01'})
+    calls = _counting(monkeypatch, 'get_event')
+
+    first = client.get('/api/v1/events/1')
+    assert first.status_code == 200 and len(calls) == 1
+    tag = first.headers['ETag']
+    assert first.headers['Cache-Control'] == 'no-cache'
+
+    again = client.get('/api/v1/events/1', headers={'If-None-Match': tag})
+    assert again.status_code == 304
+    assert again.data == b'' and again.headers['ETag'] == tag
+    assert len(calls) == 1
+
+    # A write to a table the resource depends on changes the tag
+    client.post('/events/1/contributions/add', data={'volunteer_name': 'Ann', 'volunteer_hours': '2'})
+    changed = client.get('/api/v1/events/1', headers={'If-None-Match': tag})
+    assert changed.status_code == 200 and len(calls) == 2
+    assert changed.headers['ETag'] != tag
+    assert changed.get_json()['summary']['total_hours'] == 2
+
+
+def test_unrelated_write_keeps_etag(client, monkeypatch):
+    calls = _counting(monkeypatch, 'dashboard')
+    tag = client.get('/api/v1/dashboard').headers['ETag']
+    client.post('/organizations/add', data={'name': 'Org'})
+    assert client.get('/api/v1/dashboard', headers={'If-None-Match': tag}).status_code == 304
+    client.post('/events/add', data={'event_name': 'Fair', 'event_date': '2024-02-01'})
+    response = client.get('/api/v1/dashboard', headers={'If-None-Match': tag})
+    assert response.status_code == 200 and response.headers['ETag'] != tag
+    assert len(calls) == 2
@@ -0,0 +1,69 @@
+import pytest
+
+import archive
+import database
+import exports
+import totals
+
+YEARS = range(2010, 2022)
+
+
+def _flashes(client):
+    with client.session_transaction() as session:
+        return session.pop('_flashes', [])
+
+
+@pytest.fixture
+def archived(client):
+    """One event with one contribution in each of twelve years, every year archived"""
+    client.post('/volunteers/add', data={'name': 'Ann'})
+    ids = {}
+    for year in YEARS:
+        response = client.post('/events/add', data={'event_name': f'Fair {year}', 'event_date': f'{year}-02-01'})
+        ids[year] = int(response.headers['Location'].split('/')[-2])
+        client.post(f'/events/{ids[year]}/contributions/add',
+                    data={'volunteer_id': '1', 'volunteer_name': '', 'volunteer_hours': '2'})
+    _flashes(client)
+    conn = database.connect()
+    for year in YEARS:
+        archive.close_quarter(conn, f'{year}Q1')
+    yield conn, ids
+    conn.close()
+
+
+def test_more_archived_years_than_attachments(client, archived):
+    conn, ids = archived
+    assert len(YEARS) > archive.attach_limit(conn.cursor())
+    for year, event_id in ids.items():
+        page = client.get(f'/events/{event_id}')
+        assert f'Fair {year}'.encode() in page.data
+    volunteer = client.get('/volunteers/1').data
+    assert all(f'Fair {year}'.encode() in volunteer for year in YEARS)
+
+    cursor = conn.cursor()
+    assert exports.count_ledger(cursor) == len(YEARS)
+    ledger = list(exports.iter_ledger(cursor))
+    assert [row['event_name'] for row in ledger] == [f'Fair {year}' for year in YEARS]
+    assert totals.check_totals(conn) == []
+    with pytest.raises(archive.TooManyArchives):
+        archive.partitions(cursor, '2010Q1', '2021Q4')
+
+
+def test_archived_events_are_read_only(client, archived):
+    conn, ids = archived
+    event_id = ids[2015]
+    read_only = [('error', 'This event belongs to a closed quarter and is read-only')]
+
+    response = client.post(f'/events/{event_id}/delete')
+    assert response.headers['Location'].endswith(f'/events/{event_id}')
+    assert _flashes(client) == read_only
+    assert b'Fair 2015' in client.get(f'/events/{event_id}').data
+
+    response = client.post(f'/events/{event_id}/contributions/add', data={'volunteer_name': 'Bob'})
+    assert response.status_code == 302
+    assert _flashes(client) == read_only
+
+    response = client.post(f'/events/{event_id}/edit', data={'event_name': 'Moved', 'event_date': '2026-01-05'})
+    assert _flashes(client) == read_only
+    assert conn.execute('SELECT COUNT(*) FROM contributions').fetchone()[0] == 0
+    assert conn.execute('SELECT COUNT(*) FROM event_profiles').fetchone()[0] == 0
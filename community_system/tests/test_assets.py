@@ -0,0 +1,67 @@
+import logging
+import os
+
+import pytest
+
+import assets
+
+
+@pytest.fixture
+def dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(assets, 'VENDOR_DIR', str(tmp_path / 'vendor'))
+    monkeypatch.setattr(assets, 'DIST_DIR', str(tmp_path / 'dist'))
+    monkeypatch.setattr(assets, 'MANIFEST', str(tmp_path / 'dist' / 'manifest.json'))
+    monkeypatch.setattr(assets, '_manifest', {})
+    monkeypatch.setattr(assets, 'CDN_FALLBACK', False)
+    return tmp_path
+
+
+@pytest.fixture
+def vendored(dirs):
+    """Stand-ins for the vendored files, with the font reference the real CSS has"""
+    for name in assets.ASSETS:
+        data = b'url("./fonts/bootstrap-icons.woff2?1fa40e8900654d2863d011707b9fb6f2")' if name.endswith('.css') else b'x'
+        assets._write(os.path.join(assets.VENDOR_DIR, name), data + name.encode() * 100)
+    return assets.load_manifest()
+
+
+def test_missing_vendored_files(dirs, monkeypatch, caplog):
+    with pytest.raises(RuntimeError, match='bootstrap.min.css'):
+        assets.build()
+    # The app still starts, on the CDN, and says so
+    with caplog.at_level(logging.ERROR, logger='community.assets'):
+        assert assets.load_manifest() == {}
+    assert 'bootstrap.min.css' in caplog.text
+    assert assets.asset_url('bootstrap.min.css') == assets.ASSETS['bootstrap.min.css']
+
+    caplog.clear()
+    monkeypatch.setattr(assets, 'CDN_FALLBACK', True)
+    assert assets.load_manifest() == {}
+    assert caplog.text == ''
+
+
+def test_build_fingerprints_and_rewrites_fonts(vendored):
+    assert set(vendored) == set(assets.ASSETS)
+    font = vendored['fonts/bootstrap-icons.woff2']
+    with open(os.path.join(assets.DIST_DIR, vendored['bootstrap-icons.css']), 'rb') as f:
+        assert f'url("{font}")'.encode() in f.read()
+    assert os.path.exists(os.path.join(assets.DIST_DIR, vendored['bootstrap.min.css'] + '.gz'))
+
+
+def test_pages_link_fingerprinted_assets(client, vendored):
+    target = vendored['bootstrap.min.css']
+    assert target != 'bootstrap.min.css'
+    url = f'/assets/{target}'
+    assert f'href="{url}"'.encode() in client.get('/').data
+
+    response = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == f'public, max-age={assets.MAX_AGE}, immutable'
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    with open(os.path.join(assets.DIST_DIR, target + '.gz'), 'rb') as f:
+        assert response.data == f.read()
+
+    plain = client.get(url, headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in plain.headers
+    assert client.get('/assets/bootstrap.min.css').status_code == 404
@@ -0,0 +1,81 @@
+import os
+
+import pytest
+
+import archive
+import backup
+import database
+
+
+def _state(conn):
+    return ([tuple(r) for r in conn.execute('SELECT id, event_name, event_date, total_hours FROM event_profiles ORDER BY id')],
+            [tuple(r) for r in conn.execute('SELECT id, event_id, volunteer_name, volunteer_hours FROM contributions ORDER BY id')],
+            [tuple(r) for r in conn.execute('SELECT quarter FROM closed_quarters')])
+
+
+def _post(client, url, data=None):
+    client.post(url, data=data or {})
+    with client.session_transaction() as session:
+        session.pop('_flashes', None)
+
+
+@pytest.fixture
+def backups(tmp_path, monkeypatch):
+    directory = str(tmp_path / 'backups')
+    monkeypatch.setenv('COMMUNITY_BACKUP_DIR', directory)
+    return directory
+
+
+def test_backup_verify_rotate_restore(client, backups):
+    conn = database.connect()
+    _post(client, '/events/add', {'event_name': 'Old fair', 'event_date': '2020-02-01'})
+    _post(client, '/events/1/contributions/add', {'volunteer_name': 'Ann', 'volunteer_hours': '2'})
+    archive.close_quarter(conn, '2020Q1')
+    _post(client, '/events/add', {'event_name': 'Spring fair', 'event_date': '2024-02-01'})
+    _post(client, '/events/2/contributions/add', {'volunteer_name': 'Bo', 'volunteer_hours': '3'})
+
+    first = backup.create_backup(keep=5)
+    assert first['integrity'] == 'ok' and len(first['files']) == 2
+    _post(client, '/events/2/edit', {'event_name': 'Summer fair', 'event_date': '2024-02-01'})
+    saved = _state(conn)
+    second = backup.create_backup(keep=5)
+    third = backup.create_backup(keep=2)
+
+    # Rotation keeps the newest two
+    paths = backup.snapshots()
+    assert [os.path.basename(p) for p in paths] == [second['name'], third['name']]
+    for path in paths:
+        assert backup.verify(path) == {}
+        assert set(os.listdir(path)) == set(backup.read_manifest(path)['files']) | {'manifest.json'}
+
+    # Later changes, then a restore of the second snapshot
+    _post(client, '/events/add', {'event_name': 'Autumn fair', 'event_date': '2024-10-01'})
+    _post(client, '/contributions/2/delete')
+    assert b'Summer fair' in client.get('/events/2').data
+    _post(client, '/events/2/edit', {'event_name': 'Renamed', 'event_date': '2024-02-01'})
+    cached = client.get('/events/2').data
+    assert b'Renamed' in cached
+    assert _state(conn) != saved
+
+    backup.restore(paths[0])
+    assert _state(conn) == saved
+    # The pre-restore state was backed up first
+    assert len(backup.snapshots()) == 3
+    # No stale cached page survives the restore; the archive came back too
+    assert b'Summer fair' in client.get('/events/2').data
+    assert b'Old fair' in client.get('/events/1').data
+    conn.close()
+
+
+def test_restore_rejects_a_damaged_snapshot(client, backups):
+    _post(client, '/events/add', {'event_name': 'Fair', 'event_date': '2024-02-01'})
+    manifest = backup.create_backup()
+    snapshot = backup.snapshots()[0]
+    path = os.path.join(snapshot, backup.MAIN_FILE)
+    with open(path, 'r+b') as f:
+        f.seek(os.path.getsize(path) // 2)
+        f.write(b'\xff' * 4096)
+    assert backup.MAIN_FILE in backup.verify(snapshot)
+    with pytest.raises(ValueError, match='failed verification'):
+        backup.restore(snapshot)
+    assert manifest['name'] == os.path.basename(snapshot)
@@ -0,0 +1,48 @@
+import threading
+
+from cache import TTLCache
+
+
+def test_compute_locks_are_released():
+    cache = TTLCache(ttl=60)
+    for n in range(1000):
+        assert cache.get_or_compute(n, lambda: n * 2) == n * 2
+    assert cache._compute_locks == {}
+
+
+def test_compute_lock_dropped_when_compute_raises():
+    cache = TTLCache(ttl=60)
+
+    def fail():
+        raise ValueError('boom')
+
+    try:
+        cache.get_or_compute('key', fail)
+    except ValueError:
+        pass
+    assert cache._compute_locks == {}
+    assert cache.get_or_compute('key', lambda: 1) == 1
+
+
+def test_concurrent_callers_share_one_compute():
+    cache = TTLCache(ttl=60)
+    started, release, calls = threading.Event(), threading.Event(), []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'value'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get_or_compute('key', slow)))
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    started.wait(5)
+    release.set()
+    for t in threads:
+        t.join()
+    assert results == ['value'] * 8
+    assert len(calls) == 1
+    assert cache._compute_locks == {}
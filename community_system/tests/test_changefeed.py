@@ -0,0 +1,15 @@
+import changefeed
+
+
+def test_limit_keeps_reserve_for_requests(monkeypatch):
+    monkeypatch.delenv('STREAM_MAX_SUBSCRIBERS', raising=False)
+    assert changefeed.subscriber_limit(8) == 8 - changefeed.RESERVED_THREADS
+    assert changefeed.subscriber_limit(changefeed.RESERVED_THREADS) == 0
+    assert changefeed.subscriber_limit(1) == 0
+
+
+def test_stream_refused_when_worker_full(client, monkeypatch):
+    monkeypatch.setattr(changefeed.bus, 'max_subscribers', 0)
+    response = client.get('/stream')
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '5'
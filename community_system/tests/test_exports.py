@@ -0,0 +1,70 @@
+import tracemalloc
+
+import pytest
+
+import archive
+import database
+import exports
+
+ROWS_PER_YEAR = 40000
+# Below the size of even the CSV export; one fetch batch and one 64 KB chunk
+# take a fraction of it, while holding the ledger would take several times it
+PEAK_BYTES = 3 * 1024 * 1024
+
+
+@pytest.fixture
+def ledger(db_path):
+    """80,000 contributions: one year archived, one hot"""
+    conn = database.connect()
+    with database.transaction(conn):
+        conn.executemany('INSERT INTO event_profiles (event_name, event_date, quarter) VALUES (?, ?, ?)',
+                         [(f'Event {n}', f'{year}-03-{n % 28 + 1:02d}', f'{year}Q1')
+                          for year in (2020, 2024) for n in range(400)])
+        conn.execute('''
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < ?)
+            INSERT INTO contributions (event_id, volunteer_name, volunteer_contact, volunteer_hours,
+                                       cash_donation, material_description)
+            SELECT ep.id, 'Volunteer ' || n.i, 'volunteer' || n.i || '@example.org', 1.5, 20,
+                   'boxes of donated winter clothing'
+            FROM event_profiles ep JOIN n ON n.i <= ? / 400
+        ''', (ROWS_PER_YEAR, ROWS_PER_YEAR))
+    archive.close_quarter(conn, '2020Q1')
+    yield conn
+    conn.close()
+
+
+def _peak(request):
+    """(bytes produced, peak traced allocation) for request() and consuming
+    the chunks it returns; tracing starts first because a streamed response
+    already produces its first chunk when it is returned"""
+    size = 0
+    tracemalloc.start()
+    try:
+        for chunk in request():
+            size += len(chunk)
+        return size, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+@pytest.mark.parametrize('fmt', exports.FORMATS)
+def test_export_memory_is_bounded(ledger, fmt):
+    cursor = ledger.cursor()
+    assert exports.count_ledger(cursor) == 2 * ROWS_PER_YEAR
+    size, peak = _peak(lambda: exports.stream_ledger(cursor, fmt))
+    assert size > PEAK_BYTES
+    assert peak < PEAK_BYTES, f'{fmt} export of {size} bytes peaked at {peak} bytes'
+
+
+def test_export_route_streams(client, ledger):
+    responses = []
+
+    def request():
+        responses.append(client.get('/exports/contributions.csv', buffered=False))
+        return responses[0].iter_encoded()
+
+    size, peak = _peak(request)
+    responses[0].close()
+    assert responses[0].status_code == 200
+    assert size > PEAK_BYTES
+    assert peak < PEAK_BYTES, f'export of {size} bytes peaked at {peak} bytes'
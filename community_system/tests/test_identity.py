@@ -0,0 +1,93 @@
+import pytest
+
+import database
+import identity
+
+
+@pytest.fixture
+def conn(client):
+    conn = database.connect()
+    with database.transaction(conn):
+        conn.executemany('INSERT INTO volunteers (name, email, phone) VALUES (?, ?, ?)', [
+            ('Ann Lee', 'ann@example.org', None),
+            ('Carol Jones', None, None),
+            ('Dave Smith', None, '555-123-4567'),
+        ] + [(f'Helper {n}', f'helper{n}@example.org', None) for n in range(100)])
+        conn.execute("INSERT INTO event_profiles (event_name, event_date, quarter) VALUES ('Fair', '2024-02-01', '2024Q1')")
+    yield conn
+    conn.close()
+
+
+def _orphan(conn, name, contact=None):
+    with database.transaction(conn):
+        cursor = conn.execute('INSERT INTO contributions (event_id, volunteer_name, volunteer_contact, volunteer_hours) '
+                              'VALUES (1, ?, ?, 2)', (name, contact))
+    return cursor.lastrowid
+
+
+def _volunteer_id(conn, name):
+    return conn.execute('SELECT id FROM volunteers WHERE name = ?', (name,)).fetchone()[0]
+
+
+def _linked_to(conn, contribution_id):
+    return conn.execute('SELECT volunteer_id FROM contributions WHERE id = ?', (contribution_id,)).fetchone()[0]
+
+
+def _status(conn, contribution_id):
+    row = conn.execute('SELECT status FROM identity_matches WHERE contribution_id = ?', (contribution_id,)).fetchone()
+    return row and row[0]
+
+
+def test_resolve_links_queues_and_skips(conn):
+    exact = _orphan(conn, 'Lee, Ann', 'ANN@example.org')
+    close = _orphan(conn, 'Carole Jones')
+    stranger = _orphan(conn, 'Zed Quux')
+
+    result = identity.resolve(conn)
+    assert (result['linked'], result['pending'], result['unmatched']) == (1, 1, 1)
+    # Blocking: the hundred helpers share no key with these names, so they are never scored
+    assert result['comparisons'] <= 3
+
+    assert _linked_to(conn, exact) == _volunteer_id(conn, 'Ann Lee')
+    assert _status(conn, exact) == 'linked'
+    # Close, but below AUTO_LINK: proposed for review, not linked
+    assert _linked_to(conn, close) is None
+    pending = identity.matches(conn.cursor())
+    assert [(m['contribution_id'], m['candidate_name']) for m in pending] == [(close, 'Carol Jones')]
+    assert identity.REVIEW <= pending[0]['score'] < identity.AUTO_LINK
+    assert _linked_to(conn, stranger) is None and _status(conn, stranger) is None
+    assert conn.execute('SELECT COUNT(*) FROM identity_queue').fetchone()[0] == 0
+
+
+def test_review_accept_and_reject(client, conn):
+    accepted = _orphan(conn, 'Carole Jones')
+    rejected = _orphan(conn, 'Dave Smithe', '4567')
+    identity.resolve(conn)
+    carol, dave = _volunteer_id(conn, 'Carol Jones'), _volunteer_id(conn, 'Dave Smith')
+    assert _status(conn, accepted) == _status(conn, rejected) == 'pending'
+
+    client.post(f'/volunteers/matches/{accepted}/{carol}', data={'action': 'accept'})
+    assert _linked_to(conn, accepted) == carol
+    assert _status(conn, accepted) == 'accepted'
+    assert conn.execute('SELECT total_hours FROM volunteers WHERE id = ?', (carol,)).fetchone()[0] == 2
+
+    client.post(f'/volunteers/matches/{rejected}/{dave}', data={'action': 'reject'})
+    assert _linked_to(conn, rejected) is None
+    assert _status(conn, rejected) == 'rejected'
+    # A rejected pair is not proposed again, even by a full run
+    identity.resolve(conn, full=True)
+    assert _status(conn, rejected) == 'rejected'
+    assert identity.matches(conn.cursor()) == []
+
+
+def test_rejecting_an_automatic_link_undoes_it(conn):
+    contribution = _orphan(conn, 'Ann Lee', 'ann@example.org')
+    identity.resolve(conn)
+    ann = _volunteer_id(conn, 'Ann Lee')
+    assert _linked_to(conn, contribution) == ann
+
+    identity.reject(conn, contribution, ann)
+    assert _linked_to(conn, contribution) is None
+    assert _status(conn, contribution) == 'rejected'
+    assert identity.resolve(conn)['linked'] == 0
+    assert _linked_to(conn, contribution) is None
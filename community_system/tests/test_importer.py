@@ -0,0 +1,68 @@
+import io
+import json
+import os
+
+import database
+import importer
+import jobs
+
+
+def _import(kind, text):
+    conn = database.connect()
+    try:
+        return importer.import_file(conn, kind, io.StringIO(text), 'csv')
+    finally:
+        conn.close()
+
+
+def test_duplicate_volunteer_name_is_ambiguous(db_path):
+    _import('volunteers', 'name\nAnn Lee\nAnn Lee\nBo Chen\n')
+    _import('events', 'event_name,event_date\nFair,2024-02-01\n')
+    report = _import('contributions', 'event_id,volunteer,volunteer_hours\n1,ann lee,2\n1,Bo Chen,3\n1,Cy,1\n')
+    assert report['inserted'] == 1
+    assert report['errors'] == [
+        (2, "Ambiguous volunteer: several are named 'ann lee'; give volunteer_id instead"),
+        (4, "Unknown volunteer: 'Cy'"),
+    ]
+    # An explicit id still works for either namesake
+    assert _import('contributions', 'event_id,volunteer_id,volunteer_hours\n1,2,2\n')['inserted'] == 1
+
+
+def test_duplicate_event_name_and_date_is_ambiguous(db_path):
+    _import('events', 'event_name,event_date\nFair,2024-02-01\nFair,2024-02-01\n')
+    report = _import('contributions', 'event_name,event_date,volunteer_name\nFair,2024-02-01,Ann\n')
+    assert report['inserted'] == 0
+    assert report['errors'][0][1].startswith('Ambiguous event')
+
+
+def test_lookups_load_only_what_the_kind_needs(db_path):
+    conn = database.connect()
+    lookups = importer.Lookups(conn.cursor(), importer.KINDS['volunteers'][2])
+    assert not hasattr(lookups, 'events') and not hasattr(lookups, 'volunteers')
+    lookups = importer.Lookups(conn.cursor(), importer.KINDS['events'][2])
+    assert hasattr(lookups, 'event_types') and not hasattr(lookups, 'events')
+    conn.close()
+
+
+def test_upload_is_imported_by_a_job_while_a_worker_runs(client, monkeypatch):
+    monkeypatch.setattr(jobs, 'workers_alive', lambda cursor: True)
+    response = client.post('/import', data={'kind': 'volunteers',
+                                            'file': (io.BytesIO(b'name\nAnn Lee\nBo Chen\n'), 'people.csv')})
+    assert response.status_code == 302 and '/jobs/' in response.headers['Location']
+    job_id = int(response.headers['Location'].rstrip('/').split('/')[-1])
+    conn = database.connect()
+    params = json.loads(jobs.get(conn.cursor(), job_id)['params'])
+    assert os.path.exists(params['path'])
+    assert conn.execute('SELECT COUNT(*) FROM volunteers').fetchone()[0] == 0
+
+    assert jobs.run_pending() >= 1
+    assert conn.execute('SELECT COUNT(*) FROM volunteers').fetchone()[0] == 2
+    assert not os.path.exists(params['path'])
+    assert b'<strong>2</strong> of 2 volunteers imported' in client.get(f'/jobs/{job_id}/result').data
+    conn.close()
+
+
+def test_upload_is_imported_inline_without_a_worker(client):
+    response = client.post('/import', data={'kind': 'volunteers', 'file': (io.BytesIO(b'name\nAnn Lee\n'), 'a.csv')},
+                           headers={'Accept': 'application/json'})
+    assert response.status_code == 200 and response.get_json()['inserted'] == 1
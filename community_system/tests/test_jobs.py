@@ -0,0 +1,77 @@
+import sqlite3
+import threading
+import time
+
+import database
+import jobs
+
+
+def _wait_for(conn, job_id, timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = jobs.get(conn.cursor(), job_id)
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f'job {job_id} still {job["status"]}')
+
+
+def test_worker_survives_claim_errors(db_path, monkeypatch):
+    monkeypatch.setitem(jobs.HANDLERS, 'echo', (lambda ctx, value: value, 0, 1))
+    monkeypatch.setattr(jobs, 'ERROR_BACKOFF', 0.01)
+    monkeypatch.setattr(jobs, 'POLL_INTERVAL', 0.01)
+    real_claim, failures = jobs.claim, []
+
+    def flaky_claim(conn, worker, now=None):
+        if len(failures) < 3:
+            failures.append(worker)
+            raise sqlite3.OperationalError('database is locked')
+        return real_claim(conn, worker, now)
+
+    monkeypatch.setattr(jobs, 'claim', flaky_claim)
+    conn = database.connect()
+    job = jobs.submit(conn, 'echo', {'value': 42})
+    worker = jobs.Worker(threads=1, recurring=False).start()
+    try:
+        finished = _wait_for(conn, job['id'])
+    finally:
+        worker.stop(timeout=5)
+        conn.close()
+    assert len(failures) == 3
+    assert finished['status'] == 'done'
+    assert finished['result'] == '42'
+
+
+def test_unserializable_result_fails_the_job(db_path, monkeypatch):
+    monkeypatch.setitem(jobs.HANDLERS, 'bad_result', (lambda ctx: object(), 0, 1))
+    conn = database.connect()
+    job = jobs.submit(conn, 'bad_result')
+    assert jobs.run_pending() == 1
+    failed = jobs.get(conn.cursor(), job['id'])
+    conn.close()
+    assert failed['status'] == 'failed'
+    assert 'TypeError' in failed['error']
+
+
+def test_debounced_submissions_share_one_job(db_path, monkeypatch):
+    monkeypatch.setitem(jobs.HANDLERS, 'echo', (lambda ctx, value: value, 0, 1))
+    results = []
+
+    def submit_many():
+        conn = database.connect()
+        try:
+            for _ in range(20):
+                results.append(jobs.submit(conn, 'echo', {'value': 1}, debounce=3600)['id'])
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=submit_many) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    conn = database.connect()
+    count = conn.execute("SELECT COUNT(*) FROM jobs WHERE kind = 'echo'").fetchone()[0]
+    conn.close()
+    assert count == 1
+    assert len(results) == 160 and len(set(results)) == 1
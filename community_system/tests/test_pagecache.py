@@ -0,0 +1,54 @@
+import database
+import pagecache
+
+
+def _post(client, url, data=None):
+    client.post(url, data=data or {})
+    # Pending flashes bypass the cache; drop them like a page view would
+    with client.session_transaction() as session:
+        session.pop('_flashes', None)
+
+
+def _event_key(event_id):
+    conn = database.connect()
+    try:
+        return pagecache.page_key(conn.cursor(), 'view_event', event_id, ('event', event_id),
+                                  ('event_types', 'organizations'))
+    finally:
+        conn.close()
+
+
+def _hits():
+    return pagecache.cache.stats()['hits']
+
+
+def test_writes_change_the_page_key(client):
+    _post(client, '/volunteers/add', {'name': 'Ann'})
+    _post(client, '/events/add', {'event_name': 'Spring fair', 'event_date': '2024-02-01'})
+    _post(client, '/events/1/contributions/add', {'volunteer_id': '1', 'volunteer_name': '', 'volunteer_hours': '2'})
+
+    first = client.get('/events/1').data
+    hits = _hits()
+    assert client.get('/events/1').data == first and _hits() == hits + 1
+    key = _event_key(1)
+    assert pagecache.cache.get(key) == first
+
+    # Adding a contribution: new key, fresh page
+    _post(client, '/events/1/contributions/add', {'volunteer_name': 'Bo', 'volunteer_hours': '1'})
+    assert _event_key(1) != key
+    page = client.get('/events/1').data
+    assert b'Bo' in page and page != first
+
+    # Renaming the event reaches the pages of its volunteers too
+    volunteer = client.get('/volunteers/1').data
+    assert b'Spring fair' in volunteer
+    key = _event_key(1)
+    _post(client, '/events/1/edit', {'event_name': 'Summer fair', 'event_date': '2024-02-01'})
+    assert _event_key(1) != key
+    assert b'Summer fair' in client.get('/events/1').data
+    assert b'Summer fair' in client.get('/volunteers/1').data
+
+    # A deleted volunteer's cached page is not served again
+    _post(client, '/volunteers/1/delete')
+    response = client.get('/volunteers/1')
+    assert response.status_code == 302
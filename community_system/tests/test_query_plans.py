@@ -0,0 +1,70 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+import archive
+import database
+import queries
+
+HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def conn(db_path):
+    """A database with one archived year of some size, so partition unions
+    are real unions and the planner has realistic statistics for both sides"""
+    conn = database.connect()
+    with database.transaction(conn):
+        conn.executemany('INSERT INTO volunteers (name) VALUES (?)', [(f'V{n}',) for n in range(200)])
+        conn.executemany("INSERT INTO event_profiles (event_name, event_date, quarter) VALUES (?, ?, ?)",
+                         [(f'E{n}', f'{year}-02-{n % 28 + 1:02d}', f'{year}Q1')
+                          for year in (2020, 2024) for n in range(300)])
+        conn.execute("""
+            INSERT INTO contributions (event_id, volunteer_id, volunteer_name, volunteer_hours)
+            SELECT ep.id, v.id, v.name, 1 FROM event_profiles ep JOIN volunteers v ON v.id % 50 = ep.id % 50
+        """)
+    conn.execute('ANALYZE')
+    archive.close_quarter(conn, '2020Q1')
+    yield conn
+    conn.close()
+
+
+def test_hot_queries_use_indexes(conn):
+    results = {name: (plan, ok) for name, plan, ok in database.check_query_plans(conn)}
+    assert 'event_page next page' in results and 'archived quarter report' in results
+    statements = {name: sql for name, sql, params in queries.hot_queries(conn.cursor())}
+    assert 'UNION ALL' in statements['volunteer contributions']
+    # main and the archive are each searched through the volunteer index
+    plan = results['volunteer contributions'][0]
+    assert sum(detail.startswith('SEARCH c USING INDEX idx_contributions_volunteer') for detail in plan) == 2
+    scans = {name: plan for name, (plan, ok) in results.items() if not ok}
+    assert scans == {}
+
+
+def test_explain_fails_on_a_scan(conn, db_path):
+    env = dict(os.environ, COMMUNITY_DB=db_path, ASSETS_CDN_FALLBACK='1')
+    command = [sys.executable, 'database.py', '--explain']
+    assert subprocess.run(command, cwd=HERE, env=env, capture_output=True).returncode == 0
+
+    conn.execute('DROP INDEX idx_contributions_volunteer')
+    conn.commit()
+    assert not dict((name, ok) for name, plan, ok in database.check_query_plans(conn))['volunteer contributions']
+    result = subprocess.run(command, cwd=HERE, env=env, capture_output=True, text=True)
+    assert result.returncode == 1
+    assert 'SCAN volunteer contributions' in result.stdout
+
+
+def test_aliases_do_not_carry_over_between_queries(db_path, monkeypatch):
+    # `v` is an alias for contributions in the first statement only; the
+    # second scans a small CTE of the same name
+    monkeypatch.setattr(queries, 'hot_queries', lambda cursor: [
+        ('first', 'SELECT * FROM contributions v WHERE v.id = ?', (1,)),
+        ('second', 'WITH v AS MATERIALIZED (SELECT 1 AS id) SELECT * FROM v', ()),
+    ])
+    conn = database.connect()
+    results = {name: (plan, ok) for name, plan, ok in database.check_query_plans(conn)}
+    conn.close()
+    assert any(detail.startswith('SCAN v') for detail in results['second'][0])
+    assert results['first'][1] and results['second'][1]
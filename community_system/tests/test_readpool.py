@@ -0,0 +1,17 @@
+from flask import g
+
+import app as app_module
+import database
+import instrumentation
+import readpool
+
+
+def test_pool_queries_are_traced(db_path, monkeypatch):
+    monkeypatch.setenv('COMMUNITY_READ_POOL', '1')
+    monkeypatch.setattr(database, 'connection_wrapper', instrumentation.TracedConnection)
+    with app_module.app.test_request_context('/'):
+        g.sql_statements = []
+        rows = readpool.run('list', lambda cursor: cursor.execute('SELECT COUNT(*) FROM volunteers').fetchall())
+        assert rows[0][0] == 0
+        assert [s['sql'] for s in g.sql_statements] == ['SELECT COUNT(*) FROM volunteers']
+        assert g.sql_statements[0]['rows'] == 1
@@ -0,0 +1,55 @@
+import time
+
+import database
+import jobs
+import pagecache
+
+
+def _add_event(client, name='Spring Fair', date='2024-02-10'):
+    client.post('/events/add', data={'event_name': name, 'event_date': date, 'actual_participants': '5'},
+                follow_redirects=True)
+
+
+def test_report_runs_inline_without_a_worker(client):
+    _add_event(client)
+    response = client.post('/reports/generate', data={'quarter': '2024Q1'})
+    assert response.status_code == 200
+    assert b'Spring Fair' in response.data
+    hits = pagecache.cache.stats()['hits']
+    again = client.post('/reports/generate', data={'quarter': '2024Q1'})
+    assert again.data == response.data
+    assert pagecache.cache.stats()['hits'] == hits + 1
+
+
+def test_report_is_queued_while_a_worker_runs(client, monkeypatch):
+    monkeypatch.setattr(jobs, 'POLL_INTERVAL', 0.05)
+    _add_event(client)
+    worker = jobs.Worker(threads=1, recurring=False).start()
+    try:
+        conn = database.connect()
+        deadline = time.monotonic() + 5
+        while not jobs.workers_alive(conn.cursor()) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        response = client.post('/reports/generate', data={'quarter': '2024Q1'})
+        assert response.status_code == 302
+        assert '/jobs/' in response.headers['Location']
+        page = client.get(response.headers['Location'], follow_redirects=True)
+        while b'Spring Fair' not in page.data and time.monotonic() < deadline:
+            time.sleep(0.05)
+            page = client.get(response.headers['Location'], follow_redirects=True)
+        assert b'Spring Fair' in page.data
+        # The rendered result is cached under the report's key
+        assert client.post('/reports/generate', data={'quarter': '2024Q1'}).data == page.data
+    finally:
+        worker.stop(timeout=5)
+    assert not jobs.workers_alive(conn.cursor())
+    conn.close()
+
+
+def test_job_page_warns_when_no_worker_is_running(client):
+    conn = database.connect()
+    job = jobs.submit(conn, 'analyze')
+    conn.close()
+    status = client.get(f"/jobs/{job['id']}", headers={'Accept': 'application/json'}).get_json()
+    assert status['status'] == 'queued' and status['workers_alive'] is False
+    assert b'No job worker is running' in client.get(f"/jobs/{job['id']}").data
@@ -0,0 +1,84 @@
+import json
+
+import pytest
+
+import database
+import jobs
+import rollups
+
+
+def _event(client, **form):
+    response = client.post('/events/add', data=form)
+    return int(response.headers['Location'].split('/')[-2])
+
+
+def test_incremental_rollups_match_rebuild(client):
+    conn = database.connect()
+
+    def no_drift():
+        with database.transaction(conn):
+            assert rollups.rebuild_rollups(conn) == []
+
+    def quarter(name):
+        totals = rollups.get_quarter_totals(conn.cursor(), name)
+        return totals and (totals['total_events'], totals['total_participants'], totals['total_volunteer_hours'],
+                           totals['total_cash_donations'], totals['total_material_value'])
+
+    client.post('/event-types/add', data={'name': 'Fair'})
+    type_id = conn.execute("SELECT id FROM event_types WHERE name = 'Fair'").fetchone()[0]
+    client.post('/organizations/add', data={'name': 'Org'})
+    first = _event(client, event_name='Spring', event_date='2024-02-01', event_type_id='1',
+                   organization_id='1', actual_participants='10')
+    second = _event(client, event_name='Summer', event_date='2024-05-01', event_type_id=str(type_id),
+                    actual_participants='4')
+    no_drift()
+
+    client.post(f'/events/{first}/contributions/add',
+                data={'volunteer_name': 'Ann', 'volunteer_hours': '2.5', 'cash_donation': '10', 'material_value': '5'})
+    client.post(f'/events/{first}/contributions/add', data={'volunteer_name': 'Bo', 'volunteer_hours': '1'})
+    client.post(f'/events/{second}/contributions/add', data={'volunteer_name': 'Cy', 'cash_donation': '7'})
+    no_drift()
+    assert quarter('2024Q1') == (1, 10, 3.5, 10, 5)
+
+    # Moving an event to another quarter and type moves its contributions too
+    client.post(f'/events/{first}/edit', data={'event_name': 'Spring', 'event_date': '2024-04-15',
+                                               'event_type_id': str(type_id), 'actual_participants': '12'})
+    no_drift()
+    assert not quarter('2024Q1') or quarter('2024Q1') == (0, 0, 0, 0, 0)
+    assert quarter('2024Q2') == (2, 16, 3.5, 17, 5)
+    breakdown = {row['name']: row['count'] for row in rollups.get_type_breakdown(conn.cursor(), '2024Q2')}
+    assert breakdown == {'Fair': 2}
+
+    contribution = conn.execute('SELECT id FROM contributions WHERE volunteer_name = ?', ('Bo',)).fetchone()[0]
+    client.post(f'/contributions/{contribution}/delete')
+    no_drift()
+    assert quarter('2024Q2') == (2, 16, 2.5, 17, 5)
+
+    client.post(f'/event-types/{type_id}/delete')
+    no_drift()
+    breakdown = {row['name']: row['count'] for row in rollups.get_type_breakdown(conn.cursor(), '2024Q2')}
+    assert breakdown == {None: 2}
+    client.post(f'/events/{second}/delete')
+    no_drift()
+    assert quarter('2024Q2') == (1, 12, 2.5, 10, 5)
+    conn.close()
+
+
+def test_rebuild_commits_with_its_caller(client):
+    client.post('/events/add', data={'event_name': 'Fair', 'event_date': '2024-02-01', 'actual_participants': '5'})
+    conn = database.connect()
+    with database.transaction(conn):
+        conn.execute('UPDATE quarterly_summaries SET total_events = 9')
+
+    # A failure after the rebuild rolls the replaced rows back with it
+    with pytest.raises(RuntimeError):
+        with database.transaction(conn):
+            assert len(rollups.rebuild_rollups(conn)) == 1
+            raise RuntimeError
+    assert conn.execute('SELECT total_events FROM quarterly_summaries').fetchone()[0] == 9
+
+    job = jobs.submit(conn, 'rebuild_rollups')
+    assert jobs.run_pending() == 1
+    assert json.loads(jobs.get(conn.cursor(), job['id'])['result']) == {'drifted_rows': 1}
+    assert conn.execute('SELECT total_events FROM quarterly_summaries').fetchone()[0] == 1
+    conn.close()
@@ -0,0 +1,85 @@
+import pytest
+
+import database
+import search
+
+
+def _titles(text, kind='events'):
+    conn = database.connect()
+    try:
+        return [row['title'] for row in search.search(conn.cursor(), text).get(kind, [])]
+    finally:
+        conn.close()
+
+
+def _contribution_id():
+    conn = database.connect()
+    try:
+        return conn.execute('SELECT MAX(id) FROM contributions').fetchone()[0]
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def events(client):
+    for name in ('Harvest Festival', 'Near the River Cleanup', 'X-Ray Drive', 'Winter <b>Coat</b> Drive'):
+        client.post('/events/add', data={'event_name': name, 'event_date': '2024-02-01'})
+    return client
+
+
+def test_words_match_as_prefixes_in_any_order(events):
+    assert _titles('harv') == ['Harvest Festival']
+    assert _titles('fest HARV') == ['Harvest Festival']
+    assert _titles('harv river') == []
+    assert sorted(_titles('dri')) == ['Winter <b>Coat</b> Drive', 'X-Ray Drive']
+
+
+@pytest.mark.parametrize('text', ['"', '""', 'NEAR', 'NEAR(river clean)', '-ray', 'x-ray', 'river OR harvest',
+                                  'AND', 'NOT harvest', '*', 'event_name:harvest', '(', 'river^', "o'brien"])
+def test_operators_in_input_are_literal(events, text):
+    # Never an FTS5 syntax error, and operator words are searched as words
+    results = _titles(text)
+    assert isinstance(results, list)
+    assert events.get('/search', query_string={'q': text}).status_code == 200
+
+
+def test_operator_words_are_searched_as_words(events):
+    assert _titles('NEAR') == ['Near the River Cleanup']
+    assert _titles('river OR harvest') == []
+    assert _titles('x-ray') == ['X-Ray Drive']
+    assert search.build_match('"') is None
+
+
+def test_snippets_are_escaped(events):
+    conn = database.connect()
+    rows = search.search(conn.cursor(), 'coat')['events']
+    conn.close()
+    assert str(rows[0]['snippet']) == 'Winter &lt;b&gt;<mark>Coat</mark>&lt;/b&gt; Drive'
+
+
+def test_index_follows_edits_and_deletes(events):
+    events.post('/events/1/edit', data={'event_name': 'Autumn Market', 'event_date': '2024-02-01'})
+    assert _titles('harvest') == []
+    assert _titles('autumn') == ['Autumn Market']
+    events.post('/events/1/delete')
+    assert _titles('autumn') == []
+
+    events.post('/volunteers/add', data={'name': 'Priya Natarajan', 'email': 'priya@example.org'})
+    assert _titles('natara', 'volunteers') == ['Priya Natarajan']
+    assert _titles('priya@example', 'volunteers') == ['Priya Natarajan']
+    conn = database.connect()
+    with database.transaction(conn):
+        conn.execute("UPDATE volunteers SET name = 'Priya Rao' WHERE id = 1")
+    conn.close()
+    assert _titles('natara', 'volunteers') == []
+    assert _titles('rao', 'volunteers') == ['Priya Rao']
+    events.post('/volunteers/1/delete')
+    assert _titles('priya', 'volunteers') == []
+
+    events.post('/events/2/contributions/add',
+                data={'volunteer_name': 'Bo', 'material_description': 'wool blankets', 'material_value': '5'})
+    assert _titles('blank', 'contributions') == ['Bo']
+    contribution = _contribution_id()
+    events.post(f'/contributions/{contribution}/delete')
+    assert _titles('blank', 'contributions') == []
+
@@ -0,0 +1,64 @@
+import sqlite3
+import threading
+
+import pytest
+
+import contribution_writes
+import database
+import stress
+import totals
+
+THREADS = 8
+INSERTS = 50
+
+
+@pytest.fixture
+def events(db_path):
+    conn = database.connect()
+    with database.transaction(conn):
+        conn.executemany('INSERT INTO event_profiles (event_name, event_date, quarter) VALUES (?, ?, ?)',
+                         [(f'Event {n}', f'2024-05-{n + 1:02d}', '2024Q2') for n in range(10)])
+    ids = [row[0] for row in conn.execute('SELECT id FROM event_profiles ORDER BY id')]
+    conn.close()
+    return ids
+
+
+def test_pooled_writers_lose_nothing(events):
+    """More writer threads than pooled connections, all inserting at once"""
+    errors = []
+    start = threading.Barrier(THREADS)
+
+    def write(thread_number):
+        start.wait()
+        for i in range(INSERTS):
+            params = (events[(thread_number + i) % len(events)], None, 'Stress', None, 1, 0, None, 0)
+            conn = database.pool.acquire()
+            try:
+                contribution_writes.add(conn, params)
+            except sqlite3.OperationalError as e:
+                errors.append(str(e))
+            finally:
+                database.pool.release(conn)
+
+    threads = [threading.Thread(target=write, args=(n,)) for n in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    conn = database.connect()
+    assert conn.execute('SELECT COUNT(*) FROM contributions').fetchone()[0] == THREADS * INSERTS
+    assert tuple(conn.execute('SELECT SUM(contribution_count), SUM(total_hours) FROM event_profiles').fetchone()) == (
+        THREADS * INSERTS, THREADS * INSERTS)
+    assert totals.check_totals(conn) == []
+    conn.close()
+
+
+@pytest.mark.slow
+@pytest.mark.parametrize('mode', ['immediate', 'group'])
+def test_worker_processes_lose_nothing(events, db_path, mode):
+    """stress.py's write modes, several processes of several threads each"""
+    result = stress.run_mode(db_path, mode, processes=3, threads=4, inserts=40)
+    assert result['lock_errors'] == 0
+    assert result['committed'] == result['attempted'] == 3 * 4 * 40
@@ -0,0 +1,55 @@
+import database
+import totals
+
+
+def _row(conn, table, row_id):
+    return tuple(conn.execute(f'SELECT {", ".join(totals.COLUMNS)} FROM {table} WHERE id = ?', (row_id,)).fetchone())
+
+
+def test_triggers_keep_totals_through_volunteer_delete(client):
+    conn = database.connect()
+    client.post('/volunteers/add', data={'name': 'Ann'})
+    client.post('/volunteers/add', data={'name': 'Bo'})
+    for date in ('2024-02-01', '2024-03-01'):
+        client.post('/events/add', data={'event_name': f'Fair {date}', 'event_date': date})
+    for event_id, volunteer_id, hours, cash in ((1, 1, '2', '10'), (2, 1, '3', '0'), (2, 2, '1.5', '4')):
+        client.post(f'/events/{event_id}/contributions/add',
+                    data={'volunteer_id': str(volunteer_id), 'volunteer_name': '', 'volunteer_hours': hours,
+                          'cash_donation': cash})
+    assert totals.check_totals(conn) == []
+    assert _row(conn, 'volunteers', 1) == (5, 10, 0, 2)
+    assert _row(conn, 'event_profiles', 2) == (4.5, 4, 0, 2)
+
+    # Updating a contribution moves its amounts between rows
+    with database.transaction(conn):
+        conn.execute('UPDATE contributions SET volunteer_id = 2, volunteer_hours = 4 WHERE event_id = 1')
+    assert totals.check_totals(conn) == []
+    assert _row(conn, 'volunteers', 1) == (3, 0, 0, 1)
+    assert _row(conn, 'volunteers', 2) == (5.5, 14, 0, 2)
+
+    # Deleting a volunteer nulls volunteer_id on their contributions; the
+    # events keep their totals and the other volunteer is untouched
+    client.post('/volunteers/2/delete')
+    assert conn.execute('SELECT COUNT(*) FROM contributions WHERE volunteer_id IS NULL').fetchone()[0] == 2
+    assert totals.check_totals(conn) == []
+    assert _row(conn, 'event_profiles', 1) == (4, 10, 0, 1)
+    assert _row(conn, 'event_profiles', 2) == (4.5, 4, 0, 2)
+    assert _row(conn, 'volunteers', 1) == (3, 0, 0, 1)
+
+    contribution = conn.execute('SELECT id FROM contributions WHERE volunteer_id = 1').fetchone()[0]
+    client.post(f'/contributions/{contribution}/delete')
+    assert totals.check_totals(conn) == []
+    assert _row(conn, 'volunteers', 1) == (0, 0, 0, 0)
+    conn.close()
+
+
+def test_check_totals_reports_and_repairs_drift(client):
+    conn = database.connect()
+    client.post('/events/add', data={'event_name': 'Fair', 'event_date': '2024-02-01'})
+    client.post('/events/1/contributions/add', data={'volunteer_name': 'Ann', 'volunteer_hours': '2'})
+    with database.transaction(conn):
+        conn.execute('UPDATE event_profiles SET total_hours = 7 WHERE id = 1')
+    assert totals.check_totals(conn) == [('event_profiles', 1, (7, 0, 0, 1), (2, 0, 0, 1))]
+    totals.check_totals(conn, repair=True)
+    assert totals.check_totals(conn) == []
+    conn.close()
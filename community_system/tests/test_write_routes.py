@@ -0,0 +1,62 @@
+import database
+
+
+def _flashes(client):
+    with client.session_transaction() as session:
+        return session.pop('_flashes', [])
+
+
+def _count(table):
+    conn = database.connect()
+    try:
+        return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _add_event(client, **fields):
+    data = {'event_name': 'Food Drive', 'event_date': '2024-03-01', **fields}
+    response = client.post('/events/add', data=data)
+    _flashes(client)
+    return int(response.headers['Location'].split('/')[-2])
+
+
+def test_add_contribution_to_deleted_event(client):
+    event_id = _add_event(client)
+    client.post(f'/events/{event_id}/delete')
+    _flashes(client)
+    response = client.post(f'/events/{event_id}/contributions/add',
+                           data={'volunteer_name': 'Ann', 'volunteer_hours': '2'})
+    assert response.status_code == 302
+    assert _flashes(client) == [('error', 'That event or volunteer no longer exists')]
+    assert _count('contributions') == 0
+
+
+def test_add_contribution_with_deleted_volunteer(client):
+    event_id = _add_event(client)
+    response = client.post(f'/events/{event_id}/contributions/add',
+                           data={'volunteer_id': '999', 'volunteer_name': 'Ann'})
+    assert response.status_code == 302
+    assert _flashes(client) == [('error', 'That event or volunteer no longer exists')]
+    assert _count('contributions') == 0
+
+
+def test_edit_event_with_unknown_event_type(client):
+    event_id = _add_event(client)
+    response = client.post(f'/events/{event_id}/edit',
+                           data={'event_name': 'Renamed', 'event_date': '2024-03-01', 'event_type_id': '999'})
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith(f'/events/{event_id}/edit')
+    assert _flashes(client) == [('error', 'That event type or organization no longer exists')]
+    conn = database.connect()
+    event = conn.execute('SELECT event_name, event_type_id FROM event_profiles WHERE id = ?', (event_id,)).fetchone()
+    conn.close()
+    assert tuple(event) == ('Food Drive', None)
+
+
+def test_add_event_with_unknown_organization(client):
+    response = client.post('/events/add', data={'event_name': 'Ghost', 'event_date': '2024-03-01',
+                                                'organization_id': '999'})
+    assert response.status_code == 302
+    assert _flashes(client) == [('error', 'That event type or organization no longer exists')]
+    assert _count('event_profiles') == 0
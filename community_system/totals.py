@@ -0,0 +1,112 @@
+"""Running contribution totals on event_profiles and volunteers
+
+Each event and volunteer row carries total_hours, total_cash,
+total_material and contribution_count. Triggers on contributions keep them
+current on insert, update and delete (including the volunteer_id = NULL
+reassignment done when a volunteer is deleted), in the same transaction as
+the change, so pages read the totals off the row instead of summing
+contributions. check_totals() recomputes them and reports any drift.
+
+Volunteer totals are all-time: when a quarter is archived (archive.py) its
+contributions leave the hot table but stay counted on the volunteers.
+"""
+import archive
+
+TOLERANCE = 1e-6
+
+COLUMNS = ('total_hours', 'total_cash', 'total_material', 'contribution_count')
+
+# table -> contributions column that points at it
+TABLES = {'event_profiles': 'event_id', 'volunteers': 'volunteer_id'}
+
+# Per-contribution amounts, in COLUMNS order
+_AMOUNTS = ('COALESCE({row}.volunteer_hours, 0)', 'COALESCE({row}.cash_donation, 0)',
+            'COALESCE({row}.material_value, 0)', '1')
+
+_RECOMPUTE_SQL = '''
+    SELECT COALESCE(SUM(volunteer_hours), 0), COALESCE(SUM(cash_donation), 0),
+           COALESCE(SUM(material_value), 0), COUNT(*)
+    FROM contributions WHERE {key} = {table}.id
+'''
+
+
+def _adjust(table, key, row, sign):
+    """Trigger statement adding (sign '+') or removing ('-') one contribution"""
+    sets = ', '.join(f'{col} = {col} {sign} {amount.format(row=row)}'
+                     for col, amount in zip(COLUMNS, _AMOUNTS))
+    return f'UPDATE {table} SET {sets} WHERE id = {row}.{key};'
+
+
+def total_steps():
+    """Migration SQL adding the total columns, their triggers and a backfill"""
+    steps = []
+    for table, key in TABLES.items():
+        for col in COLUMNS:
+            kind = 'INTEGER' if col == 'contribution_count' else 'REAL'
+            steps.append(f'ALTER TABLE {table} ADD COLUMN {col} {kind} NOT NULL DEFAULT 0')
+        steps.append(f'UPDATE {table} SET ({", ".join(COLUMNS)}) = ({_RECOMPUTE_SQL.format(key=key, table=table)})')
+
+    add = ' '.join(_adjust(table, key, 'new', '+') for table, key in TABLES.items())
+    remove = ' '.join(_adjust(table, key, 'old', '-') for table, key in TABLES.items())
+    steps += [
+        f'CREATE TRIGGER IF NOT EXISTS contributions_totals_insert AFTER INSERT ON contributions BEGIN {add} END',
+        f'CREATE TRIGGER IF NOT EXISTS contributions_totals_delete AFTER DELETE ON contributions BEGIN {remove} END',
+        f'''CREATE TRIGGER IF NOT EXISTS contributions_totals_update
+            AFTER UPDATE OF event_id, volunteer_id, volunteer_hours, cash_donation, material_value
+            ON contributions BEGIN {remove} {add} END''',
+        # Totals changes are already counted by the contributions counter; keep
+        # the volunteers counter (and the lookup index keyed on it) for edits
+        # to the volunteer's own fields.
+        'DROP TRIGGER IF EXISTS volunteers_version_update',
+        '''CREATE TRIGGER volunteers_version_update
+           AFTER UPDATE OF name, phone, email, address, notes ON volunteers BEGIN
+               UPDATE data_versions SET version = version + 1 WHERE table_name = 'volunteers';
+           END''',
+    ]
+    return steps
+
+
+def check_totals(conn, repair=False):
+    """Recompute every running total and return the drift found.
+
+    Each drift entry is (table, id, stored_totals, expected_totals). With
+    repair=True the drifted rows are corrected and committed.
+    """
+    cursor = conn.cursor()
+    cols = ', '.join(COLUMNS)
+    drift = []
+    for table, key in TABLES.items():
+        # Summed per run of archives, since all of them may not attach at once
+        expected = {}
+        for contributions, params in archive.union_batches(
+                cursor, 'SELECT event_id, volunteer_id, volunteer_hours, cash_donation, material_value '
+                        'FROM {s}.contributions'):
+            cursor.execute(f'''
+                SELECT {key}, SUM(volunteer_hours), SUM(cash_donation), SUM(material_value), COUNT(*)
+                FROM ({contributions}) WHERE {key} IS NOT NULL GROUP BY {key}
+            ''', params)
+            for ref, *sums in map(tuple, cursor.fetchall()):
+                expected[ref] = [x + (y or 0) for x, y in zip(expected.get(ref, (0, 0, 0, 0)), sums)]
+        cursor.execute(f'SELECT id, {cols} FROM {table}')
+        for row in map(tuple, cursor.fetchall()):
+            have, want = row[1:5], tuple(expected.get(row[0], (0, 0, 0, 0)))
+            if any(abs((x or 0) - (y or 0)) > TOLERANCE for x, y in zip(have, want)):
+                drift.append((table, row[0], have, want))
+
+    if repair and drift:
+        for table, row_id, _, want in drift:
+            cursor.execute(f'UPDATE {table} SET ({cols}) = (?, ?, ?, ?) WHERE id = ?', (*want, row_id))
+        conn.commit()
+    return drift
+
+
+if __name__ == '__main__':
+    import sys
+    from database import get_db
+    conn = get_db()
+    repair = '--repair' in sys.argv
+    drift = check_totals(conn, repair=repair)
+    conn.close()
+    for table, row_id, have, want in drift:
+        print(f"Drift in {table} {row_id}: stored {have}, expected {want}")
+    print(f"{len(drift)} drifted rows{' corrected' if repair else ''}")
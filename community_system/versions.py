@@ -0,0 +1,145 @@
+"""Per-table data version counters
+
+Triggers bump `data_versions.version` for a table on every insert, update
+or delete, in the same transaction as the change. Because the counters live
+in the database, every gunicorn worker sees the same values, so reading a
+few of them is a cheap cross-process "has anything changed?" check.
+
+entity_versions narrows this to single rows: one counter per event,
+volunteer and quarter, bumped by the triggers of every write that changes
+what that entity's page shows.
+"""
+import hashlib
+
+TRACKED_TABLES = ('event_types', 'organizations', 'volunteers', 'event_profiles', 'contributions')
+
+
+def version_steps(tables=TRACKED_TABLES):
+    """Migration SQL creating the counter table and its triggers"""
+    steps = ['''
+        CREATE TABLE IF NOT EXISTS data_versions (
+            table_name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    ''']
+    for table in tables:
+        steps.append(f"INSERT OR IGNORE INTO data_versions (table_name, version) VALUES ('{table}', 0)")
+        for action in ('INSERT', 'UPDATE', 'DELETE'):
+            steps.append(f'''
+                CREATE TRIGGER IF NOT EXISTS {table}_version_{action.lower()}
+                AFTER {action} ON {table} BEGIN
+                    UPDATE data_versions SET version = version + 1 WHERE table_name = '{table}';
+                END
+            ''')
+    return steps
+
+
+# Columns of event_profiles shown on pages other than the event's own; the
+# running totals are left out because the contributions triggers already
+# bump everything a contribution change touches.
+_EVENT_COLUMNS = ('event_name, event_date, event_type_id, location, description, organization_id, '
+                  'coordinator_name, coordinator_phone, coordinator_email, expected_participants, '
+                  'actual_participants, income, expense, notes, status, quarter')
+
+
+def _bump(kind, key):
+    """Trigger statement bumping one entity version (skipped when key is NULL)"""
+    return (f"INSERT INTO entity_versions (kind, key, version) SELECT '{kind}', {key}, 1 "
+            f"WHERE {key} IS NOT NULL ON CONFLICT(kind, key) DO UPDATE SET version = version + 1;")
+
+
+def _bump_event_volunteers(event):
+    return ("INSERT INTO entity_versions (kind, key, version) "
+            f"SELECT DISTINCT 'volunteer', volunteer_id, 1 FROM contributions "
+            f"WHERE event_id = {event}.id AND volunteer_id IS NOT NULL "
+            "ON CONFLICT(kind, key) DO UPDATE SET version = version + 1;")
+
+
+def _quarter_of(row):
+    return f'(SELECT quarter FROM event_profiles WHERE id = {row}.event_id)'
+
+
+def entity_version_steps():
+    """Migration SQL for per-entity versions of events, volunteers and quarters
+
+    Pages about one event, one volunteer or one quarter are cached under
+    these, so a write only invalidates the pages that show what it changed.
+    """
+    def contribution(row):
+        return ' '.join([_bump('event', f'{row}.event_id'), _bump('volunteer', f'{row}.volunteer_id'),
+                         _bump('quarter', _quarter_of(row))])
+
+    return [
+        '''
+        CREATE TABLE IF NOT EXISTS entity_versions (
+            kind TEXT NOT NULL,
+            key TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (kind, key)
+        ) WITHOUT ROWID
+        ''',
+        f'CREATE TRIGGER IF NOT EXISTS contributions_entity_insert AFTER INSERT ON contributions '
+        f'BEGIN {contribution("new")} END',
+        f'CREATE TRIGGER IF NOT EXISTS contributions_entity_delete AFTER DELETE ON contributions '
+        f'BEGIN {contribution("old")} END',
+        f'CREATE TRIGGER IF NOT EXISTS contributions_entity_update AFTER UPDATE ON contributions '
+        f'BEGIN {contribution("old")} {contribution("new")} END',
+        f'CREATE TRIGGER IF NOT EXISTS events_entity_insert AFTER INSERT ON event_profiles '
+        f'BEGIN {_bump("event", "new.id")} {_bump("quarter", "new.quarter")} END',
+        f'CREATE TRIGGER IF NOT EXISTS events_entity_update AFTER UPDATE OF {_EVENT_COLUMNS} ON event_profiles '
+        f'BEGIN {_bump("event", "new.id")} {_bump("quarter", "old.quarter")} {_bump("quarter", "new.quarter")} END',
+        # Volunteer histories list each event's name and date
+        f'CREATE TRIGGER IF NOT EXISTS events_entity_rename AFTER UPDATE OF event_name, event_date ON event_profiles '
+        f'BEGIN {_bump_event_volunteers("new")} END',
+        f'CREATE TRIGGER IF NOT EXISTS events_entity_delete AFTER DELETE ON event_profiles '
+        f'BEGIN {_bump("event", "old.id")} {_bump("quarter", "old.quarter")} END',
+        f'CREATE TRIGGER IF NOT EXISTS volunteers_entity_update AFTER UPDATE OF name, phone, email, address, notes '
+        f'ON volunteers BEGIN {_bump("volunteer", "new.id")} END',
+        f'CREATE TRIGGER IF NOT EXISTS volunteers_entity_delete AFTER DELETE ON volunteers '
+        f'BEGIN {_bump("volunteer", "old.id")} END',
+    ]
+
+
+def get_entity_version(cursor, kind, key):
+    """Current version of one entity (0 if it was never changed)"""
+    cursor.execute('SELECT version FROM entity_versions WHERE kind = ? AND key = ?', (kind, str(key)))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def get_versions(cursor, tables):
+    """Return {table: version} for the given tables"""
+    placeholders = ', '.join('?' for _ in tables)
+    cursor.execute(f'SELECT table_name, version FROM data_versions WHERE table_name IN ({placeholders})',
+                   tuple(tables))
+    return {row[0]: row[1] for row in cursor.fetchall()}
+
+
+def etag(cursor, tables, *parts):
+    """Opaque tag that changes whenever any of tables changes or parts differ"""
+    current = get_versions(cursor, tables)
+    key = '|'.join([*(f'{t}:{current.get(t, 0)}' for t in sorted(tables)), *map(str, parts)])
+    return hashlib.sha1(key.encode()).hexdigest()[:20]
+
+
+def max_version(cursor):
+    """Highest table or entity version; restores move every counter past it"""
+    cursor.execute('SELECT MAX(v) FROM (SELECT MAX(version) AS v FROM data_versions '
+                   'UNION ALL SELECT MAX(version) FROM entity_versions)')
+    return cursor.fetchone()[0] or 0
+
+
+def entity_keys(cursor):
+    cursor.execute('SELECT kind, key FROM entity_versions')
+    return [tuple(row) for row in cursor.fetchall()]
+
+
+def advance_past(cursor, floor, keys=()):
+    """After replacing the data wholesale (backup.restore), move every
+    version above floor, so keys cached before cannot match it. keys are
+    entities known before; those the new data lacks get a version too."""
+    step = floor + 1
+    cursor.execute('UPDATE data_versions SET version = version + ?', (step,))
+    cursor.execute('UPDATE entity_versions SET version = version + ?', (step,))
+    cursor.executemany('INSERT OR IGNORE INTO entity_versions (kind, key, version) VALUES (?, ?, ?)',
+                       [(kind, key, step) for kind, key in keys])
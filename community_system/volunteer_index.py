@@ -0,0 +1,144 @@
+"""In-process prefix index for volunteer typeahead lookups
+
+Volunteers are indexed by every word of their name, their email and the
+digits of their phone number, each kept as a sorted list of (key, id) so a
+prefix lookup is a bisect plus a short forward scan. add_volunteer and
+delete_volunteer update the index in place; changes made by other workers
+or by bulk tools are detected through the volunteers data_versions counter
+and trigger a full reload on the next lookup.
+"""
+import bisect
+import re
+import threading
+
+import versions
+
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 25
+
+FIELDS = ('name', 'email', 'phone')
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _keys(field, value):
+    """Normalized index keys for one field value"""
+    if not value:
+        return []
+    if field == 'name':
+        words = _WORD_RE.findall(value.casefold())
+        # Whole name first so "mary jo" matches as typed, then each word
+        return list(dict.fromkeys([' '.join(words), *words])) if words else []
+    if field == 'phone':
+        digits = re.sub(r'\D', '', value)
+        return [digits] if digits else []
+    return [value.strip().casefold()]
+
+
+def normalize_query(text):
+    """(text key, phone digits key) for a typed query"""
+    text = ' '.join(_WORD_RE.findall((text or '').casefold()))
+    digits = re.sub(r'\D', '', text)
+    return text, digits
+
+
+class VolunteerIndex:
+    """Sorted prefix index over the volunteers table"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records = {}
+        self._sorted = {field: [] for field in FIELDS}
+        self.version = None
+
+    def _insert(self, record):
+        vol_id = record['id']
+        self._records[vol_id] = record
+        for field in FIELDS:
+            for key in _keys(field, record[field]):
+                bisect.insort(self._sorted[field], (key, vol_id))
+
+    def _delete(self, vol_id):
+        record = self._records.pop(vol_id, None)
+        if record is None:
+            return
+        for field in FIELDS:
+            entries = self._sorted[field]
+            for key in _keys(field, record[field]):
+                i = bisect.bisect_left(entries, (key, vol_id))
+                if i < len(entries) and entries[i] == (key, vol_id):
+                    del entries[i]
+
+    def load(self, cursor):
+        """Rebuild the index from the volunteers table"""
+        version = versions.get_versions(cursor, ['volunteers']).get('volunteers')
+        cursor.execute('SELECT id, name, email, phone FROM volunteers')
+        records = {}
+        entries = {field: [] for field in FIELDS}
+        for row in cursor.fetchall():
+            record = {'id': row['id'], 'name': row['name'], 'email': row['email'], 'phone': row['phone']}
+            records[row['id']] = record
+            for field in FIELDS:
+                entries[field].extend((key, row['id']) for key in _keys(field, record[field]))
+        for field in FIELDS:
+            entries[field].sort()
+        with self._lock:
+            self._records = records
+            self._sorted = entries
+            self.version = version
+
+    def _sync(self, cursor):
+        current = versions.get_versions(cursor, ['volunteers']).get('volunteers')
+        if current != self.version:
+            self.load(cursor)
+
+    def _after_write(self, cursor, previous_version):
+        # Only our own change since we were current: keep the incremental update
+        current = versions.get_versions(cursor, ['volunteers']).get('volunteers')
+        if previous_version is not None and current == previous_version + 1:
+            self.version = current
+        else:
+            self.version = None
+
+    def add(self, cursor, vol_id, name, email=None, phone=None):
+        """Record a volunteer just committed by this worker"""
+        with self._lock:
+            previous = self.version
+            self._delete(vol_id)
+            self._insert({'id': vol_id, 'name': name, 'email': email, 'phone': phone})
+            self._after_write(cursor, previous)
+
+    def remove(self, cursor, vol_id):
+        """Forget a volunteer just deleted by this worker"""
+        with self._lock:
+            previous = self.version
+            self._delete(vol_id)
+            self._after_write(cursor, previous)
+
+    def _scan(self, field, prefix, found, limit):
+        entries = self._sorted[field]
+        i = bisect.bisect_left(entries, (prefix,))
+        while i < len(entries) and len(found) < limit:
+            key, vol_id = entries[i]
+            if not key.startswith(prefix):
+                break
+            found.setdefault(vol_id, None)
+            i += 1
+
+    def lookup(self, cursor, text, limit=DEFAULT_LIMIT):
+        """Top matches for a name, email or phone prefix, name matches first"""
+        limit = max(1, min(limit, MAX_LIMIT))
+        prefix, digits = normalize_query(text)
+        if not prefix:
+            return []
+        self._sync(cursor)
+        with self._lock:
+            found = {}
+            self._scan('name', prefix, found, limit)
+            self._scan('email', (text or '').strip().casefold(), found, limit)
+            if digits:
+                self._scan('phone', digits, found, limit)
+            return [dict(self._records[vol_id]) for vol_id in found if vol_id in self._records]
+
+
+index = VolunteerIndex()